@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# @Author: Olivier Watté <user>
+# @Date:   2026-10-17T09:00:00-04:00
+# @Email:  owatte@ipeos.com
+# @Last modified by:   user
+# @Last modified time: 2026-10-17T09:00:00-04:00
+# @License: GPLv3
+# @Copyright: Olivier Watté
+
+# Rlieh-pwm provides an interface to manage PWM on RLIEH systems.
+# Copyright (C) 2017 Olivier Watte
+#
+# This file is part of rlieh-pwm.
+#
+# Rlieh-pwm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rlieh-pwm is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rlieh-pwm.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+    This module runs many rlieh-pwm commands in one process.
+
+    Commands are read from a file or stdin, one per line, with the
+    syntax of the daemon commands (see rlieh_pwm.daemon):
+
+        # living room
+        set 42 18
+        on 23
+        range 0 100 24 0.5
+        fx-light sunset 16 30
+
+    Commands share the RliehPWM instances and the pi-blaster device of a
+    daemon Controller, and run in order, as a loop of rlieh-pwm
+    commands would: a command on a pin waits for the end of its running
+    transition, while the other pins go on. 'stop' ends the running
+    transition of its pin at once. Values written during the same PWM
+    tick are sent to pi-blaster as one frame, so a hundred 'set' lines
+    cost one write.
+
+    'get' and 'metrics' replies are printed on stdout, errors on stderr
+    with their line number. The batch ends when the input is exhausted
+    and every transition is over.
+
+    Usage:
+
+    $ printf 'set 42 18\\non 23\\n' | rlieh-pwm batch
+"""
+import asyncio
+import sys
+import threading
+
+from time import perf_counter
+
+from rlieh_pwm.core import BlasterWriter, DeviceWriter, METRICS
+from rlieh_pwm.daemon import Controller
+
+__all__ = ['FrameBuffer', 'run']
+
+# position of the GPIO argument of the commands waiting for the running
+# transition of their pin
+PIN_ARGUMENTS = {'set': 2, 'on': 1, 'off': 1, 'range': 3, 'fx-light': 2,
+                 'fx-storm': 1, 'get': 1}
+
+
+class FrameBuffer(BlasterWriter):
+    """Collects the values written during a tick, flushed as one frame.
+
+    The latest value of a pin written during the tick wins. The pins
+    metrics count the values flushed to the writer, and the replaced
+    ones as dropped.
+
+    Attributes:
+        - writer (BlasterWriter): writer receiving the frames.
+        - frames (int): frames sent to the writer.
+    """
+
+    metered = True
+
+    def __init__(self, writer, metrics=None):
+        '''
+        Args:
+            writer (BlasterWriter): writer receiving the frames
+            metrics (Metrics): pins metrics registry (default: METRICS)
+        '''
+        self.writer = writer
+        self.resolution = writer.resolution
+        self.frequency = writer.frequency
+        self.metrics = metrics
+        self.frames = 0
+        self._pending = {}
+
+    def write(self, pin, value):
+        self.write_frame(((pin, value),))
+
+    def write_frame(self, frame):
+        pending = self._pending
+        for pin, value in frame:
+            if pin in pending:
+                (self.metrics or METRICS).pin(pin).dropped += 1
+            pending[pin] = value
+
+    def flush(self, timeout=None):
+        '''send the values of the tick to the writer.'''
+        if self._pending:
+            frame, self._pending = list(self._pending.items()), {}
+            metrics = self.metrics or METRICS
+            start = perf_counter()
+            try:
+                self.writer.write_frame(frame)
+            except OSError:
+                for pin, _value in frame:
+                    metrics.pin(pin).failed += 1
+                raise
+            self.frames += 1
+            if not self.writer.metered:
+                latency = perf_counter() - start
+                for pin, _value in frame:
+                    pin_metrics = metrics.pin(pin)
+                    pin_metrics.writes += 1
+                    pin_metrics.latency.observe(latency)
+        return self.writer.flush(timeout)
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+def _read_lines(stream, loop, lines):
+    '''reader thread: queue the lines of stream, then None.'''
+    try:
+        for line in stream:
+            loop.call_soon_threadsafe(lines.put_nowait, line)
+    finally:
+        loop.call_soon_threadsafe(lines.put_nowait, None)
+
+
+def _pins(args):
+    '''get the pins of a command, see PIN_ARGUMENTS.'''
+    position = PIN_ARGUMENTS.get(args[0])
+    if args[0] == 'frame':
+        pins = [arg.partition('=')[0] for arg in args[1:]]
+    elif position is not None and position < len(args):
+        pins = [args[position]]
+    else:
+        pins = []
+    try:
+        return [int(pin) for pin in pins]
+    except ValueError:
+        # reported by the command
+        return []
+
+
+async def _wait_transitions(controller, pins):
+    '''wait for the running transitions of pins to end.'''
+    tasks = [controller.tasks[pin] for pin in pins if pin in controller.tasks]
+    if tasks:
+        await asyncio.wait(tasks)
+
+
+async def _execute(stream, controller, output, errors):
+    '''execute the commands of stream, then wait for the transitions.
+
+    Returns:
+        int: number of failed commands
+    '''
+    loop = asyncio.get_running_loop()
+    lines = asyncio.Queue()
+    reader = threading.Thread(target=_read_lines, args=(stream, loop, lines),
+                              daemon=True)
+    reader.start()
+    failed = number = 0
+    line = await lines.get()
+    while line is not None:
+        number += 1
+        command = line.split('#', 1)[0].strip()
+        if command:
+            await _wait_transitions(controller, _pins(command.split()))
+            reply = await controller.execute(command)
+            if reply.startswith('error'):
+                failed += 1
+                print('line {}: {}'.format(number, reply), file=errors)
+            elif reply != 'ok':
+                print(reply[3:], file=output)
+        # lines already read run in the same tick
+        line = lines.get_nowait() if not lines.empty() else await lines.get()
+    await controller.wait()
+    return failed
+
+
+async def _flush(buffer):
+    '''send the buffered values on each PWM tick.'''
+    while True:
+        await asyncio.sleep(1. / buffer.frequency)
+        buffer.flush()
+
+
+async def _batch(stream, controller, buffer, output, errors):
+    executing = asyncio.ensure_future(
+        _execute(stream, controller, output, errors))
+    flushing = asyncio.ensure_future(_flush(buffer))
+    await asyncio.wait([executing, flushing],
+                       return_when=asyncio.FIRST_COMPLETED)
+    for task in [executing, flushing] + list(controller.tasks.values()):
+        task.cancel()
+    if flushing.done() and not flushing.cancelled():
+        # the device failed
+        flushing.result()
+    return executing.result()
+
+
+def run(stream, writer=None, output=None, errors=None, **kwargs):
+    '''run the commands of a stream.
+
+    Args:
+        stream: text file of commands
+        writer (BlasterWriter): pi-blaster write backend
+            (default: DeviceWriter on /dev/pi-blaster)
+        output: text file of get replies (default: stdout)
+        errors: text file of error messages (default: stderr)
+        **kwargs: extra Controller arguments (pwm_thresholds, log_level,
+            log_path, metrics, state, locks)
+
+    Returns:
+        int: number of failed commands
+
+    Raises:
+        OSError: pi-blaster write failed
+    '''
+    if writer is None:
+        writer = DeviceWriter()
+    buffer = FrameBuffer(writer, kwargs.get('metrics'))
+    controller = Controller(writer=buffer, **kwargs)
+    try:
+        return asyncio.run(_batch(stream, controller, buffer,
+                                  output or sys.stdout,
+                                  errors or sys.stderr))
+    finally:
+        buffer.flush()
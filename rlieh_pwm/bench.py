@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# @Author: Olivier Watté <user>
+# @Date:   2026-10-17T09:00:00-04:00
+# @Email:  owatte@ipeos.com
+# @Last modified by:   user
+# @Last modified time: 2026-10-17T09:00:00-04:00
+# @License: GPLv3
+# @Copyright: Olivier Watté
+
+# Rlieh-pwm provides an interface to manage PWM on RLIEH systems.
+# Copyright (C) 2017 Olivier Watte
+#
+# This file is part of rlieh-pwm.
+#
+# Rlieh-pwm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rlieh-pwm is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rlieh-pwm.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+    This module benchmarks the RLIEH PWM write path and transition engine.
+
+    Benchmarks run against a stand-in for /dev/pi-blaster: a temporary
+    file (default), a temporary FIFO drained by a thread, or any given
+    device path. Results are a JSON document, to compare releases and
+    Raspberry Pi models:
+        - writes: single value writes per second and latency percentiles
+        - frames: 8 channels frame writes per second and latency
+        - schedules: writes, skipped steps and lateness of standard
+          transitions run on the real clock
+        - construction: RliehPWM instance creation cost
+        - metrics: cost of recording a write and a scheduled step
+        - locks: uncontended cost of the pin locks
+        - dither: cost of a dithering tick of 8 channels
+        - sysfs: single value writes through the sysfs hardware PWM
+          backend (fake /sys/class/pwm tree unless a path is given), to
+          compare with the pi-blaster writes
+        - cold_start: CLI start-up time
+
+    Usage:
+
+    $ rlieh-pwm bench --fifo --output=bench.json
+"""
+from contextlib import contextmanager
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from time import monotonic, perf_counter
+
+from rlieh_pwm import __version__
+from rlieh_pwm.core import (BlasterWriter, DeviceWriter, DitherWriter,
+                            ENVELOPES, PinLocks, PinMetrics, RliehPWM,
+                            RliehPWMGroup, SysfsPWMWriter)
+
+__all__ = ['run']
+
+# pins of the 8 channels frame
+FRAME_PINS = [12, 15, 16, 18, 22, 24, 32, 33]
+
+
+def percentiles(samples, points=(50, 90, 99)):
+    '''summarize samples.
+
+    Args:
+        samples (list): measures
+        points (tuple): percentiles to report
+
+    Returns:
+        dict: 'p50'... percentiles, 'max' and 'mean' of samples
+    '''
+    samples = sorted(samples)
+    if not samples:
+        return {}
+    summary = dict(('p{}'.format(point),
+                    samples[min(len(samples) - 1,
+                                len(samples) * point // 100)])
+                   for point in points)
+    summary['max'] = samples[-1]
+    summary['mean'] = sum(samples) / len(samples)
+    return summary
+
+
+@contextmanager
+def stand_in(fifo=False):
+    '''temporary /dev/pi-blaster stand-in.
+
+    Args:
+        fifo (bool): use a FIFO drained by a thread instead of a file
+
+    Yields:
+        str: stand-in path
+    '''
+    directory = tempfile.mkdtemp(prefix='rlieh-bench-')
+    path = os.path.join(directory, 'pi-blaster')
+    drain = None
+    try:
+        if fifo:
+            os.mkfifo(path)
+
+            def reader():
+                with open(path, 'rb') as f:
+                    while f.read(65536):
+                        pass
+            drain = threading.Thread(target=reader, daemon=True)
+            drain.start()
+        else:
+            open(path, 'w').close()
+        yield path
+    finally:
+        if drain is not None and drain.is_alive():
+            # wakes the reader up if the FIFO was never opened for writing
+            try:
+                os.close(os.open(path, os.O_WRONLY | os.O_NONBLOCK))
+            except OSError:
+                pass
+            drain.join(1)
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+class _TimedWriter(BlasterWriter):
+    """Forwards writes to a writer, recording their time."""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.resolution = writer.resolution
+        self.frequency = writer.frequency
+        self.times = []
+
+    def write(self, pin, value):
+        self.writer.write(pin, value)
+        self.times.append(monotonic())
+
+    def write_frame(self, frame):
+        self.writer.write_frame(frame)
+        self.times.append(monotonic())
+
+    def close(self):
+        self.writer.close()
+
+
+def bench_writes(writer, count, pin=18):
+    '''time single value writes on a pin.
+
+    Returns:
+        dict: writes per second and latency percentiles (microseconds)
+    '''
+    latencies = []
+    start = perf_counter()
+    for index in range(count):
+        before = perf_counter()
+        writer.write(pin, (index % 1000) / 1000.)
+        latencies.append((perf_counter() - before) * 1e6)
+    elapsed = perf_counter() - start
+    return {'count': count, 'per_second': count / elapsed,
+            'latency_us': percentiles(latencies)}
+
+
+def bench_frames(writer, count):
+    '''time 8 channels frame writes.
+
+    Returns:
+        dict: frames per second and latency percentiles (microseconds)
+    '''
+    group = RliehPWMGroup(FRAME_PINS, writer=writer)
+    latencies = []
+    start = perf_counter()
+    for index in range(count):
+        value = (index % 1000) / 10.
+        before = perf_counter()
+        group.frame = [value] * len(FRAME_PINS)
+        latencies.append((perf_counter() - before) * 1e6)
+    elapsed = perf_counter() - start
+    return {'count': count, 'channels': len(FRAME_PINS),
+            'per_second': count / elapsed,
+            'latency_us': percentiles(latencies)}
+
+
+def bench_schedules(writer, scale=1.):
+    '''run standard transitions on the real clock.
+
+    Args:
+        writer (BlasterWriter): device writer
+        scale (float): transitions duration factor
+
+    Returns:
+        dict: per transition writes, skipped steps, lateness percentiles
+              (milliseconds) and duration error (seconds)
+    '''
+    transitions = {
+        'linear_0_100_1s': lambda pwm: pwm.modulate(0, 100, scale / 60.),
+        'log_100_0_2s': lambda pwm: pwm.modulate(100, 0, 2 * scale / 60.,
+                                                 curve='log'),
+        'noon_2s': lambda pwm: pwm.play(ENVELOPES['noon'], 2 * scale / 60.),
+    }
+    results = {}
+    for name, transition in sorted(transitions.items()):
+        timed = _TimedWriter(writer)
+        pwm = RliehPWM(writer=timed, log_level='critical',
+                       log_path=tempfile.gettempdir())
+        start = monotonic()
+        report = transition(pwm)
+        elapsed = monotonic() - start
+        results[name] = {'writes': report.writes, 'skipped': report.skipped,
+                         'max_lateness_ms': report.max_lateness * 1e3,
+                         'duration_s': elapsed,
+                         'write_interval_ms': percentiles(
+                             [(b - a) * 1e3 for a, b
+                              in zip(timed.times, timed.times[1:])])}
+    return results
+
+
+def bench_construction(count):
+    '''time RliehPWM instances creation.
+
+    Returns:
+        dict: creation time percentiles (microseconds)
+    '''
+    writer = DeviceWriter(os.devnull)
+    log_path = tempfile.gettempdir()
+    durations = []
+    for _index in range(count):
+        before = perf_counter()
+        RliehPWM(writer=writer, log_level='critical', log_path=log_path)
+        durations.append((perf_counter() - before) * 1e6)
+    return {'count': count, 'latency_us': percentiles(durations)}
+
+
+def bench_metrics(count):
+    '''time metrics recording, as done for each scheduled write.
+
+    Returns:
+        dict: nanoseconds per recorded write and per recorded step
+    '''
+    metrics = PinMetrics()
+    start = perf_counter()
+    for index in range(count):
+        metrics.latency.observe(index * 1e-7)
+        metrics.writes += 1
+    write = perf_counter() - start
+    start = perf_counter()
+    for index in range(count):
+        metrics.step(index * 1e-6, 0)
+    step = perf_counter() - start
+    return {'count': count, 'write_ns': write / count * 1e9,
+            'step_ns': step / count * 1e9}
+
+
+def bench_locks(count):
+    '''time uncontended pin locks.
+
+    Returns:
+        dict: microseconds per value set without lock, with a lock taken
+              for the write ('rlieh-pwm set'), and nanoseconds per owner
+              check (each step of a modulation)
+    '''
+    directory = tempfile.mkdtemp(prefix='rlieh-bench-')
+    writer = DeviceWriter(os.devnull)
+    log_path = tempfile.gettempdir()
+    try:
+        results = {'count': count}
+        for name, locks in (('unlocked_us', None),
+                            ('locked_us', PinLocks(directory))):
+            pwm = RliehPWM(writer=writer, log_level='critical',
+                           log_path=log_path, locks=locks)
+            start = perf_counter()
+            for index in range(count):
+                pwm.pwm = index % 100
+            results[name] = (perf_counter() - start) / count * 1e6
+        lock = pwm.lock
+        lock.acquire()
+        start = perf_counter()
+        for _index in range(count):
+            lock.owned()
+        results['owned_ns'] = (perf_counter() - start) / count * 1e9
+        lock.close()
+    finally:
+        writer.close()
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+@contextmanager
+def sysfs_stand_in():
+    '''yield the path of a fake /sys/class/pwm tree (pwmchip0, pwm0).'''
+    directory = tempfile.mkdtemp(prefix='rlieh-bench-')
+    try:
+        channel = os.path.join(directory, 'pwmchip0', 'pwm0')
+        os.makedirs(channel)
+        for name in ('period', 'duty_cycle', 'enable'):
+            with open(os.path.join(channel, name), 'w') as f:
+                f.write('0\n')
+        yield directory
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def bench_sysfs(count, path=None):
+    '''time single value writes on GPIO 12 through the sysfs backend.
+
+    Args:
+        count (int): number of writes
+        path (str): sysfs PWM tree (default: fake tree)
+
+    Returns:
+        dict: writes per second and latency percentiles (microseconds)
+    '''
+    if path is not None:
+        with SysfsPWMWriter(path=path) as writer:
+            return dict(bench_writes(writer, count, pin=12), device=path)
+    with sysfs_stand_in() as path:
+        with SysfsPWMWriter(path=path) as writer:
+            return dict(bench_writes(writer, count, pin=12), device='file')
+
+
+def bench_dither(writer, count):
+    '''time the dithering ticks of 8 channels at fractional levels.
+
+    Returns:
+        dict: tick latency percentiles (microseconds), and CPU share of
+              one core used at the device frequency (percent)
+    '''
+    dither = DitherWriter(writer, run=False)
+    dither.write_frame((pin, (index + 1.37) / 1000.)
+                       for index, pin in enumerate(FRAME_PINS))
+    latencies = []
+    for _index in range(count):
+        before = perf_counter()
+        dither.tick()
+        latencies.append((perf_counter() - before) * 1e6)
+    summary = percentiles(latencies)
+    return {'count': count, 'channels': len(FRAME_PINS),
+            'tick_us': summary,
+            'cpu_percent': summary['mean'] * dither.frequency / 1e4}
+
+
+def bench_cold_start(count):
+    '''time CLI start-up in new interpreters.
+
+    Returns:
+        dict: milliseconds percentiles of the bare interpreter, the CLI
+              module import and 'rlieh-pwm --version'
+    '''
+    commands = {
+        'python': [sys.executable, '-c', 'pass'],
+        'import_cli': [sys.executable, '-c', 'import rlieh_pwm.cli'],
+        'version': [sys.executable, '-m', 'rlieh_pwm.cli', '--version'],
+    }
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        filter(None, [root, env.get('PYTHONPATH')]))
+    results = {}
+    for name, command in sorted(commands.items()):
+        durations = []
+        for _index in range(count):
+            before = perf_counter()
+            subprocess.run(command, env=env, stdout=subprocess.DEVNULL,
+                           check=True)
+            durations.append((perf_counter() - before) * 1e3)
+        results[name] = percentiles(durations)
+    return results
+
+
+def run(device=None, fifo=False, quick=False, sysfs=None):
+    '''run every benchmark.
+
+    Args:
+        device (str): device path to benchmark (default: stand-in)
+        fifo (bool): use a FIFO stand-in instead of a file
+        quick (bool): fewer iterations and shorter transitions
+        sysfs (str): sysfs PWM tree to benchmark (default: fake tree)
+
+    Returns:
+        dict: JSON serializable results
+    '''
+    count = 1000 if quick else 20000
+    results = {
+        'version': __version__,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'platform': platform.platform(),
+    }
+    with stand_in(fifo) as path:
+        if device is None:
+            device = path
+        results['device'] = 'fifo' if fifo and device == path else \
+            ('file' if device == path else device)
+        with DeviceWriter(device) as writer:
+            results['writes'] = bench_writes(writer, count)
+            results['frames'] = bench_frames(writer, count // 8)
+            results['dither'] = bench_dither(writer, count // 8)
+            results['schedules'] = bench_schedules(
+                writer, scale=0.1 if quick else 1.)
+    results['sysfs'] = bench_sysfs(count, sysfs)
+    results['construction'] = bench_construction(count // 100)
+    results['metrics'] = bench_metrics(count * 10)
+    results['locks'] = bench_locks(count)
+    results['cold_start'] = bench_cold_start(2 if quick else 10)
+    return results
+
+
+def main(device=None, fifo=False, quick=False, output=None, sysfs=None):
+    '''run benchmarks and write JSON results to output (default: stdout).'''
+    results = run(device, fifo, quick, sysfs)
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return results
@@ -32,12 +32,31 @@
 
 Usage:
   rlieh-pwm (on|off) GPIO [--log-level=LOG_LEVEL] [--log-path=LOG_DIR_PATH]
+            [--socket=SOCKET_PATH] [--lock=POLICY]
   rlieh-pwm set VALUE GPIO [--log-level=LOG_LEVEL] [--log-path=LOG_DIR_PATH]
+            [--socket=SOCKET_PATH] [--lock=POLICY]
   rlieh-pwm range BEGIN END GPIO [--duration=MINUTES] [--log-level=LOG_LEVEL]
-            [--log-path=LOG_DIR_PATH]
+            [--log-path=LOG_DIR_PATH] [--socket=SOCKET_PATH] [--simulate]
+            [--lock=POLICY]
   rlieh-pwm fx-light (--dawn|--sunrise|--noon|--sunset|--dusk) GPIO
             [--duration=MINUTES] [--log-level=LOG_LEVEL]
-            [--log-path=LOG_DIR_PATH]
+            [--log-path=LOG_DIR_PATH] [--socket=SOCKET_PATH] [--simulate]
+            [--lock=POLICY]
+  rlieh-pwm fx-storm GPIO [--duration=MINUTES] [--seed=SEED]
+            [--strikes=STRIKES] [--log-level=LOG_LEVEL]
+            [--log-path=LOG_DIR_PATH] [--socket=SOCKET_PATH] [--simulate]
+            [--lock=POLICY]
+  rlieh-pwm daemon [--socket=SOCKET_PATH] [--log-level=LOG_LEVEL]
+            [--log-path=LOG_DIR_PATH] [--dither] [--sysfs=GPIOS]
+            [--listen=ADDRESS]
+  rlieh-pwm run PROGRAM [--log-level=LOG_LEVEL] [--log-path=LOG_DIR_PATH]
+            [--simulate | --dither] [--sysfs=GPIOS] [--lock=POLICY]
+  rlieh-pwm status [GPIO] [--state=STATE_PATH]
+  rlieh-pwm batch [FILE] [--log-level=LOG_LEVEL] [--log-path=LOG_DIR_PATH]
+            [--lock=POLICY]
+  rlieh-pwm remote NODES [FILE] [--start=SECONDS]
+  rlieh-pwm bench [--device=DEVICE_PATH] [--fifo] [--quick]
+            [--sysfs-path=SYSFS_PATH] [--output=FILE]
   rlieh-pwm (-h |--help)
   rlieh-pwm (-v |--version)
 
@@ -45,6 +64,13 @@ Arguments:
   GPIO        Raspberry Pi GPIO pin
   VALUE       Percent of modulation
               minimal modulation = 0.01, power Off = 0, power On = 100
+  BEGIN       Percent of modulation at range begin, '-' for current value
+              (from the daemon, or the state table)
+  PROGRAM     Daily light program file (JSON), see rlieh_pwm.program
+  FILE        Commands file, one daemon command per line (eg. 'set 42 18'),
+              see rlieh_pwm.batch. (Default = standard input)
+  NODES       Comma separated addresses of rlieh-pwm daemons listening on
+              TCP (HOST[:PORT], default port 5018), see rlieh_pwm.remote
 
 Options:
   -h --help                 Shows this help message and exit.
@@ -53,25 +79,58 @@ Options:
   --log-level=LOG_LEVEL     none, critical, warning, error, info, debug.
                             (Default = none, no log)
   --log-path=LOG_DIR_PATH  Set log file path. (Default = /var/log/rlieh)
+  --socket=SOCKET_PATH     rlieh-pwm daemon socket, commands are sent to the
+                           daemon when it runs.
+                           (Default = /run/rlieh/pwm.sock)
+  --simulate               Runs on a simulated clock and prints the writes
+                           ("seconds gpio value") instead of driving PWM.
+                           A program is simulated for one day from midnight.
+  --seed=SEED              Random seed of the storm, a seed always plays
+                           the same storm. (Default = random storm)
+  --strikes=STRIKES        Mean lightning strikes per minute. (Default = 4)
+  --dither                 Dithers values between two pi-blaster steps
+                           (eg. 0.15%) over the PWM periods.
+  --sysfs=GPIOS            Drives these GPIOs (comma separated, eg. 12,13)
+                           with the hardware PWM of the kernel
+                           (/sys/class/pwm) instead of pi-blaster.
+  --lock=POLICY            When another rlieh-pwm process drives the GPIO:
+                           preempt (it stops), queue (wait for its end) or
+                           reject (fail). The daemon always preempts.
+                           (Default = preempt)
+  --state=STATE_PATH       PWM state table read by status, it is updated by
+                           the commands driving PWM.
+                           (Default = /run/rlieh/pwm.state)
+  --listen=ADDRESS         Also serves the daemon commands on TCP
+                           (HOST:PORT, eg. 0.0.0.0:5018). There is no
+                           authentication: trusted networks only.
+  --start=SECONDS          Nodes run the commands at the same time,
+                           SECONDS from now.
+  --device=DEVICE_PATH     Benchmarked device (Default = temporary file)
+  --fifo                   Benchmarks a temporary FIFO instead of a file.
+  --quick                  Runs fewer and shorter benchmarks.
+  --sysfs-path=SYSFS_PATH  Benchmarked sysfs PWM tree, GPIO 12 is written
+                           (eg. /sys/class/pwm, Default = temporary tree)
+  --output=FILE            Writes benchmark JSON results to FILE.
+                           (Default = standard output)
 
 Tip:
   Use an alias to set a default GPIO (eg. alias light='rlieh-pwm $@ 18')
+  Run 'rlieh-pwm daemon' as a service to make commands faster.
+  Send many commands to 'rlieh-pwm batch' rather than one process each.
+  Drive other Pis with 'rlieh-pwm remote' rather than one SSH each.
 
 RLIEH puts a roXXXing poney in your aquarium and greenhouses
 """
 
 
 from __future__ import absolute_import
-from docopt import docopt
+from collections import defaultdict
+import sys
 
 from rlieh_pwm import __version__
-from rlieh_pwm.core import RliehPWM
-
-PWM_THRESHOLDS = {'dawn': [0, 20],
-                  'sunrise': [20, 75],
-                  'noon': [75, 100, 75],
-                  'sunset': [75, 20],
-                  'dusk': [20, 0]}
+from rlieh_pwm.client import SOCKET_PATH, send
+from rlieh_pwm.core import (DitherWriter, Envelope, PWM_THRESHOLDS,
+                            RecordingWriter, RliehPWM, SimulatedClock)
 
 # default modulation range duration (in minutes)
 DURATION = 0.5
@@ -79,6 +138,14 @@ DURATION = 0.5
 # default log level
 LOG_LEVEL = 'error'
 
+# default arbitration with other rlieh-pwm processes
+LOCK_POLICY = 'preempt'
+
+
+# command lines parsed without docopt (verb: positional arguments)
+FAST_VERBS = {'set': ['VALUE', 'GPIO'], 'on': ['GPIO'], 'off': ['GPIO']}
+FAST_OPTIONS = ['--log-level', '--log-path', '--socket', '--lock']
+
 
 class MyPWM(RliehPWM):
     def __init__(self, pin, pwm_thresholds=PWM_THRESHOLDS, **kwargs):
@@ -86,8 +153,73 @@ class MyPWM(RliehPWM):
         self.pwm_thresholds = pwm_thresholds
 
 
-def main():
-    arguments = docopt(__doc__, version='RLIEH PWM {}'.format(__version__))
+def daemon_command(arguments, duration):
+    '''translate CLI arguments into a rlieh-pwm daemon command.
+
+    Returns:
+        str: daemon command, or None if the action is not a daemon command
+    '''
+    if arguments['set']:
+        return 'set {} {}'.format(arguments['VALUE'], arguments['GPIO'])
+    elif arguments['on']:
+        return 'on {}'.format(arguments['GPIO'])
+    elif arguments['off']:
+        return 'off {}'.format(arguments['GPIO'])
+    elif arguments['range']:
+        return 'range {} {} {} {}'.format(arguments['BEGIN'], arguments['END'],
+                                          arguments['GPIO'], duration)
+    elif arguments['fx-light']:
+        for name in PWM_THRESHOLDS:
+            if arguments['--' + name]:
+                return 'fx-light {} {} {}'.format(name, arguments['GPIO'],
+                                                  duration)
+    elif arguments['fx-storm']:
+        return 'fx-storm {} {} {} {}'.format(
+            arguments['GPIO'], duration, arguments['--seed'] or '-',
+            arguments['--strikes'] or '').strip()
+    return None
+
+
+def fast_arguments(argv):
+    '''parse set, on and off command lines without docopt.
+
+    Setting a value is the most frequent command: it skips loading
+    docopt and parsing the usage.
+
+    Args:
+        argv (list): command line arguments
+
+    Returns:
+        dict: docopt arguments (missing ones are None), or None if the
+              command line needs docopt
+    '''
+    if not argv or argv[0] not in FAST_VERBS:
+        return None
+    arguments = defaultdict(lambda: None)
+    arguments[argv[0]] = True
+    positional = []
+    for arg in argv[1:]:
+        if arg.startswith('-'):
+            name, sep, value = arg.partition('=')
+            if not sep or name not in FAST_OPTIONS or name in arguments:
+                return None
+            arguments[name] = value
+        else:
+            positional.append(arg)
+    if len(positional) != len(FAST_VERBS[argv[0]]):
+        return None
+    arguments.update(zip(FAST_VERBS[argv[0]], positional))
+    return arguments
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    arguments = fast_arguments(argv)
+    if arguments is None:
+        from docopt import docopt
+        arguments = docopt(__doc__, argv=argv,
+                           version='RLIEH PWM {}'.format(__version__))
     # optionnal args and default values
     if arguments['--duration']:
         duration = float(arguments['--duration'])
@@ -101,54 +233,259 @@ def main():
         log_path = arguments['--log-path']
     else:
         log_path = '/var/log/rlieh'
+    if arguments['--socket']:
+        socket_path = arguments['--socket']
+    else:
+        socket_path = SOCKET_PATH
 
-    mypwm = MyPWM(arguments['GPIO'], log_level=log_level, log_path=log_path,
-                  pwm_thresholds=PWM_THRESHOLDS)
+    options = {'log_level': log_level, 'log_path': log_path}
+    if arguments['--simulate']:
+        clock = SimulatedClock()
+        options.update(writer=RecordingWriter(clock), clock=clock,
+                       sleeper=clock.sleep)
 
-    if arguments['set']:
-        mypwm.pwm = arguments['VALUE']
-    elif arguments['on']:
-        mypwm.pwm = 100
-    elif arguments['off']:
-        mypwm.pwm = 0
-    elif arguments['range']:
-        mypwm.modulate(float(arguments['BEGIN']),
-                       float(arguments['END']),
-                       duration)
-    # fx-light --dawn|--sunrise|--noon|--sunset|--dusk
-    elif arguments['fx-light']:
-        if arguments['--dawn']:
-            mypwm.modulate(mypwm.pwm_thresholds['dawn'][0],
-                           mypwm.pwm_thresholds['dawn'][1],
-                           duration)
-        elif arguments['--sunrise']:
-            mypwm.modulate(mypwm.pwm_thresholds['sunrise'][0],
-                           mypwm.pwm_thresholds['sunrise'][1],
-                           duration)
-        elif arguments['--noon']:
-            duration = float(arguments['--duration']) / 4
-            mypwm.modulate(mypwm.pwm_thresholds['noon'][0],
-                           mypwm.pwm_thresholds['noon'][1]-1,
-                           duration)
-            mypwm.modulate(mypwm.pwm_thresholds['noon'][1]-1,
-                           mypwm.pwm_thresholds['noon'][1],
-                           duration)
-            mypwm.modulate(mypwm.pwm_thresholds['noon'][1],
-                           mypwm.pwm_thresholds['noon'][1]-1,
-                           duration)
-            mypwm.modulate(mypwm.pwm_thresholds['noon'][1]-1,
-                           mypwm.modulation.light_thresholds['noon'][2],
-                           duration)
-        elif arguments['--sunset']:
-            mypwm.modulate(mypwm.pwm_thresholds['sunset'][0],
-                           mypwm.pwm_thresholds['sunset'][1],
-                           duration)
-        elif arguments['--dusk']:
-            mypwm.modulate(mypwm.pwm_thresholds['dusk'][0],
-                           mypwm.pwm_thresholds['dusk'][1],
-                           duration)
+    if arguments['status']:
+        print_status(arguments['GPIO'], arguments['--state'])
+        return
+
+    if arguments['run']:
+        from rlieh_pwm.program import DAY, Program
+        program = Program.load(arguments['PROGRAM'])
+        if arguments['--simulate']:
+            program.run(start=0, duration=DAY, **options)
+        else:
+            if arguments['--dither']:
+                options['writer'] = DitherWriter()
+            if arguments['--sysfs']:
+                options['writer'] = sysfs_writer(arguments['--sysfs'],
+                                                 options.get('writer'))
+            try:
+                program.run(state=open_state(), locks=open_locks(
+                    arguments['--lock'] or LOCK_POLICY), **options)
+            except RuntimeError as e:
+                # pin used by another process (--lock=reject or queue
+                # timeout)
+                sys.exit(str(e))
+        print_simulation(options)
+        return
+
+    if arguments['batch']:
+        from rlieh_pwm import batch
+        kwargs = {'pwm_thresholds': PWM_THRESHOLDS, 'log_level': log_level,
+                  'log_path': log_path, 'state': open_state(),
+                  'locks': open_locks(arguments['--lock'] or LOCK_POLICY)}
+        try:
+            if arguments['FILE'] in (None, '-'):
+                failed = batch.run(sys.stdin, **kwargs)
+            else:
+                with open(arguments['FILE']) as stream:
+                    failed = batch.run(stream, **kwargs)
+        except OSError as e:
+            sys.exit('PWM batch failed: {}'.format(e))
+        if failed:
+            sys.exit(1)
+        return
+
+    if arguments['bench']:
+        from rlieh_pwm import bench
+        bench.main(device=arguments['--device'], fifo=arguments['--fifo'],
+                   quick=arguments['--quick'], output=arguments['--output'],
+                   sysfs=arguments['--sysfs-path'])
+        return
+
+    if arguments['daemon']:
+        from rlieh_pwm.daemon import run
+        writer = DitherWriter() if arguments['--dither'] else None
+        if arguments['--sysfs']:
+            writer = sysfs_writer(arguments['--sysfs'], writer)
+        run(socket_path, log_level=log_level, log_path=log_path,
+            pwm_thresholds=PWM_THRESHOLDS, state=open_state(),
+            locks=open_locks('preempt'), writer=writer,
+            listen=arguments['--listen'])
+        return
+
+    if arguments['remote']:
+        send_remote(arguments['NODES'], arguments['FILE'],
+                    arguments['--start'])
+        return
+
+    command = daemon_command(arguments, duration)
+    if command is not None and not arguments['--simulate']:
+        try:
+            reply = send(command, socket_path)
+        except (FileNotFoundError, ConnectionRefusedError, PermissionError):
+            # no daemon running: the command is run by this process
+            pass
+        except OSError as e:
+            # the daemon may have run the command: never run it twice
+            sys.exit('PWM daemon did not reply to "{}": {}'.format(command,
+                                                                   e))
+        else:
+            if not reply:
+                sys.exit('PWM daemon did not reply to "{}"'.format(command))
+            if reply.startswith('error'):
+                sys.exit(reply)
+            return
+
+    if not arguments['--simulate']:
+        options['state'] = open_state()
+        options['locks'] = open_locks(arguments['--lock'] or LOCK_POLICY)
+    mypwm = MyPWM(arguments['GPIO'], pwm_thresholds=PWM_THRESHOLDS, **options)
+
+    try:
+        if arguments['set']:
+            mypwm.pwm = arguments['VALUE']
+        elif arguments['on']:
+            mypwm.pwm = 100
+        elif arguments['off']:
+            mypwm.pwm = 0
+        elif arguments['range']:
+            if arguments['BEGIN'] == '-':
+                # hand off from the value left by other commands
+                value = stored_value(options.get('state'), arguments['GPIO'])
+                if value is not None:
+                    mypwm._store(value)
+                begin = None
+            else:
+                begin = float(arguments['BEGIN'])
+            mypwm.modulate(begin, float(arguments['END']), duration)
+        # fx-light --dawn|--sunrise|--noon|--sunset|--dusk
+        elif arguments['fx-light']:
+            for name, thresholds in mypwm.pwm_thresholds.items():
+                if arguments['--' + name]:
+                    mypwm.play(Envelope.from_thresholds(thresholds), duration)
+        elif arguments['fx-storm']:
+            # lightning over the value left by other commands
+            ambient = stored_value(options.get('state'), arguments['GPIO'])
+            seed = arguments['--seed']
+            mypwm.storm(duration, None if seed is None else int(seed),
+                        arguments['--strikes'], ambient)
         elif arguments['-v']:
-            print(__name__.__version__)
+            print(__version__)
+    except RuntimeError as e:
+        # pin used by another process (--lock=reject or queue timeout)
+        sys.exit(str(e))
+    except ValueError as e:
+        # invalid value or range, eg. range BEGIN unknown
+        sys.exit(str(e))
+    print_simulation(options)
+
+
+def send_remote(nodes, path=None, start=None):
+    '''send the commands of a file (default: stdin) to the comma separated
+    nodes, run at the same time start seconds from now if given.'''
+    from rlieh_pwm.remote import Fleet, read_commands
+    if path in (None, '-'):
+        commands = read_commands(sys.stdin)
+    else:
+        with open(path) as stream:
+            commands = read_commands(stream)
+    with Fleet(nodes.split(',')) as fleet:
+        if start is None:
+            replies = fleet.send(commands)
+        else:
+            replies = fleet.start(commands, float(start))
+    failed = 0
+    for address, node_replies in replies.items():
+        for command, reply in zip(commands, node_replies):
+            if reply.startswith('error'):
+                failed += 1
+                print('{}: {}: {}'.format(address, command, reply),
+                      file=sys.stderr)
+            elif reply != 'ok':
+                print('{} {}'.format(address, reply[3:]))
+    if failed:
+        sys.exit(1)
+
+
+def sysfs_writer(gpios, default=None):
+    '''route the comma separated GPIOs to the sysfs hardware PWM, and the
+    other pins to the default writer (default: BackgroundWriter).'''
+    from rlieh_pwm.core import (BackgroundWriter, RoutingWriter,
+                                SysfsPWMWriter)
+    try:
+        pins = [int(pin) for pin in gpios.split(',') if pin.strip()]
+    except ValueError:
+        sys.exit('Invalid --sysfs GPIOs: {}'.format(gpios))
+    sysfs = BackgroundWriter(SysfsPWMWriter())
+    try:
+        routes = dict((pin, sysfs.route(pin)) for pin in pins)
+    except ValueError as e:
+        sys.exit('Invalid --sysfs GPIOs: {}'.format(e))
+    if default is None:
+        default = BackgroundWriter()
+    return RoutingWriter(routes, default=default)
+
+
+def open_locks(policy):
+    '''open the pin locks shared by rlieh-pwm processes, or None if the
+    locks directory is not writable.'''
+    import os
+    from rlieh_pwm.core import LOCK_PATH, PinLocks
+    try:
+        locks = PinLocks(LOCK_PATH, policy)
+    except ValueError as e:
+        sys.exit(str(e))
+    try:
+        os.makedirs(LOCK_PATH, exist_ok=True)
+    except OSError:
+        return None
+    if not os.access(LOCK_PATH, os.W_OK):
+        return None
+    return locks
+
+
+def stored_value(state, pin):
+    '''get the value of a pin from the state table.
+
+    Returns:
+        float: value of the pin, or None if unknown
+    '''
+    if state is None:
+        return None
+    pin_state = state.read(pin)
+    if pin_state is None:
+        return None
+    return pin_state.value
+
+
+def open_state():
+    '''open the state table, or None if not available (see rlieh_pwm.state).
+    '''
+    from rlieh_pwm.state import open_state
+    return open_state()
+
+
+def print_status(pin=None, path=None):
+    '''print the state of the pins ("gpio value target remaining").'''
+    from time import time
+    from rlieh_pwm.state import STATE_PATH, StateTable
+    try:
+        table = StateTable(path or STATE_PATH, writable=False)
+    except (OSError, ValueError) as e:
+        sys.exit('PWM state unavailable: {}'.format(e))
+    with table:
+        if pin is None:
+            states = table.snapshot()
+        else:
+            states = {int(pin): table.read(pin)}
+    now = time()
+    for pin, state in sorted(states.items()):
+        if state is None:
+            print('{} - - -'.format(pin))
+        elif state.target is None:
+            print('{} {} - -'.format(pin, state.value))
+        else:
+            print('{} {} {} {:.1f}'.format(pin, state.value, state.target,
+                                           max(0., state.end - now)))
+
+
+def print_simulation(options):
+    '''print the writes recorded by a simulation, if any.'''
+    writer = options.get('writer')
+    if isinstance(writer, RecordingWriter):
+        for time, pin, value in writer.writes:
+            print('{:.3f} {} {}'.format(time, pin, value))
 
 
 if __name__ == '__main__':
@@ -54,59 +54,52 @@ Tip: use an alias to set a default GPIO (eg. alias light='light.py $@ 18')
 RLIEH puts a roXXXing poney in your aquarium and greenhouses
 """
 
-from time import sleep
 from docopt import docopt
-from rlieh_pwm.core import RliehPWM
+from rlieh_pwm.core import RliehPWM, Transition, schedule
+from rlieh_pwm.curves import transition_table
 
 class MyLeds(RliehPWM):
-    def __init__(self, pin):
-        super(MyLeds, self).__init__(pin=pin)
+    def __init__(self, pin, **kwargs):
+        super(MyLeds, self).__init__(pin=pin, **kwargs)
 
     def regular_variation(self, duration, ascending=True):
         '''Set regular modulation during duration minutes.'''
 
         avg_pause_time = self._get_avg_pause_time(duration)
-        for i in self._get_range(ascending):
-            f = (i/float(1000))
-            self.pwm = str(f)
-            sleep(avg_pause_time)
+        range_ = self._get_range(ascending)
+        timeline = Transition(
+            len(range_),
+            lambda n: (n * avg_pause_time, range_[n]/float(1000)),
+            len(range_) * avg_pause_time)
+        self._run(timeline, timeline.duration)
         self.variation_out(ascending)
 
     def progressive_variation(self, duration, ascending=True):
         '''Set progressive variation during duration minutes.
 
-        Note: sleep duration is longer for low light values
+        Note: values follow a perceptual (log) curve, light changes
+        slowly at low values
         '''
         avg_pause_time = self._get_avg_pause_time(duration)
-        for i in self._get_range(ascending):
-            f = (i/float(1000))
-            print(f)
-            self.pwm = str(f)
-            if ascending:
-                if i < 201:
-                    pause_time = avg_pause_time * 3
-                elif i > 200 and i < 401:
-                    pause_time = avg_pause_time * 2
-                elif i > 400 and i < 601:
-                    pause_time = avg_pause_time
-                elif i > 600 and i < 801:
-                    pause_time = avg_pause_time / 2
-                else:
-                    pause_time = avg_pause_time / 3
-            else:
-                if i < 201:
-                    pause_time = avg_pause_time / 3
-                elif i > 200 and i < 401:
-                    pause_time = avg_pause_time / 2
-                elif i > 400 and i < 601:
-                    pause_time = avg_pause_time
-                elif i > 600 and i < 801:
-                    pause_time = avg_pause_time * 2
-                else:
-                    pause_time = avg_pause_time * 3
-            sleep(pause_time)
+        # curves work on percents, this script sets 0..1 values
+        if ascending:
+            values = transition_table(0, 100, 1000, 'log') / 100
+        else:
+            values = transition_table(100, 0, 1000, 'log') / 100
+        timeline = Transition(
+            len(values),
+            lambda n: (n * avg_pause_time, values[n]),
+            len(values) * avg_pause_time)
+        self._run(timeline, timeline.duration)
         self.variation_out(ascending)
 
+    def _run(self, timeline, end):
+        '''play (offset, value) pairs on deadlines, see core.schedule.'''
+        report = schedule(timeline, self._set_pwm, end=end, clock=self.clock,
+                          sleeper=self.sleeper)
+        self._log_report('variation', report)
+        return report
+
     def _get_range(self, ascending=True):
         '''get iteration range according with chosen order.
 
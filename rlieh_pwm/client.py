@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# @Author: Olivier Watté <user>
+# @Date:   2026-10-17T09:00:00-04:00
+# @Email:  owatte@ipeos.com
+# @Last modified by:   user
+# @Last modified time: 2026-10-17T09:00:00-04:00
+# @License: GPLv3
+# @Copyright: Olivier Watté
+
+# Rlieh-pwm provides an interface to manage PWM on RLIEH systems.
+# Copyright (C) 2017 Olivier Watte
+#
+# This file is part of rlieh-pwm.
+#
+# Rlieh-pwm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rlieh-pwm is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rlieh-pwm.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+    This module is the client side of the rlieh-pwm daemon.
+
+    It only relies on the standard library socket module, so sending a
+    command costs no more than a Unix socket round trip.
+
+    Usage:
+
+    >>> from rlieh_pwm.client import send
+    >>> send('set 42.42 18')
+    'ok'
+"""
+import socket
+
+__all__ = ['SOCKET_PATH', 'send']
+
+# default rlieh-pwm daemon socket
+SOCKET_PATH = '/run/rlieh/pwm.sock'
+
+
+def send(command, path=SOCKET_PATH, timeout=5.):
+    '''send a command line to the rlieh-pwm daemon.
+
+    Args:
+        command (str): daemon command, eg. 'set 42.42 18'
+        path (str): daemon socket path
+        timeout (float): socket timeout in seconds
+
+    Returns:
+        str: daemon reply, 'ok [value]' or 'error message'
+
+    Raises:
+        OSError: the daemon can't be reached
+    '''
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        sock.sendall(command.encode('ascii') + b'\n')
+        sock.shutdown(socket.SHUT_WR)
+        reply = sock.makefile('rb').readline()
+    return reply.decode('ascii').strip()
@@ -47,20 +47,1521 @@
     >>> light = RliehPWM(pin=18)
     >>> light.pwm = 42.42
 """
+import atexit
+from bisect import bisect_left
+from collections import namedtuple
 import logging
-import logging.config
+import math
 import os
-from time import sleep
-from subprocess import call, CalledProcessError
+from time import monotonic, perf_counter, sleep, time as wall_time
 import sys
-import gettext
+import threading
 
-gettext.bindtextdomain('rlieh', 'locale')
-gettext.textdomain('rlieh')
-_ = gettext.gettext
+# asyncio, gettext, json, logging.handlers and queue are imported when
+# needed: a command line setting one value must start fast (eg. Pi Zero)
+_translate = None
 
 
-__all__ = ['RliehPWM']
+def _(message):
+    '''translate a message, gettext is set up on first use.'''
+    global _translate
+    if _translate is None:
+        import gettext
+        gettext.bindtextdomain('rlieh', 'locale')
+        gettext.textdomain('rlieh')
+        _translate = gettext.gettext
+    return _translate(message)
+
+
+__all__ = ['RliehPWM', 'RliehPWMGroup',
+           'BlasterWriter', 'DeviceWriter', 'MemoryWriter', 'RecordingWriter',
+           'BackgroundWriter', 'DitherWriter', 'SysfsPWMWriter',
+           'RoutingWriter',
+           'SimulatedClock',
+           'Metrics', 'PinMetrics', 'Histogram', 'METRICS',
+           'configure_logging', 'PinLock', 'PinLocks',
+           'ScheduleReport', 'schedule', 'schedule_async',
+           'Transition', 'plan_transition',
+           'Envelope', 'ENVELOPES', 'PWM_THRESHOLDS']
+
+
+LOGGING_LEVELS = {'debug': 'DEBUG', 'info': 'INFO', 'warning': 'WARNING',
+                  'error': 'ERROR', 'critical': 'CRITICAL'}
+
+# logging configuration of the process, see configure_logging
+_logging = {'config': None, 'listener': None, 'handler': None}
+_logging_lock = threading.Lock()
+
+
+def configure_logging(log_level='critical', log_path='/var/log/rlieh'):
+    '''Configure RLIEH logging, once per process.
+
+    Records are sent to the console, to pwm.log and to pwm_error.log
+    (errors only) from a QueueListener thread: a slow SD card never
+    delays a PWM step. Calls with the configuration already in place
+    return at once, so creating RliehPWM instances costs no logging
+    reconfiguration.
+
+    Args:
+        log_level (str): debug, info, warning, error or critical
+        log_path (str): log files directory
+
+    Returns:
+        str: logging level name (eg. 'CRITICAL')
+    '''
+    log_level = log_level.lower()
+    if log_level not in LOGGING_LEVELS:
+        log_levels = ', '.join(LOGGING_LEVELS.keys())
+        raise ValueError(
+            _('Unknown log_level "{}". '
+              'Log level should be a value in: {}.'.format(
+                log_level, log_levels))
+        )
+    level = LOGGING_LEVELS[log_level]
+    config = (level, log_path)
+    if _logging['config'] == config:
+        return level
+    with _logging_lock:
+        if _logging['config'] == config:
+            return level
+        import logging.handlers
+        import queue
+        basic = logging.Formatter(
+            '%(asctime)-6s: %(name)s - %(levelname)s - %(message)s')
+        console = logging.StreamHandler()
+        console.setLevel(level)
+        console.setFormatter(logging.Formatter('[%(levelname)s]  %(message)s'))
+        main_file = logging.handlers.WatchedFileHandler(
+            os.path.join(log_path, 'pwm.log'), delay=True)
+        main_file.setLevel(level)
+        main_file.setFormatter(basic)
+        error_file = logging.handlers.WatchedFileHandler(
+            os.path.join(log_path, 'pwm_error.log'), delay=True)
+        error_file.setLevel('ERROR')
+        error_file.setFormatter(basic)
+
+        records = queue.SimpleQueue()
+        handler = logging.handlers.QueueHandler(records)
+        listener = logging.handlers.QueueListener(
+            records, console, main_file, error_file,
+            respect_handler_level=True)
+        _stop_logging()
+        for logger in (logging.getLogger(), logging.getLogger('rlieh')):
+            logger.addHandler(handler)
+            logger.setLevel(level)
+        logging.getLogger('rlieh').propagate = False
+        listener.start()
+        if _logging['config'] is None:
+            atexit.register(_stop_logging)
+        _logging.update(config=config, listener=listener, handler=handler)
+    return level
+
+
+def _stop_logging():
+    '''write the queued records and remove the RLIEH handlers.'''
+    listener, handler = _logging['listener'], _logging['handler']
+    if handler is not None:
+        for logger in (logging.getLogger(), logging.getLogger('rlieh')):
+            logger.removeHandler(handler)
+    if listener is not None:
+        listener.stop()
+        for target in listener.handlers:
+            target.close()
+    _logging.update(listener=None, handler=None)
+
+
+class BlasterWriter(object):
+    """Base class for the pi-blaster write path.
+
+    A writer sends ``pin=value`` lines to pi-blaster. Subclasses only
+    implement ``_write``, which receives the ready to send text.
+
+    Attributes:
+        - resolution (int): number of distinct PWM steps of the backend.
+        - frequency (int): PWM frequency of the backend in Hz.
+        - metered (bool): the writer records the device writes in the
+          pins metrics itself (RliehPWM then does not).
+    """
+
+    resolution = 1000
+    frequency = 100
+    metered = False
+
+    def write(self, pin, value):
+        '''send one pi-blaster value for the given pin.
+
+        Args:
+            pin (int): Raspberry Pi's gpio used for PWM.
+            value (float): pi-blaster PWM value (number between 0 and 1)
+        '''
+        self._write('{0}={1}\n'.format(pin, value))
+
+    def write_frame(self, frame):
+        '''send several pi-blaster values in a single write.
+
+        Args:
+            frame: iterable of (pin, value) pairs
+        '''
+        self._write(''.join('{0}={1}\n'.format(pin, value)
+                            for pin, value in frame))
+
+    def flush(self, timeout=None):
+        '''wait for the values written so far to reach the device.
+
+        Returns:
+            bool: False if timeout expired first
+        '''
+        return True
+
+    def route(self, pin):
+        '''get the writer handling a pin (see RoutingWriter).'''
+        return self
+
+    def close(self):
+        '''release the resources held by the writer.'''
+        pass
+
+    def _write(self, data):
+        raise NotImplementedError
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class DeviceWriter(BlasterWriter):
+    """Writes to pi-blaster through a file descriptor kept open.
+
+    The device is opened on first write, so building a writer on a
+    system without pi-blaster does not fail. Any path can be used in
+    place of ``/dev/pi-blaster``: a FIFO, or a regular file used as
+    stand-in for tests and benchmarks (the file must exist, lines are
+    appended).
+    """
+
+    def __init__(self, path='/dev/pi-blaster'):
+        self.path = path
+        self._fd = None
+
+    def open(self):
+        '''open the device if needed.
+
+        Returns:
+            int: device file descriptor
+        '''
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+        return self._fd
+
+    def close(self):
+        if self._fd is not None:
+            fd, self._fd = self._fd, None
+            os.close(fd)
+
+    def _write(self, data):
+        fd = self._fd if self._fd is not None else self.open()
+        try:
+            os.write(fd, data.encode('ascii'))
+        except OSError:
+            # pi-blaster may have been restarted: reopen on next write
+            self.close()
+            raise
+
+
+class MemoryWriter(BlasterWriter):
+    """In-memory stand-in for pi-blaster, keeps every line written.
+
+    Attributes:
+        - lines (list): ``pin=value`` lines, in write order.
+    """
+
+    def __init__(self):
+        self.lines = []
+
+    def _write(self, data):
+        self.lines.extend(data.splitlines())
+
+
+SYSFS_PWM_PATH = '/sys/class/pwm'
+# BCM GPIOs wired to the hardware PWM channels of pwmchip0
+SYSFS_PWM_CHANNELS = {12: 0, 18: 0, 13: 1, 19: 1}
+
+
+class SysfsPWMWriter(BlasterWriter):
+    """Writes to kernel hardware PWM channels (/sys/class/pwm/pwmchipN).
+
+    Hardware PWM runs at higher frequencies than pi-blaster, on the pins
+    wired to a PWM channel. A channel is exported, set up and enabled on
+    the first write of its pin, then its duty_cycle file is kept open:
+    a value is a single write.
+
+    Any directory with the sysfs layout can be used in place of
+    /sys/class/pwm (eg. a fake tree for tests, where each write replaces
+    the first line of duty_cycle).
+
+    Attributes:
+        - chip_path (str): pwmchip directory.
+        - channels (dict): PWM channel of each pin.
+        - period (int): PWM period in nanoseconds.
+    """
+
+    # values have 4 digits
+    resolution = 10000
+    # seconds, wait for the kernel and udev to create an exported channel
+    EXPORT_TIMEOUT = 1.
+
+    def __init__(self, chip=0, channels=None, frequency=1000,
+                 path=SYSFS_PWM_PATH):
+        '''
+        Args:
+            chip (int): pwmchip number
+            channels (dict): PWM channel of each pin
+                             (default: SYSFS_PWM_CHANNELS)
+            frequency (int): PWM frequency in Hz
+            path (str): sysfs PWM class directory
+        '''
+        if channels is None:
+            channels = SYSFS_PWM_CHANNELS
+        self.chip_path = os.path.join(path, 'pwmchip{}'.format(chip))
+        self.channels = dict((int(pin), channel)
+                             for pin, channel in channels.items())
+        self.frequency = frequency
+        self.period = int(round(1e9 / frequency))
+        self._fds = {}
+
+    def open(self, pin):
+        '''export and enable the PWM channel of a pin, if needed.
+
+        Returns:
+            int: duty_cycle file descriptor
+        '''
+        fd = self._fds.get(pin)
+        if fd is not None:
+            return fd
+        self.route(pin)
+        channel = self.channels[int(pin)]
+        channel_path = os.path.join(self.chip_path, 'pwm{}'.format(channel))
+        duty_cycle = os.path.join(channel_path, 'duty_cycle')
+        if not os.path.isdir(channel_path):
+            self._set(os.path.join(self.chip_path, 'export'), channel)
+            deadline = monotonic() + self.EXPORT_TIMEOUT
+            while not os.access(duty_cycle, os.W_OK):
+                if monotonic() > deadline:
+                    raise FileNotFoundError(
+                        _('PWM channel {} was not exported'.format(
+                            channel_path))
+                    )
+                sleep(.01)
+        # the duty cycle can't be longer than the period
+        self._set(duty_cycle, 0)
+        self._set(os.path.join(channel_path, 'period'), self.period)
+        self._set(os.path.join(channel_path, 'enable'), 1)
+        fd = self._fds[pin] = os.open(duty_cycle, os.O_WRONLY)
+        return fd
+
+    def write(self, pin, value):
+        fd = self._fds.get(pin)
+        if fd is None:
+            fd = self.open(pin)
+        try:
+            os.pwrite(fd, b'%d\n' % round(value * self.period), 0)
+        except OSError:
+            # set up again on next write
+            del self._fds[pin]
+            os.close(fd)
+            raise
+
+    def write_frame(self, frame):
+        frame = list(frame)
+        # no partial frame for a pin without channel
+        for pin, _value in frame:
+            if pin not in self._fds:
+                self.route(pin)
+        for pin, value in frame:
+            self.write(pin, value)
+
+    def route(self, pin):
+        '''check the pin has a hardware PWM channel.
+
+        Raises:
+            ValueError: the pin has no channel
+        '''
+        if int(pin) not in self.channels:
+            raise ValueError(
+                _('Pin {} has no hardware PWM channel ({})'.format(
+                    pin, self.chip_path))
+            )
+        return self
+
+    def close(self):
+        fds, self._fds = self._fds, {}
+        for fd in fds.values():
+            os.close(fd)
+
+    @staticmethod
+    def _set(path, value):
+        with open(path, 'w') as f:
+            f.write('{}\n'.format(value))
+
+
+class RoutingWriter(BlasterWriter):
+    """Sends the values of each pin to its own backend.
+
+    >>> writer = RoutingWriter({12: SysfsPWMWriter()},
+    ...                        default=BackgroundWriter())
+    >>> leds = RliehPWMGroup([12, 16, 18], writer=writer)
+
+    RliehPWM channels plan their transitions for the resolution and
+    frequency of their pin backend. Wrap each backend (eg. in a
+    BackgroundWriter), not the routing writer.
+
+    Attributes:
+        - routes (dict): backend of each routed pin.
+        - default (BlasterWriter): backend of the other pins.
+    """
+
+    def __init__(self, routes, default=None):
+        '''
+        Args:
+            routes (dict): backend of each routed pin
+            default (BlasterWriter): backend of the other pins
+                (default: DeviceWriter on /dev/pi-blaster)
+        '''
+        if default is None:
+            default = DeviceWriter()
+        self.routes = dict((int(pin), writer)
+                           for pin, writer in routes.items())
+        # unknown pins are rejected here, not on their first write
+        for pin, writer in self.routes.items():
+            writer.route(pin)
+        self.default = default
+        self.resolution = default.resolution
+        self.frequency = default.frequency
+
+    def route(self, pin):
+        return self.routes.get(int(pin), self.default).route(pin)
+
+    def write(self, pin, value):
+        self.route(pin).write(pin, value)
+
+    def write_frame(self, frame):
+        # one frame per backend
+        frames = {}
+        for pin, value in frame:
+            writer = self.route(pin)
+            frames.setdefault(id(writer), (writer, []))[1].append(
+                (pin, value))
+        for writer, pairs in frames.values():
+            writer.write_frame(pairs)
+
+    def _writers(self):
+        writers = dict((id(writer), writer)
+                       for writer in self.routes.values())
+        writers[id(self.default)] = self.default
+        return writers.values()
+
+    def flush(self, timeout=None):
+        return all([writer.flush(timeout) for writer in self._writers()])
+
+    def close(self):
+        for writer in self._writers():
+            writer.close()
+
+
+class BackgroundWriter(BlasterWriter):
+    """Writes to pi-blaster from a thread, the latest value of a pin wins.
+
+    write() and write_frame() only store the pending value of each pin
+    and return at once, so schedules never block on device I/O. The
+    thread sends the pending values of all pins in one frame. When the
+    device drains slower than values come, a pending value is replaced
+    by the newer one of its pin: stale intermediate values are dropped.
+
+    A device error does not stop the process: values are kept and the
+    device is reopened with an exponential backoff.
+
+    The pins metrics count the values actually written by the thread,
+    with the device write latency, and the dropped values.
+
+    >>> light = RliehPWM(18, writer=BackgroundWriter())
+
+    Attributes:
+        - writer (BlasterWriter): writer used by the thread.
+        - dropped (int): values replaced before being written.
+        - errors (int): failed device writes.
+    """
+
+    metered = True
+
+    def __init__(self, writer=None, backoff=.1, max_backoff=5.,
+                 metrics=None):
+        '''
+        Args:
+            writer (BlasterWriter): device writer
+                (default: DeviceWriter on /dev/pi-blaster)
+            backoff (float): first retry delay after an error, in seconds
+            max_backoff (float): longest retry delay, in seconds
+            metrics (Metrics): pins metrics registry (default: METRICS)
+        '''
+        if writer is None:
+            writer = DeviceWriter()
+        self.writer = writer
+        self.resolution = writer.resolution
+        self.frequency = writer.frequency
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.metrics = metrics
+        self.dropped = self.errors = 0
+        self.logger = logging.getLogger(__name__)
+        self._pending = {}
+        self._busy = False
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def write(self, pin, value):
+        self.write_frame(((pin, value),))
+
+    def write_frame(self, frame):
+        with self._condition:
+            if self._closed:
+                raise ValueError(_('Write to a closed writer'))
+            pending = self._pending
+            for pin, value in frame:
+                if pin in pending:
+                    self.dropped += 1
+                    (self.metrics or METRICS).pin(pin).dropped += 1
+                pending[pin] = value
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='rlieh-pwm-writer', daemon=True)
+                self._thread.start()
+            self._condition.notify_all()
+
+    def flush(self, timeout=None):
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: not self._pending and not self._busy, timeout)
+
+    def route(self, pin):
+        # checks the pin before its values reach the thread
+        self.writer.route(pin)
+        return self
+
+    def close(self):
+        '''write the pending values, stop the thread and close the device.
+
+        Pending values are dropped if the device still fails.
+        '''
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        self.writer.close()
+
+    def _run(self):
+        '''writer thread loop.'''
+        delay = self.backoff
+        condition = self._condition
+        while True:
+            with condition:
+                while not self._pending and not self._closed:
+                    condition.wait()
+                if not self._pending:
+                    return
+                frame = list(self._pending.items())
+                self._pending = {}
+                self._busy = True
+            metrics = self.metrics or METRICS
+            start = perf_counter()
+            try:
+                self.writer.write_frame(frame)
+            except OSError as e:
+                self.errors += 1
+                for pin, _value in frame:
+                    metrics.pin(pin).failed += 1
+                with condition:
+                    # values written meanwhile are newer
+                    pending = dict(frame)
+                    for pin in pending.keys() & self._pending.keys():
+                        self.dropped += 1
+                        metrics.pin(pin).dropped += 1
+                    pending.update(self._pending)
+                    self._pending = pending
+                    self._busy = False
+                    if self._closed:
+                        self.logger.error(
+                            'pi-blaster write failed (%s), %s values dropped',
+                            e.strerror, len(pending))
+                        self._pending = {}
+                        condition.notify_all()
+                        return
+                    self.logger.warning(
+                        'pi-blaster write failed (%s), retry in %.3fs',
+                        e.strerror, delay)
+                    deadline = monotonic() + delay
+                    while not self._closed:
+                        remaining = deadline - monotonic()
+                        if remaining <= 0:
+                            break
+                        condition.wait(remaining)
+                delay = min(delay * 2, self.max_backoff)
+            except ValueError as e:
+                # a pin the device can't drive, retrying would not help
+                self.errors += 1
+                for pin, _value in frame:
+                    metrics.pin(pin).failed += 1
+                self.logger.error('pi-blaster write failed (%s), %s values '
+                                  'dropped', e, len(frame))
+                with condition:
+                    self._busy = False
+                    condition.notify_all()
+            else:
+                latency = perf_counter() - start
+                for pin, _value in frame:
+                    pin_metrics = metrics.pin(pin)
+                    pin_metrics.writes += 1
+                    pin_metrics.latency.observe(latency)
+                delay = self.backoff
+                with condition:
+                    self._busy = False
+                    condition.notify_all()
+
+
+class DitherWriter(BlasterWriter):
+    """Temporal dithering of values finer than the device resolution.
+
+    Values are kept as targets and sent on each PWM period by a thread:
+    a first order sigma-delta modulator alternates between the two
+    closest hardware levels, so their average matches the target (eg.
+    0.15% as 0.1% and 0.2% on alternate periods of pi-blaster). A pin
+    is written only when its level changes, all pins in one frame.
+
+    The writer resolution is the device resolution times oversampling:
+    transitions are planned with fractional hardware levels.
+
+    >>> light = RliehPWM(18, writer=DitherWriter())
+    >>> light.modulate(0, 5, duration=30)
+
+    The pins metrics count the levels actually written on the ticks,
+    with the device write latency.
+
+    Attributes:
+        - writer (BlasterWriter): device writer.
+        - oversampling (int): virtual levels per hardware level.
+    """
+
+    metered = True
+
+    def __init__(self, writer=None, oversampling=10, run=True,
+                 metrics=None):
+        '''
+        Args:
+            writer (BlasterWriter): device writer
+                (default: DeviceWriter on /dev/pi-blaster)
+            oversampling (int): virtual levels per hardware level
+            run (bool): tick from a thread at the device frequency, else
+                        tick() is called by the owner
+            metrics (Metrics): pins metrics registry (default: METRICS)
+        '''
+        if writer is None:
+            writer = DeviceWriter()
+        self.writer = writer
+        self.metrics = metrics
+        self.oversampling = oversampling
+        self.resolution = writer.resolution * oversampling
+        self.frequency = writer.frequency
+        self.logger = logging.getLogger(__name__)
+        # pin: [target level, error, last level]
+        self._pins = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._run = run
+
+    def write(self, pin, value):
+        self.write_frame(((pin, value),))
+
+    def write_frame(self, frame):
+        levels = self.writer.resolution
+        with self._lock:
+            for pin, value in frame:
+                state = self._pins.get(pin)
+                if state is None:
+                    self._pins[pin] = [value * levels, 0., None]
+                else:
+                    state[0] = value * levels
+        if self._run and self._thread is None:
+            self._thread = threading.Thread(
+                target=self._ticks, name='rlieh-pwm-dither', daemon=True)
+            self._thread.start()
+
+    def route(self, pin):
+        # checks the pin before its values reach the thread
+        self.writer.route(pin)
+        return self
+
+    def tick(self):
+        '''send the levels of one PWM period.
+
+        Returns:
+            list: (pin, value) pairs written
+        '''
+        levels = self.writer.resolution
+        frame = []
+        with self._lock:
+            for pin, state in self._pins.items():
+                wanted = state[0] + state[1]
+                level = math.floor(wanted + .5)
+                if level < 0:
+                    level = 0
+                elif level > levels:
+                    level = levels
+                state[1] = wanted - level
+                if level != state[2]:
+                    state[2] = level
+                    frame.append((pin, level / levels))
+        if frame:
+            metrics = self.metrics or METRICS
+            start = perf_counter()
+            try:
+                self.writer.write_frame(frame)
+            except OSError:
+                for pin, _value in frame:
+                    metrics.pin(pin).failed += 1
+                raise
+            if not self.writer.metered:
+                latency = perf_counter() - start
+                for pin, _value in frame:
+                    pin_metrics = metrics.pin(pin)
+                    pin_metrics.writes += 1
+                    pin_metrics.latency.observe(latency)
+        return frame
+
+    def _ticks(self):
+        '''dithering thread: one tick per PWM period, on deadlines.'''
+        period = 1. / self.frequency
+        deadline = monotonic()
+        while not self._stop.is_set():
+            try:
+                self.tick()
+            except OSError as e:
+                # DeviceWriter reopens the device on next write
+                self.logger.error('pi-blaster write failed (%s)', e.strerror)
+            deadline += period
+            delay = deadline - monotonic()
+            if delay < 0:
+                # late: skip the missed periods
+                deadline -= delay
+                delay = 0
+            self._stop.wait(delay)
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.writer.close()
+
+
+class Histogram(object):
+    """Fixed buckets histogram, cheap enough to observe every write.
+
+    Attributes:
+        - bounds (tuple): bucket upper bounds, ascending.
+        - counts (list): observations of each bucket, the last one is +Inf.
+        - sum (float): sum of observed values.
+    """
+
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def cumulative(self):
+        '''get (upper bound, observations lower or equal) pairs.'''
+        total = 0
+        buckets = []
+        for bound, count in zip(self.bounds + (float('inf'),), self.counts):
+            total += count
+            buckets.append((bound, total))
+        return buckets
+
+
+class PinMetrics(object):
+    """Counters and histograms of a pin.
+
+    Attributes:
+        - writes (int): values written to the device.
+        - failed (int): writes which raised an OSError.
+        - skipped (int): late steps merged into a later one.
+        - dropped (int): values replaced before being written to the
+          device.
+        - latency (Histogram): device write duration, in seconds.
+        - lateness (Histogram): delay of scheduled writes after their
+          deadline, in seconds.
+    """
+
+    __slots__ = ('writes', 'failed', 'skipped', 'dropped', 'latency',
+                 'lateness')
+
+    # seconds
+    LATENCY_BOUNDS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 5e-3,
+                      1e-2, 5e-2)
+    LATENESS_BOUNDS = (1e-4, 5e-4, 1e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, .1, .5,
+                       1.)
+
+    def __init__(self):
+        self.writes = self.failed = self.skipped = self.dropped = 0
+        self.latency = Histogram(self.LATENCY_BOUNDS)
+        self.lateness = Histogram(self.LATENESS_BOUNDS)
+
+    def step(self, lateness, skipped):
+        '''record a scheduled write, see schedule() observe argument.'''
+        self.lateness.observe(lateness)
+        self.skipped += skipped
+
+
+class Metrics(object):
+    """Registry of the pins metrics of a process.
+
+    Metrics are always on: recording an event costs a few hundred
+    nanoseconds. They are read in-process or exported as JSON or as a
+    Prometheus textfile (node_exporter textfile collector):
+
+    >>> METRICS.pin(18).writes
+    1001
+    >>> METRICS.write_textfile('/var/lib/node_exporter/rlieh_pwm.prom')
+
+    Attributes:
+        - pins (dict): PinMetrics of each pin.
+    """
+
+    PREFIX = 'rlieh_pwm'
+
+    def __init__(self):
+        self.pins = {}
+
+    def pin(self, pin):
+        '''get the metrics of a pin, created on first use.'''
+        pin = int(pin)
+        metrics = self.pins.get(pin)
+        if metrics is None:
+            metrics = self.pins.setdefault(pin, PinMetrics())
+        return metrics
+
+    def reset(self):
+        '''forget every recorded event.'''
+        for pin in list(self.pins):
+            self.pins[pin] = PinMetrics()
+
+    def snapshot(self):
+        '''get the metrics of every pin.
+
+        Returns:
+            dict: JSON serializable metrics, by pin
+        '''
+        def histogram(h):
+            return {'buckets': [[bound if bound != float('inf') else '+Inf',
+                                 count] for bound, count in h.cumulative()],
+                    'sum': h.sum, 'count': h.count}
+
+        return dict((str(pin), {
+            'writes': metrics.writes,
+            'failed': metrics.failed,
+            'skipped': metrics.skipped,
+            'dropped': metrics.dropped,
+            'write_latency_seconds': histogram(metrics.latency),
+            'lateness_seconds': histogram(metrics.lateness),
+        }) for pin, metrics in sorted(self.pins.items()))
+
+    def to_json(self):
+        import json
+        return json.dumps(self.snapshot(), sort_keys=True)
+
+    def to_prometheus(self):
+        '''get the metrics in Prometheus text exposition format.'''
+        pins = sorted(self.pins.items())
+        lines = []
+        for name, attribute, text in (
+                ('writes_total', 'writes', 'PWM values written.'),
+                ('failed_writes_total', 'failed', 'PWM writes failed.'),
+                ('skipped_steps_total', 'skipped',
+                 'Late transition steps merged into a later one.'),
+                ('dropped_values_total', 'dropped',
+                 'PWM values replaced before being written.')):
+            name = '{}_{}'.format(self.PREFIX, name)
+            lines.append('# HELP {} {}'.format(name, text))
+            lines.append('# TYPE {} counter'.format(name))
+            for pin, metrics in pins:
+                lines.append('{}{{pin="{}"}} {}'.format(
+                    name, pin, getattr(metrics, attribute)))
+        for name, attribute, text in (
+                ('write_latency_seconds', 'latency',
+                 'PWM device write duration.'),
+                ('lateness_seconds', 'lateness',
+                 'Delay of transition steps after their deadline.')):
+            name = '{}_{}'.format(self.PREFIX, name)
+            lines.append('# HELP {} {}'.format(name, text))
+            lines.append('# TYPE {} histogram'.format(name))
+            for pin, metrics in pins:
+                h = getattr(metrics, attribute)
+                for bound, count in h.cumulative():
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append('{}_bucket{{pin="{}",le="{}"}} {}'.format(
+                        name, pin, le, count))
+                lines.append('{}_sum{{pin="{}"}} {!r}'.format(
+                    name, pin, h.sum))
+                lines.append('{}_count{{pin="{}"}} {}'.format(
+                    name, pin, h.count))
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        '''write the Prometheus metrics to a file, atomically.'''
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+
+# metrics of the process, used by default by RliehPWM instances
+METRICS = Metrics()
+
+
+LOCK_PATH = '/run/rlieh/locks'
+LOCK_POLICIES = ('preempt', 'queue', 'reject')
+
+# lock owner tokens of the process
+_tokens = [0]
+
+
+class PinLock(object):
+    """Advisory lock giving the writes of a pin to one owner at a time.
+
+    The owner holds an exclusive flock on the pin lock file. The file
+    holds the token of the current owner, read through a memory map: an
+    owner checks it is still the owner without system call, before each
+    write of a modulation and on each tick while waiting for the next
+    one.
+
+    Policies of a new owner when the pin is in use:
+        - preempt: writes its token, the current owner stops within one
+          tick and releases the lock.
+        - queue: waits for the current owner to release the lock.
+        - reject: raises RuntimeError.
+
+    Attributes:
+        - path (str): lock file path.
+        - policy (str): preempt, queue or reject.
+        - held (bool): True while the lock is held.
+    """
+
+    # seconds, lock polling period while waiting
+    TICK = .01
+
+    def __init__(self, path, policy='preempt', timeout=None):
+        '''
+        Args:
+            path (str): lock file, created if needed
+            policy (str): preempt, queue or reject
+            timeout (float): longest wait for the lock in seconds
+                             (default: no limit)
+        '''
+        import fcntl
+        import mmap
+        if policy not in LOCK_POLICIES:
+            raise ValueError(
+                _('Unknown lock policy "{}", should be a value in: {}.'
+                  .format(policy, ', '.join(LOCK_POLICIES)))
+            )
+        self.path = path
+        self.policy = policy
+        self.timeout = timeout
+        self.held = False
+        self._flock = fcntl.flock
+        self._exclusive = fcntl.LOCK_EX | fcntl.LOCK_NB
+        self._unlock = fcntl.LOCK_UN
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+        if os.fstat(self._fd).st_size < 8:
+            os.ftruncate(self._fd, 8)
+        self._map = mmap.mmap(self._fd, 8)
+        _tokens[0] += 1
+        self._token = ((os.getpid() << 32) + _tokens[0]).to_bytes(8, 'little')
+
+    def owned(self):
+        '''check the lock is held and was not preempted.'''
+        return self.held and self._map[:8] == self._token
+
+    def acquire(self):
+        '''take the lock, following the lock policy.
+
+        Raises:
+            RuntimeError: the pin is used (reject policy, timeout, or
+                          preempted by a newer owner while waiting)
+        '''
+        if self.held:
+            return
+        if self.policy == 'preempt':
+            self._map[:8] = self._token
+        deadline = None if self.timeout is None else \
+            monotonic() + self.timeout
+        while True:
+            try:
+                self._flock(self._fd, self._exclusive)
+                break
+            except BlockingIOError:
+                pass
+            if self.policy == 'reject' or (
+                    deadline is not None and monotonic() >= deadline):
+                raise RuntimeError(
+                    _('Pin lock {} is held by another process'.format(
+                        self.path))
+                )
+            if self.policy == 'preempt' and self._map[:8] != self._token:
+                raise RuntimeError(
+                    _('Pin lock {} was preempted'.format(self.path))
+                )
+            sleep(self.TICK)
+        self._map[:8] = self._token
+        self.held = True
+
+    def release(self):
+        if self.held:
+            self.held = False
+            self._flock(self._fd, self._unlock)
+
+    def close(self):
+        self.release()
+        self._map.close()
+        os.close(self._fd)
+
+
+class PinLocks(object):
+    """Registry of the pin locks of a process, see PinLock.
+
+    Pins are arbitrated between processes running blocking writes and
+    modulations (eg. overlapping cron jobs):
+
+    >>> light = RliehPWM(18, locks=PinLocks(policy='queue'))
+
+    The daemon arbitrates the pins of its own commands.
+
+    Attributes:
+        - path (str): lock files directory.
+        - policy (str): preempt, queue or reject.
+    """
+
+    def __init__(self, path=LOCK_PATH, policy='preempt', timeout=None):
+        if policy not in LOCK_POLICIES:
+            raise ValueError(
+                _('Unknown lock policy "{}", should be a value in: {}.'
+                  .format(policy, ', '.join(LOCK_POLICIES)))
+            )
+        self.path = path
+        self.policy = policy
+        self.timeout = timeout
+        self.locks = {}
+
+    def lock(self, pin):
+        '''get the lock of a pin, created on first use.'''
+        pin = int(pin)
+        lock = self.locks.get(pin)
+        if lock is None:
+            lock = self.locks.setdefault(pin, PinLock(
+                os.path.join(self.path, 'pin{}'.format(pin)), self.policy,
+                self.timeout))
+        return lock
+
+
+def _plan_value(begin, end, tick, ticks, resolution):
+    '''value of a planned transition at a given tick, see plan_transition.'''
+    if tick <= 0:
+        return begin
+    elif tick >= ticks:
+        return end
+    begin_level = math.floor(begin * resolution / 100. + .5)
+    end_level = math.floor(end * resolution / 100. + .5)
+    level = begin_level + math.floor(
+        (end_level - begin_level) * tick / float(ticks) + .5)
+    return level * 100. / resolution
+
+
+class Transition(object):
+    """Lazy transition: (offset, value) pairs computed on demand.
+
+    Offsets are in seconds from the transition start, each value is held
+    until the next offset, and the last one until the end of the
+    transition. Transitions are chained with +, reversed with
+    reversed(), sliced and indexed without building lists, so a long
+    program only uses memory for its definition.
+
+    Usage:
+
+    >>> dawn = plan_transition(0, 20, 1800)
+    >>> day = dawn + Transition.hold(20, 3600) + reversed(dawn)
+    >>> first_hour = day[:len(dawn)]
+
+    Attributes:
+        - duration (float): transition duration in seconds.
+    """
+
+    def __init__(self, length, point, duration):
+        '''
+        Args:
+            length (int): number of (offset, value) pairs
+            point: callable returning the (offset, value) pair of an index
+            duration (float): transition duration in seconds
+        '''
+        self._length = length
+        self._point = point
+        self.duration = float(duration)
+
+    @classmethod
+    def from_pairs(cls, pairs, duration=None):
+        '''build a transition from a sequence of (offset, value) pairs.'''
+        pairs = list(pairs)
+        if duration is None:
+            duration = pairs[-1][0] if pairs else 0.
+        return cls(len(pairs), pairs.__getitem__, duration)
+
+    @classmethod
+    def hold(cls, value, duration):
+        '''transition keeping one value for duration seconds.'''
+        return cls(1, lambda index: (0., value), duration)
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        return map(self._point, range(self._length))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            indexes = range(self._length)[index]
+            if indexes.step < 0:
+                raise ValueError(
+                    _('Transition slices can\'t go backward, use reversed()')
+                )
+            if not indexes:
+                return Transition(0, self._point, 0)
+            start = self._point(indexes[0])[0]
+            following = indexes[-1] + indexes.step
+            if following < self._length:
+                stop = self._point(following)[0]
+            else:
+                stop = self.duration
+            point = self._point
+
+            def sliced(i):
+                offset, value = point(indexes[i])
+                return offset - start, value
+            return Transition(len(indexes), sliced, stop - start)
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError(_('Transition index out of range'))
+        return self._point(index)
+
+    def __add__(self, other):
+        length, point, shift = self._length, self._point, self.duration
+
+        def chained(index):
+            if index < length:
+                return point(index)
+            offset, value = other._point(index - length)
+            return offset + shift, value
+        return Transition(length + len(other), chained,
+                          self.duration + other.duration)
+
+    def __reversed__(self):
+        length, point, duration = self._length, self._point, self.duration
+
+        def backward(index):
+            # value held on [offset, next offset) is held on
+            # [duration - next offset, duration - offset) once reversed
+            if index == 0:
+                stop = duration
+            else:
+                stop = point(length - index)[0]
+            return duration - stop, point(length - 1 - index)[1]
+        return Transition(length, backward, duration)
+
+    def after(self, offset):
+        '''get the rest of the transition from offset (seconds), starting
+        with the value held at offset.'''
+        # first pair after offset
+        low, high = 0, self._length
+        while low < high:
+            middle = (low + high) // 2
+            if self._point(middle)[0] <= offset:
+                low = middle + 1
+            else:
+                high = middle
+        if low == 0:
+            return self
+        value = self._point(low - 1)[1]
+        if low == self._length:
+            return Transition.hold(value, max(self.duration - offset, 0.))
+        return Transition.hold(value, self._point(low)[0] - offset) + \
+            self[low:]
+
+    def __repr__(self):
+        return 'Transition({} steps, {}s)'.format(self._length, self.duration)
+
+
+def plan_transition(begin, end, duration, resolution=1000, frequency=100,
+                    curve='linear'):
+    '''Plan the smallest set of writes giving a smooth transition.
+
+    Only distinct hardware levels are emitted, never faster than the
+    PWM frequency, and the duration is evenly shared between them (or
+    follows the curve). The first and last values are begin and end, as
+    given. Linear transitions are computed on demand.
+
+    Args:
+        begin (float): first value, in percent
+        end (float): last value, in percent
+        duration (float): transition duration in seconds
+        resolution (int): number of hardware PWM steps
+        frequency (int): PWM frequency in Hz (maximum update rate)
+        curve: transition curve name or keyframes (see rlieh_pwm.curves)
+
+    Returns:
+        Transition: lazy (offset, value) pairs
+    '''
+    levels = abs(math.floor(end * resolution / 100. + .5) -
+                 math.floor(begin * resolution / 100. + .5))
+    if curve != 'linear':
+        return _plan_curve(begin, end, duration, resolution, frequency,
+                           curve, levels)
+    ticks = min(levels, int(duration * frequency))
+    if ticks < 1:
+        return Transition.hold(end, duration)
+    pause_time = float(duration) / ticks
+
+    def point(tick):
+        return (tick * pause_time,
+                _plan_value(begin, end, tick, ticks, resolution))
+    return Transition(ticks + 1, point, duration)
+
+
+# curved transitions are sampled up to this many times per hardware level
+CURVE_OVERSAMPLING = 16
+
+
+def _plan_curve(begin, end, duration, resolution, frequency, curve, levels):
+    '''plan_transition for non linear curves.'''
+    from rlieh_pwm.curves import transition_table
+    import numpy as np
+
+    ticks = min(levels * CURVE_OVERSAMPLING, int(duration * frequency))
+    if ticks < 1:
+        return Transition.hold(end, duration)
+    values = transition_table(begin, end, ticks + 1, curve)
+    hw_levels = np.floor(values * resolution / 100. + .5)
+    # keep the first tick of each hardware level
+    kept = np.flatnonzero(np.diff(hw_levels)) + 1
+    if not len(kept):
+        kept = np.array([ticks])
+    offsets = [0.] + (kept * (float(duration) / ticks)).tolist()
+    values = [begin] + (hw_levels[kept] * 100. / resolution).tolist()
+    values[-1] = end
+    return Transition.from_pairs(zip(offsets, values), duration)
+
+
+# fx-light presets: values reached at evenly spaced times of the effect
+PWM_THRESHOLDS = {'dawn': [0, 20],
+                  'sunrise': [20, 75],
+                  'noon': [75, 99, 100, 99, 75],
+                  'sunset': [75, 20],
+                  'dusk': [20, 0]}
+
+
+class Envelope(object):
+    """Piecewise transition through keyframes.
+
+    Keyframe times are fractions of the envelope duration (0 to 1), so
+    an envelope is compiled once per duration into a single Transition
+    played on one time base.
+
+    Usage:
+
+    >>> noon = Envelope([(0, 75), (0.25, 99), (0.5, 100), (0.75, 99), (1, 75)])
+    >>> light.play(noon, duration=60)
+
+    Attributes:
+        - keyframes (list): (time, value) pairs, the first value may be
+          None to start from the current value.
+        - curve: transition curve of each segment (see rlieh_pwm.curves).
+    """
+
+    def __init__(self, keyframes, curve='linear'):
+        keyframes = [(float(time), value if value is None else float(value))
+                     for time, value in keyframes]
+        times = [time for time, _ in keyframes]
+        if (len(keyframes) < 2 or times[0] != 0 or times[-1] != 1 or
+                times != sorted(times)):
+            raise ValueError(
+                _('Envelope times must go from 0 to 1. (was {})'.format(times))
+            )
+        for index, (_time, value) in enumerate(keyframes):
+            if value is None and index == 0:
+                continue
+            if value is None or not 0 <= value <= 100:
+                raise ValueError(
+                    _('Envelope values must be between 0 and 100. '
+                      '(was {})'.format(value))
+                )
+        self.keyframes = keyframes
+        self.curve = curve
+
+    @classmethod
+    def from_thresholds(cls, thresholds, curve='linear'):
+        '''build an envelope reaching values at evenly spaced times.
+
+        Args:
+            thresholds (list): values, eg. PWM_THRESHOLDS['noon']
+        '''
+        last = float(len(thresholds) - 1)
+        return cls([(index / last, value)
+                    for index, value in enumerate(thresholds)], curve)
+
+    def compile(self, duration, begin=None, resolution=1000, frequency=100):
+        '''compile the envelope into a single transition.
+
+        Args:
+            duration (float): envelope duration in seconds
+            begin (float): first value, overrides the first keyframe
+            resolution (int): number of hardware PWM steps
+            frequency (int): PWM frequency in Hz
+
+        Returns:
+            Transition: lazy (offset, value) pairs of the whole envelope
+        '''
+        if begin is None:
+            begin = self.keyframes[0][1]
+        if begin is None:
+            raise ValueError(_('Envelope first value is needed.'))
+        keyframes = [(0., float(begin))] + self.keyframes[1:]
+        transition = None
+        segments = list(zip(keyframes, keyframes[1:]))
+        for index, ((start, first), (stop, last)) in enumerate(segments):
+            seconds = (stop - start) * duration
+            if first == last:
+                segment = Transition.hold(last, seconds)
+            else:
+                segment = plan_transition(first, last, seconds, resolution,
+                                          frequency, self.curve)
+                # the next segment writes the value reached at its start
+                if (index < len(segments) - 1 and len(segment) > 1 and
+                        segment[-1][0] >= segment.duration):
+                    segment = segment[:-1]
+            transition = segment if transition is None else \
+                transition + segment
+        return transition
+
+    def __repr__(self):
+        return 'Envelope({})'.format(self.keyframes)
+
+
+ENVELOPES = dict((name, Envelope.from_thresholds(thresholds))
+                 for name, thresholds in PWM_THRESHOLDS.items())
+
+
+ScheduleReport = namedtuple('ScheduleReport',
+                            ['writes', 'skipped', 'max_lateness', 'cancelled'],
+                            defaults=[False])
+ScheduleReport.__doc__ = """Outcome of a schedule run.
+
+    Attributes:
+        - writes (int): number of values applied.
+        - skipped (int): number of late values merged into a later one.
+        - max_lateness (float): worst delay of a write after its deadline,
+          in seconds.
+        - cancelled (bool): True if the schedule was stopped before its end.
+"""
+
+
+def _schedule_steps(timeline, apply, end, clock, cancelled=None,
+                    observe=None):
+    '''deadline loop, yields the delays to wait between values.
+
+    Returns:
+        ScheduleReport (as StopIteration value)
+    '''
+    timeline = iter(timeline)
+    writes = skipped = 0
+    max_lateness = 0.
+    start = clock()
+    pending = next(timeline, None)
+    while pending is not None:
+        offset, value = pending
+        delay = start + offset - clock()
+        if delay > 0:
+            yield delay
+        if cancelled is not None and cancelled():
+            return ScheduleReport(writes, skipped, max_lateness, True)
+        # a late loop merges every value already due into the latest one
+        following = next(timeline, None)
+        now = clock()
+        merged = 0
+        while following is not None and start + following[0] <= now:
+            offset, value = following
+            merged += 1
+            following = next(timeline, None)
+        lateness = now - start - offset
+        if lateness > max_lateness:
+            max_lateness = lateness
+        skipped += merged
+        if observe is not None:
+            observe(lateness, merged)
+        apply(value)
+        writes += 1
+        pending = following
+    if end is not None:
+        delay = start + end - clock()
+        if delay > 0:
+            yield delay
+        if cancelled is not None and cancelled():
+            return ScheduleReport(writes, skipped, max_lateness, True)
+    return ScheduleReport(writes, skipped, max_lateness)
+
+
+def schedule(timeline, apply, end=None, clock=None, sleeper=None,
+             cancelled=None, observe=None):
+    '''Apply values on absolute deadlines.
+
+    Deadlines are computed from the start time on a monotonic clock, so
+    the time spent applying values never delays the following ones. When
+    the loop runs late, every value already due is merged into the
+    latest one instead of being pushed further back.
+
+    Args:
+        timeline: iterable of (offset, value) pairs, offset in seconds
+                  from the start, ascending
+        apply: callable receiving each value
+        end (float): offset in seconds of the schedule end
+                     (default: last offset)
+        clock: time source in seconds (default: time.monotonic)
+        sleeper: sleep function (default: time.sleep), it may return
+                 early when the schedule is cancelled
+        cancelled: callable returning True to stop the schedule, checked
+                   before each value
+        observe: callable receiving the lateness in seconds and the
+                 number of merged values of each write (eg.
+                 PinMetrics.step)
+
+    Returns:
+        ScheduleReport
+    '''
+    clock = clock or monotonic
+    sleeper = sleeper or sleep
+    steps = _schedule_steps(timeline, apply, end, clock, cancelled, observe)
+    try:
+        while True:
+            sleeper(next(steps))
+    except StopIteration as e:
+        return e.value
+
+
+async def schedule_async(timeline, apply, end=None, clock=None,
+                         cancelled=None, observe=None):
+    '''Apply values on absolute deadlines without blocking the event loop.
+
+    asyncio counterpart of schedule(): one event loop can run many
+    schedules concurrently (eg. one per pin).
+
+    Args:
+        timeline: iterable of (offset, value) pairs, offset in seconds
+                  from the start, ascending
+        apply: callable receiving each value
+        end (float): offset in seconds of the schedule end
+                     (default: last offset)
+        clock: time source in seconds (default: time.monotonic)
+        cancelled: callable returning True to stop before the next write
+        observe: callable receiving the lateness and the number of merged
+                 values of each write
+
+    Returns:
+        ScheduleReport
+    '''
+    import asyncio
+    steps = _schedule_steps(timeline, apply, end, clock or monotonic,
+                            cancelled=cancelled, observe=observe)
+    try:
+        while True:
+            await asyncio.sleep(next(steps))
+    except StopIteration as e:
+        return e.value
+
+
+class SimulatedClock(object):
+    """Clock moving forward only when slept, for simulations.
+
+    A simulated clock and sleeper run hours of schedule in milliseconds:
+
+    >>> clock = SimulatedClock()
+    >>> light = RliehPWM(18, clock=clock, sleeper=clock.sleep)
+    >>> light.modulate(0, 100, duration=720)
+    >>> clock.now
+    43200.0
+
+    Attributes:
+        - now (float): current time in seconds.
+    """
+
+    def __init__(self, start=0.):
+        self.now = float(start)
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, delay):
+        '''move the clock forward of delay seconds.'''
+        if delay > 0:
+            self.now += delay
+
+
+class RecordingWriter(BlasterWriter):
+    """Stand-in for pi-blaster recording every value with its time.
+
+    Attributes:
+        - writes (list): (time, pin, value) tuples, in write order.
+        - frames (int): number of writes to the device (one per frame).
+    """
+
+    def __init__(self, clock=None):
+        '''
+        Args:
+            clock: time source in seconds (default: time.monotonic)
+        '''
+        self.clock = clock or monotonic
+        self.writes = []
+        self.frames = 0
+
+    def write(self, pin, value):
+        self.write_frame(((pin, value),))
+
+    def write_frame(self, frame):
+        now = self.clock()
+        self.frames += 1
+        self.writes.extend((now, pin, value) for pin, value in frame)
 
 
 class RliehPWM(object):
@@ -74,76 +1575,35 @@ class RliehPWM(object):
     """
 
     def __init__(self, pin=18, pwm=None,
-                 log_level='critical', log_path='/var/log/rlieh'):
+                 log_level='critical', log_path='/var/log/rlieh',
+                 writer=None, clock=None, sleeper=None, metrics=None,
+                 state=None, locks=None):
         """Sets up the Raspberry Pi GPIOs and sets the working directory.
         Args:
             pin (int): Raspberry Pi's gpio used for PWM.
+            writer (BlasterWriter): pi-blaster write backend
+                (default: DeviceWriter on /dev/pi-blaster)
+            clock: time source of modulations, in seconds
+                (default: time.monotonic)
+            sleeper: sleep function of modulations (default: interruptible
+                time.sleep), see SimulatedClock
+            metrics (Metrics): metrics registry (default: METRICS)
+            state (StateTable): table publishing the pin state to other
+                processes (default: None), see rlieh_pwm.state
+            locks (PinLocks): pin arbitration with other processes
+                (default: None)
         """
 
-        # Logger
-        LOGGING_LEVELS = {'debug': 'DEBUG', 'info': 'INFO',
-                          'warning': 'WARNING', 'error': 'ERROR',
-                          'critical': 'CRITICAL'}
-
-        log_level = log_level.lower()
-        if log_level in LOGGING_LEVELS:
-            self.log_level = LOGGING_LEVELS[log_level]
-        else:
-            log_levels = ', '.join(LOGGING_LEVELS.keys())
-            raise ValueError(
-                _('Unknown log_level "{}". '
-                  'Log level should be a value in: {}.'.format(
-                    log_level, log_levels))
-            )
+        # Logger, configured once per process
+        self.log_level = configure_logging(log_level, log_path)
         self.log_path = log_path
-        LOGGING = {
-            'version': 1,
-            'disable_existing_loggers': False,
-            'formatters': {
-                'basic': {
-                    'format': ('%(asctime)-6s: %(name)s - '
-                               '%(levelname)s - %(message)s'),
-                },
-                'short': {
-                    'format': ('[%(levelname)s]  %(message)s'),
-                }
-            },
-            'handlers': {
-                'console': {
-                    'level': self.log_level,
-                    'class': 'logging.StreamHandler',
-                    'formatter': 'short',
-                },
-                'main_file': {
-                    'level': self.log_level,
-                    'class': 'logging.handlers.WatchedFileHandler',
-                    'formatter': 'basic',
-                    'filename': os.path.join(self.log_path, 'pwm.log'),
-                },
-                'error_file': {
-                    'level': 'ERROR',
-                    'class': 'logging.handlers.WatchedFileHandler',
-                    'formatter': 'basic',
-                    'filename': os.path.join(self.log_path, 'pwm_error.log'),
-                }
-            },
-            'loggers': {
-                'rlieh': {
-                    'handlers': ['console', 'main_file', 'error_file'],
-                    'level': self.log_level,
-                    'propagate': False
-                },
-            },
-            'root': {
-                'handlers': ['console', 'main_file', 'error_file'],
-                'level': self.log_level,
-            }
-        }
-        if self.log_level:
-            logging.config.dictConfig(LOGGING)
         self.logger = logging.getLogger(__name__)
 
         self.blaster = '/dev/pi-blaster'
+        if writer is None:
+            writer = DeviceWriter(self.blaster)
+        self.clock = clock or monotonic
+        self.sleeper = sleeper
 
         # gpio numbers working with pwm using pi-blaster
         BCM_PINS = [3, 5, 7, 8, 10, 11, 12, 13, 15, 16, 18, 19, 21, 22, 23, 24,
@@ -156,13 +1616,23 @@ class RliehPWM(object):
             raise ValueError(_('Bad pin value ({})'.format(str(pin))))
         else:
             self.pin = pin
-            self.logger.debug('pin: {}'.format(self.pin))
+            self.logger.debug('pin: %s', self.pin)
+        # backend of the pin
+        self.writer = writer.route(pin)
+        self.metrics = (metrics or METRICS).pin(pin)
+        self.state = state
+        self.lock = None if locks is None else locks.lock(pin)
+        # running transition target and end time, published in state
+        self._target = self._end = None
         self.__pwm = pwm
+        # running modulations stop when set
+        self._interrupt = threading.Event()
+        self._task = None
 
     @property
     def pwm(self):
         '''get pwm value for the given pin.'''
-        self.logger.debug('pwm: {}%'.format(self.__pwm))
+        self.logger.debug('pwm: %s%%', self.__pwm)
         return self.__pwm
 
     @pwm.setter
@@ -174,19 +1644,286 @@ class RliehPWM(object):
             (float, 2 decimal point)
         '''
 
-        self._blast(self._convert_percent_to_blaster(float(percent)))
+        value = self._convert_percent_to_blaster(float(percent))
+        if self.lock is None or self.lock.held:
+            self._blast(value)
+        else:
+            self.lock.acquire()
+            try:
+                self._blast(value)
+            finally:
+                self.lock.release()
+        self.__pwm = percent
+        if self.state is not None:
+            self.state.update(self.pin, percent, self._target, self._end)
+
+    def _store(self, percent):
+        '''remember pwm value written by someone else (eg. a group frame).'''
         self.__pwm = percent
+        if self.state is not None:
+            self.state.update(self.pin, percent, self._target, self._end)
+
+    def _transition_state(self, target=None, duration=None):
+        '''publish the target and duration (seconds) of a transition.
+
+        Called without arguments when the transition is over.
+        '''
+        if target is None:
+            self._target = self._end = None
+        else:
+            self._target, self._end = target, wall_time() + duration
+        if self.state is not None and self.__pwm is not None:
+            self.state.update(self.pin, self.__pwm, self._target, self._end)
+
+    def cancel(self):
+        '''Stop the running modulation, the output keeps its current value.
+
+        Can be called from another thread, the modulation stops without
+        waiting for its next step.
+        '''
+        self._interrupt.set()
+        task = self._task
+        if task is not None:
+            task.get_loop().call_soon_threadsafe(task.cancel)
+
+    def modulate(self, begin, end, duration, curve='linear'):
+        '''Set modulation value from a range of values for a duration.
 
-    def modulate(self, begin, end, duration):
+        Steps are planned for the writer resolution and frequency (see
+        plan_transition) and run on deadlines: the whole modulation lasts
+        duration minutes whatever the time spent writing values.
+        The modulation stops early when cancel() is called.
+
+        Args:
+            begin (float): first range value, None starts from the
+                           current value
+            end (float): last range value
+            duration (float): total time of duration in minutes
+            curve: transition curve name or keyframes
+                   (see rlieh_pwm.curves, default: linear)
+        Returns:
+            ScheduleReport : writes, skipped steps and lateness
+        '''
+        timeline, stop = self._modulation_timeline(begin, end, duration,
+                                                   curve)
+        return self._play('modulate', timeline, stop)
+
+    async def modulate_async(self, begin, end, duration, curve='linear'):
         '''Set modulation value from a range of values for a duration.
 
+        Non-blocking counterpart of modulate(), to be awaited from an
+        asyncio event loop:
+
+        >>> await asyncio.gather(RliehPWM(18).modulate_async(0, 20, 30),
+        ...                      RliehPWM(23).modulate_async(80, 0, 5))
+
+        cancel() (or cancelling the awaiting task) stops the modulation
+        at once, raising asyncio.CancelledError.
+
         Args:
-            begin (float): first range value
+            begin (float): first range value, None starts from the
+                           current value
             end (float): last range value
             duration (float): total time of duration in minutes
+            curve: transition curve name or keyframes
+                   (see rlieh_pwm.curves, default: linear)
+        Returns:
+            ScheduleReport : writes, skipped steps and lateness
+        '''
+        timeline, stop = self._modulation_timeline(begin, end, duration,
+                                                   curve)
+        return await self._play_async('modulate_async', timeline, stop)
+
+    def play(self, envelope, duration, begin=None):
+        '''Run an envelope for a duration, as a single schedule.
+
+        Args:
+            envelope (Envelope): keyframes to go through
+            duration (float): total time of duration in minutes
+            begin (float): first value, overrides the first keyframe
+                           (default: first keyframe, or current value)
+        Returns:
+            ScheduleReport : writes, skipped steps and lateness
+        '''
+        timeline = self._envelope_timeline(envelope, duration, begin)
+        return self._play('play', timeline, timeline.duration)
+
+    async def play_async(self, envelope, duration, begin=None):
+        '''Run an envelope for a duration, non-blocking play().'''
+        timeline = self._envelope_timeline(envelope, duration, begin)
+        return await self._play_async('play_async', timeline,
+                                      timeline.duration)
+
+    def storm(self, duration, seed=None, strikes=None, ambient=None):
+        '''Overlay lightning on an ambient level, then return to it.
+
+        The storm is drawn up front (see rlieh_pwm.storm) and played on
+        deadlines, as a single schedule.
+
+        Args:
+            duration (float): storm duration in minutes
+            seed (int): random seed, a seed always plays the same storm
+                        (default: random storm)
+            strikes (float): mean lightning strikes per minute
+                             (default: rlieh_pwm.storm.STRIKES_PER_MINUTE)
+            ambient: ambient value, or Transition of the ambient level
+                     (default: current value, or 0 if unknown)
+        Returns:
+            ScheduleReport : writes, skipped steps and lateness
+        '''
+        timeline = self._storm_timeline(duration, seed, strikes, ambient)
+        return self._play('storm', timeline, timeline.duration)
+
+    async def storm_async(self, duration, seed=None, strikes=None,
+                          ambient=None):
+        '''Overlay lightning on an ambient level, non-blocking storm().'''
+        timeline = self._storm_timeline(duration, seed, strikes, ambient)
+        return await self._play_async('storm_async', timeline,
+                                      timeline.duration)
+
+    def _play(self, name, timeline, stop):
+        '''run a timeline on deadlines until its end, cancel() or the loss
+        of the pin lock.'''
+        self._interrupt.clear()
+        lock = self.lock
+        if lock is None:
+            sleeper = self.sleeper or self._interrupt.wait
+            cancelled = self._interrupt.is_set
+        else:
+            lock.acquire()
+            sleeper = self.sleeper or self._wait_owned
+            cancelled = self._lost
+        if len(timeline):
+            self._transition_state(timeline[-1][1], stop)
+        try:
+            report = schedule(timeline, self._set_pwm, end=stop,
+                              clock=self.clock, sleeper=sleeper,
+                              cancelled=cancelled,
+                              observe=self.metrics.step)
+        finally:
+            if lock is None or lock.owned():
+                self._transition_state()
+            else:
+                # preempted: the new owner publishes the pin state
+                self._target = self._end = None
+            if lock is not None:
+                lock.release()
+        self._log_report(name, report)
+        return report
+
+    def _lost(self):
+        '''check if the modulation is cancelled or its pin lock lost.'''
+        return self._interrupt.is_set() or not self.lock.owned()
+
+    def _wait_owned(self, delay):
+        '''sleep, waking up on cancel() or within a tick of a lock loss.'''
+        deadline = monotonic() + delay
+        while self.lock.owned():
+            remaining = deadline - monotonic()
+            if remaining <= 0 or self._interrupt.wait(
+                    min(remaining, self.lock.TICK)):
+                return
+
+    async def _play_async(self, name, timeline, stop):
+        '''run a timeline on deadlines from an asyncio event loop, until
+        its end, its task cancellation or the loss of the pin lock.'''
+        import asyncio
+        self._task = asyncio.current_task()
+        lock = self.lock
+        if lock is not None:
+            # acquire() may wait for the owner (queue): off the event loop
+            acquiring = asyncio.get_running_loop().run_in_executor(
+                None, lock.acquire)
+            try:
+                await asyncio.shield(acquiring)
+            except asyncio.CancelledError:
+                acquiring.add_done_callback(
+                    lambda future: future.exception() or lock.release())
+                self._task = None
+                raise
+        if len(timeline):
+            self._transition_state(timeline[-1][1], stop)
+        try:
+            report = await schedule_async(
+                timeline, self._set_pwm, end=stop, clock=self.clock,
+                cancelled=None if lock is None else self._lost,
+                observe=self.metrics.step)
+        finally:
+            self._task = None
+            if lock is None or lock.owned():
+                self._transition_state()
+            else:
+                # preempted: the new owner publishes the pin state
+                self._target = self._end = None
+            if lock is not None:
+                lock.release()
+        self._log_report(name, report)
+        return report
+
+    def _envelope_timeline(self, envelope, duration, begin=None):
+        '''compile an envelope for this channel.
+
+        Returns:
+            Transition
+        '''
+        if begin is None:
+            begin = envelope.keyframes[0][1]
+        if begin is None:
+            begin = self.__pwm
+        if begin is None:
+            raise ValueError(
+                _('Current value of pin {} is unknown, a first value '
+                  'is needed.'.format(self.pin))
+            )
+        timeline = envelope.compile(float(duration) * 60., float(begin),
+                                    self.writer.resolution,
+                                    self.writer.frequency)
+        self.logger.debug('_envelope_timeline: %s', timeline)
+        return timeline
+
+    def _storm_timeline(self, duration, seed=None, strikes=None,
+                        ambient=None):
+        '''draw a storm for this channel.
+
+        Returns:
+            Transition
+        '''
+        from rlieh_pwm.storm import STRIKES_PER_MINUTE, storm_timeline
+        if ambient is None:
+            ambient = self.__pwm or 0
+        if not isinstance(ambient, Transition):
+            # same checks as the pwm setter
+            self._convert_percent_to_blaster(float(ambient))
+        if strikes is None:
+            strikes = STRIKES_PER_MINUTE
+        elif float(strikes) <= 0:
+            raise ValueError(
+                _('Strikes per minute must be greater than 0. (was {})'
+                  .format(strikes))
+            )
+        timeline = storm_timeline(float(duration) * 60., ambient, seed,
+                                  float(strikes), self.writer.resolution,
+                                  self.writer.frequency)
+        self.logger.debug('_storm_timeline: %s', timeline)
+        return timeline
+
+    def _modulation_timeline(self, begin, end, duration, curve='linear'):
+        '''check a modulation range and build its timeline.
+
         Returns:
-            integer : average sleep time in seconds
+            tuple: Transition, end offset in seconds
         '''
+        if begin is None:
+            # hand off from the current value
+            begin = self.__pwm
+            if begin is None:
+                raise ValueError(
+                    _('Current value of pin {} is unknown, range BEGIN '
+                      'is needed.'.format(self.pin))
+                )
+            begin = float(begin)
+            if begin == end:
+                return Transition.hold(end, 0), 0.
         if begin == end:
             error_msg = 'Range BEGIN and range START can\'t be equal. {}={}' \
                       .format(begin, end)
@@ -200,52 +1937,54 @@ class RliehPWM(object):
                       .format(end)
             raise ValueError(error_msg)
 
-        steps = self._calc_steps(begin, end)
-        pause_time = self._calc_pause_time(duration, len(steps))
-        for step in steps:
-            self.pwm = step
-            sleep(pause_time)
-
-    def _blast(self, value):
-        '''call pi-blaster'''
+        seconds = float(duration) * 60.
+        timeline = plan_transition(begin, end, seconds,
+                                   self.writer.resolution,
+                                   self.writer.frequency, curve)
+        self.logger.debug('_modulation_timeline: %s', timeline)
+        return timeline, seconds
 
-        cmd = self._build_blaster_cmd(value)
+    def _set_pwm(self, percent):
+        self.pwm = percent
 
-        try:
-            call(cmd, shell=True)
-            self.logger.debug('_blast : {}'.format(value))
-        except CalledProcessError as e:
-            self.logger.critical(
-                _('_blast failed, returned code {}'.format(e.returncode))
+    def _log_report(self, name, report):
+        '''log a schedule report, warns when steps were skipped.'''
+        if report.cancelled:
+            self.logger.info(
+                _('{}: cancelled at {}%'.format(name, self.__pwm))
             )
-            sys.exit(
-                _('PWM modulation value {} on pin {} failed'
-                    .format(self.pin, value))
+        elif report.skipped:
+            self.logger.warning(
+                _('{}: {} steps skipped, up to {:.3f}s late'.format(
+                    name, report.skipped, report.max_lateness))
             )
+        else:
+            self.logger.info(
+                _('{}: {} steps, up to {:.3f}s late'.format(
+                    name, report.writes, report.max_lateness))
+            )
+
+    def _blast(self, value):
+        '''send value to pi-blaster'''
+
+        metrics = self.metrics
+        start = perf_counter()
+        try:
+            self.writer.write(self.pin, value)
+            if not self.writer.metered:
+                metrics.latency.observe(perf_counter() - start)
+                metrics.writes += 1
+            self.logger.debug('_blast : %s', value)
         except OSError as e:
+            metrics.failed += 1
             self.logger.critical(
                 _('_blast failed {}.'.format(e.strerror))
             )
             sys.exit(
                 _('PWM modulation value {} on pin {} failed'
-                    .format(self.pin, value))
+                    .format(value, self.pin))
             )
 
-    def _build_blaster_cmd(self, value):
-        '''Forge blaster command.
-
-        Args:
-            value: pi-blaster pwm value
-
-        Retruns:
-            pi-blaster command
-        '''
-
-        blaster = '{0}={1}'.format(self.pin, value)
-        cmd = "/bin/echo " + blaster + " > " + self.blaster
-        self.logger.debug(_('cmd blaster command: {}'.format(cmd)))
-        return cmd
-
     def _convert_percent_to_blaster(self, percent):
         '''convert PWM percent in pi-blaster value.
 
@@ -256,7 +1995,12 @@ class RliehPWM(object):
             float: pi-blaster PWM value (number between 0 and 1, with 3 digits)
         '''
 
-        if percent < 0:
+        if not math.isfinite(percent):
+            self.logger.critical(
+                _('PWM value must be a number. (was {})'.format(percent))
+            )
+            raise ValueError(_('Bad PWM percent ({})'.format(percent)))
+        elif percent < 0:
             self.logger.critical(
                 _('PWM value must be greater or equal to 0. (was {})'
                     .format(percent))
@@ -271,7 +2015,7 @@ class RliehPWM(object):
         else:
             value = round(percent / 100., 4)
 
-        self.logger.debug(_('{}% PWM = {}'.format(percent, value)))
+        self.logger.debug('%s%% PWM = %s', percent, value)
         return value
 
     def _calc_pause_time(self, duration, steps=1000):
@@ -285,7 +2029,7 @@ class RliehPWM(object):
         '''
 
         avg_pause_time = float(duration) * 60. / steps
-        self.logger.debug(_('_calc_pause_time: {}').format(avg_pause_time))
+        self.logger.debug('_calc_pause_time: %s', avg_pause_time)
         return avg_pause_time
 
     def _calc_steps(self, begin, end):
@@ -303,8 +2047,8 @@ class RliehPWM(object):
             tuple: list of steps
         '''
 
-        self.logger.debug(_('modulation begin: {}'.format(begin)))
-        self.logger.debug(_('modulation end: {}'.format(end)))
+        self.logger.debug('modulation begin: %s', begin)
+        self.logger.debug('modulation end: %s', end)
         begin *= 10
         end *= 10
         if end > begin:
@@ -313,9 +2057,245 @@ class RliehPWM(object):
         else:
             step = -1
             end -= 1
-        self.logger.debug(_('range begin: {}'.format(begin)))
-        self.logger.debug(_('range end: {}'.format(end)))
+        self.logger.debug('range begin: %s', begin)
+        self.logger.debug('range end: %s', end)
 
         steps = [x/10. for x in range(int(begin), int(end), step)]
-        self.logger.debug(_('_calc_steps: {}'.format(steps)))
+        self.logger.debug('_calc_steps: %s', steps)
         return steps
+
+
+class RliehPWMGroup(object):
+    """This class drives several PWM channels sharing one pi-blaster writer.
+
+    A frame holds one value per channel and is sent to pi-blaster in a
+    single write, so channels of a fixture (eg. RGBW) are updated at once.
+
+    Usage:
+
+    >>> leds = RliehPWMGroup([16, 18, 22, 24])
+    >>> leds.frame = [100, 50, 0, 42.42]
+    >>> leds.frame = {24: 0}
+
+    Attributes:
+        - channels (list): RliehPWM instance of each channel.
+        - writer (BlasterWriter): shared pi-blaster write backend.
+
+    Properties:
+        - frame (list): PWM value of each channel, in pins order.
+    """
+
+    # pi-blaster provides 8 PWM channels
+    MAX_CHANNELS = 8
+
+    def __init__(self, pins, writer=None, **kwargs):
+        """Sets up one RliehPWM channel per pin.
+
+        Args:
+            pins (list): Raspberry Pi's gpios used for PWM.
+            writer (BlasterWriter): pi-blaster write backend
+                (default: DeviceWriter on /dev/pi-blaster)
+            **kwargs: extra RliehPWM arguments (log_level, log_path, clock,
+                sleeper, metrics, state)
+        """
+        pins = list(pins)
+        if not 0 < len(pins) <= self.MAX_CHANNELS:
+            raise ValueError(
+                _('A group needs 1 to {} pins. (was {})'.format(
+                    self.MAX_CHANNELS, len(pins)))
+            )
+        if len(set(pins)) != len(pins):
+            raise ValueError(_('Duplicated pin in group ({})'.format(pins)))
+        if writer is None:
+            writer = DeviceWriter()
+        self.writer = writer
+        self.channels = [RliehPWM(pin=pin, writer=writer, **kwargs)
+                         for pin in pins]
+        self.clock = self.channels[0].clock
+        self.sleeper = self.channels[0].sleeper or sleep
+        self.logger = logging.getLogger(__name__)
+
+    @property
+    def pins(self):
+        '''get group pins, in channels order.'''
+        return [channel.pin for channel in self.channels]
+
+    @property
+    def frame(self):
+        '''get pwm value of each channel.'''
+        return [channel.pwm for channel in self.channels]
+
+    @frame.setter
+    def frame(self, percents):
+        '''set pwm value of several channels in one write.
+
+        Args:
+            percents : list of values in channels order, or dict
+                       {pin: value} to update only some channels
+        '''
+        if isinstance(percents, dict):
+            by_pin = dict((channel.pin, channel) for channel in self.channels)
+            try:
+                changes = [(by_pin[pin], percent)
+                           for pin, percent in percents.items()]
+            except KeyError as e:
+                raise ValueError(_('Pin {} not in group'.format(e.args[0])))
+        else:
+            percents = list(percents)
+            if len(percents) != len(self.channels):
+                raise ValueError(
+                    _('Frame needs {} values. (was {})'.format(
+                        len(self.channels), len(percents)))
+                )
+            changes = list(zip(self.channels, percents))
+        taken = self._acquire(channel for channel, _percent in changes)
+        try:
+            self._blast_frame(changes)
+        finally:
+            for lock in taken:
+                lock.release()
+
+    def modulate(self, begins, ends, duration):
+        '''Set modulation of all channels from ranges of values for a duration.
+
+        Channels move in lockstep on the ticks of the widest range: each
+        pi-blaster write carries the channels whose hardware level changed.
+
+        Args:
+            begins (list): first range value of each channel
+            ends (list): last range value of each channel
+            duration (float): total time of duration in minutes
+        Returns:
+            ScheduleReport : writes, skipped frames and lateness
+        '''
+        if not len(begins) == len(ends) == len(self.channels):
+            raise ValueError(
+                _('Ranges need {} values.'.format(len(self.channels)))
+            )
+        seconds = float(duration) * 60.
+        # channels may have backends of different resolutions
+        ranges = [(begin, end, channel.writer.resolution)
+                  for begin, end, channel in zip(begins, ends, self.channels)]
+        ticks = max(len(plan_transition(begin, end, seconds, resolution,
+                                        channel.writer.frequency)) - 1
+                    for (begin, end, resolution), channel
+                    in zip(ranges, self.channels))
+        pause_time = seconds / max(ticks, 1)
+
+        def point(tick):
+            return tick * pause_time, [
+                _plan_value(begin, end, tick, ticks, resolution)
+                for begin, end, resolution in ranges]
+        return self._play('modulate', Transition(ticks + 1, point, seconds))
+
+    def play(self, timeline):
+        '''Run a timeline of frames, as a single schedule.
+
+        Args:
+            timeline (Transition): (offset, frame) pairs, offsets in
+                seconds and frames of one value per channel
+        Returns:
+            ScheduleReport : writes, skipped frames and lateness
+        '''
+        return self._play('play', timeline)
+
+    def _play(self, name, timeline):
+        '''run a timeline of frames on deadlines until its end or the loss
+        of a pin lock.'''
+        seconds = timeline.duration
+        last = [None] * len(self.channels)
+
+        def apply(frame):
+            changes = [(channel, step) for channel, step, previous
+                       in zip(self.channels, frame, last) if step != previous]
+            last[:] = frame
+            if changes:
+                self._blast_frame(changes)
+
+        def observe(lateness, merged):
+            for channel in self.channels:
+                channel.metrics.step(lateness, merged)
+
+        locks = [channel.lock for channel in self.channels
+                 if channel.lock is not None]
+
+        def lost():
+            return not all(lock.owned() for lock in locks)
+
+        def wait(delay):
+            # wakes up within a tick of a pin lock loss
+            deadline = monotonic() + delay
+            while not lost():
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    return
+                sleep(min(remaining, PinLock.TICK))
+
+        taken = self._acquire(self.channels)
+        if len(timeline):
+            for channel, end in zip(self.channels, timeline[-1][1]):
+                channel._transition_state(end, seconds)
+        try:
+            report = schedule(timeline, apply, end=seconds, clock=self.clock,
+                              sleeper=wait if locks and self.sleeper is sleep
+                              else self.sleeper,
+                              cancelled=lost if locks else None,
+                              observe=observe)
+        finally:
+            for channel in self.channels:
+                if channel.lock is None or channel.lock.owned():
+                    channel._transition_state()
+            for lock in taken:
+                lock.release()
+        self.channels[0]._log_report(name, report)
+        return report
+
+    @staticmethod
+    def _acquire(channels):
+        '''take the pin locks of channels not held yet, in pins order.
+
+        Returns:
+            list: locks taken, to release
+        '''
+        taken = []
+        try:
+            for channel in sorted(channels, key=lambda c: int(c.pin)):
+                lock = channel.lock
+                if lock is not None and not lock.held:
+                    lock.acquire()
+                    taken.append(lock)
+        except BaseException:
+            for lock in taken:
+                lock.release()
+            raise
+        return taken
+
+    def _blast_frame(self, changes):
+        '''send a frame to pi-blaster.
+
+        Args:
+            changes: list of (channel, percent) pairs
+        '''
+        frame = [(channel.pin,
+                  channel._convert_percent_to_blaster(float(percent)))
+                 for channel, percent in changes]
+        start = perf_counter()
+        try:
+            self.writer.write_frame(frame)
+            latency = perf_counter() - start
+            for channel, _percent in changes:
+                if not channel.writer.metered:
+                    channel.metrics.latency.observe(latency)
+                    channel.metrics.writes += 1
+            self.logger.debug('_blast_frame : %s', frame)
+        except OSError as e:
+            for channel, _percent in changes:
+                channel.metrics.failed += 1
+            self.logger.critical(
+                _('_blast_frame failed {}.'.format(e.strerror))
+            )
+            sys.exit(
+                _('PWM modulation frame {} failed'.format(frame))
+            )
+        for channel, percent in changes:
+            channel._store(percent)
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# @Author: Olivier Watté <user>
+# @Date:   2026-10-17T09:00:00-04:00
+# @Email:  owatte@ipeos.com
+# @Last modified by:   user
+# @Last modified time: 2026-10-17T09:00:00-04:00
+# @License: GPLv3
+# @Copyright: Olivier Watté
+
+# Rlieh-pwm provides an interface to manage PWM on RLIEH systems.
+# Copyright (C) 2017 Olivier Watte
+#
+# This file is part of rlieh-pwm.
+#
+# Rlieh-pwm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rlieh-pwm is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rlieh-pwm.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+    This module provides transition curves for RLIEH PWM modulations.
+
+    A transition table holds the values of a whole transition, computed
+    in one NumPy pass. Tables are kept in a bounded LRU cache, so daily
+    effects (sunrise, sunset...) are only computed once.
+
+    Available curves:
+        - linear: constant speed
+        - gamma: linear in gamma-corrected (perceived) lightness
+        - log: linear in logarithmic (perceived) brightness
+        - smoothstep: slow start and end
+        - ease-in: slow start
+        - ease-out: slow end
+        - ease-in-out: slow start and end, steeper than smoothstep
+        - keyframes: tuple of (time, progress) pairs between 0 and 1,
+          eg. ((0, 0), (0.5, 0.8), (1, 1))
+
+    Usage:
+
+    >>> from rlieh_pwm.curves import transition_table
+    >>> transition_table(0, 100, 5, 'smoothstep')
+    array([  0.   ,  15.625,  50.   ,  84.375, 100.   ])
+"""
+from functools import lru_cache
+
+import numpy as np
+
+
+__all__ = ['CURVES', 'transition_table']
+
+# gamma of the 'gamma' curve
+GAMMA = 2.2
+
+# base of the 'log' curve: ratio between full and minimal perceived step
+LOG_BASE = 100.
+
+# number of transition tables kept in cache
+CACHE_SIZE = 64
+
+
+def _linear(begin, end, x):
+    return begin + (end - begin) * x
+
+
+def _gamma(begin, end, x):
+    lightness = np.power([begin / 100., end / 100.], 1. / GAMMA)
+    return 100. * np.power(_linear(lightness[0], lightness[1], x), GAMMA)
+
+
+def _log(begin, end, x):
+    scale = np.log(LOG_BASE)
+    brightness = np.log1p((LOG_BASE - 1.) * np.array([begin, end]) / 100.)
+    brightness /= scale
+    return 100. * np.expm1(_linear(brightness[0], brightness[1], x) * scale) \
+        / (LOG_BASE - 1.)
+
+
+def _easing(function):
+    '''build a curve moving at the pace of an easing function.'''
+    def curve(begin, end, x):
+        return _linear(begin, end, function(x))
+    return curve
+
+
+def _ease_in_out(x):
+    return np.where(x < .5, 4. * x ** 3, 1. - (2. - 2. * x) ** 3 / 2.)
+
+
+CURVES = {
+    'linear': _linear,
+    'gamma': _gamma,
+    'log': _log,
+    'smoothstep': _easing(lambda x: x * x * (3. - 2. * x)),
+    'ease-in': _easing(lambda x: x * x),
+    'ease-out': _easing(lambda x: x * (2. - x)),
+    'ease-in-out': _easing(_ease_in_out),
+}
+
+
+def _check_curve(curve):
+    '''check a curve name or keyframes and make it hashable.
+
+    Returns:
+        str or tuple: curve name, or keyframes as a tuple of pairs
+    '''
+    if isinstance(curve, str):
+        if curve not in CURVES:
+            raise ValueError(
+                'Unknown curve "{}". Curve should be a value in: {}.'.format(
+                    curve, ', '.join(sorted(CURVES)))
+            )
+        return curve
+    keyframes = tuple((float(x), float(y)) for x, y in curve)
+    times = [x for x, _ in keyframes]
+    if (len(keyframes) < 2 or times[0] != 0 or times[-1] != 1 or
+            times != sorted(times)):
+        raise ValueError(
+            'Keyframes times must go from 0 to 1. (was {})'.format(times)
+        )
+    return keyframes
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _table(begin, end, steps, curve):
+    x = np.linspace(0., 1., steps)
+    if isinstance(curve, tuple):
+        times, progress = zip(*curve)
+        values = _linear(begin, end, np.interp(x, times, progress))
+    else:
+        values = CURVES[curve](begin, end, x)
+    values = np.clip(values, min(begin, end), max(begin, end))
+    values[0], values[-1] = begin, end
+    values.flags.writeable = False
+    return values
+
+
+def transition_table(begin, end, steps, curve='linear'):
+    '''get the values of a transition.
+
+    Tables are computed in one NumPy pass and cached, the returned array
+    is read-only.
+
+    Args:
+        begin (float): first value, in percent
+        end (float): last value, in percent
+        steps (int): number of values, begin and end included
+        curve: curve name (see CURVES) or keyframes
+
+    Returns:
+        numpy.ndarray: transition values
+    '''
+    if int(steps) < 2:
+        raise ValueError('A transition needs 2 steps at least.')
+    return _table(float(begin), float(end), int(steps), _check_curve(curve))
+
+
+transition_table.cache_info = _table.cache_info
+transition_table.cache_clear = _table.cache_clear
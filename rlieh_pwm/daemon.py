@@ -0,0 +1,424 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# @Author: Olivier Watté <user>
+# @Date:   2026-10-17T09:00:00-04:00
+# @Email:  owatte@ipeos.com
+# @Last modified by:   user
+# @Last modified time: 2026-10-17T09:00:00-04:00
+# @License: GPLv3
+# @Copyright: Olivier Watté
+
+# Rlieh-pwm provides an interface to manage PWM on RLIEH systems.
+# Copyright (C) 2017 Olivier Watte
+#
+# This file is part of rlieh-pwm.
+#
+# Rlieh-pwm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rlieh-pwm is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rlieh-pwm.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+    This module provides the rlieh-pwm daemon.
+
+    The daemon holds the RliehPWM instances and the pi-blaster writer
+    open, and executes commands received on a Unix socket, one per line:
+
+        set VALUE GPIO
+        on GPIO
+        off GPIO
+        range BEGIN END GPIO [MINUTES]
+        fx-light (dawn|sunrise|noon|sunset|dusk) GPIO [MINUTES]
+        fx-storm GPIO [MINUTES [SEED [STRIKES]]]
+        stop GPIO
+        get GPIO
+        metrics
+        frame GPIO=VALUE [GPIO=VALUE...]
+        at TIME COMMAND
+
+    Each command gets a one line reply: 'ok', 'ok VALUE' for get, 'ok
+    JSON' for metrics (see rlieh_pwm.core.Metrics), or 'error MESSAGE'.
+    Transitions (range, fx-light, fx-storm) run in the background: the
+    reply is sent as soon as they are started.
+
+    'frame' sets several pins in one pi-blaster write. 'at' runs a
+    command at a wall clock time (seconds since the epoch, as
+    time.time()), it is answered once the command is scheduled.
+
+    'fx-storm' overlays lightning on the current value of a pin, or on
+    its running transition, which goes on after the storm. A SEED of '-'
+    draws a random storm.
+
+    Commands can be pipelined: the lines received together are run in
+    order and their replies are sent in one write.
+
+    A new command on a pin preempts its running transition at once. A
+    preempting transition starts from the current output value, as does
+    a range whose BEGIN is '-'. Given pin locks (see
+    rlieh_pwm.core.PinLocks), commands also preempt the other processes
+    driving their pins, and stop when preempted by them.
+
+    Usage:
+
+    >>> from rlieh_pwm.daemon import run
+    >>> run('/run/rlieh/pwm.sock', log_level='error')
+"""
+import asyncio
+import logging
+import os
+from time import time as wall_time
+
+from rlieh_pwm.client import SOCKET_PATH
+from rlieh_pwm.core import (BackgroundWriter, DeviceWriter, Envelope, METRICS,
+                            PWM_THRESHOLDS, RliehPWM, RliehPWMGroup)
+
+__all__ = ['Controller', 'serve', 'run']
+
+# default modulation range duration (in minutes)
+DURATION = 0.5
+
+# longest command line (bytes)
+LINE_LIMIT = 65536
+
+
+class Controller(object):
+    """This class executes rlieh-pwm commands on shared RliehPWM instances.
+
+    Attributes:
+        - channels (dict): RliehPWM instance of each pin used so far.
+        - tasks (dict): running transition task of each pin.
+        - timelines (dict): running transition of each pin, and its start
+          time on the channel clock.
+        - scheduled (set): tasks of the commands waiting for their time.
+        - writer (BlasterWriter): pi-blaster writer shared by channels.
+    """
+
+    def __init__(self, writer=None, pwm_thresholds=None, **kwargs):
+        """
+        Args:
+            writer (BlasterWriter): pi-blaster write backend
+                (default: DeviceWriter on /dev/pi-blaster)
+            pwm_thresholds (dict): fx-light presets
+                (default: rlieh_pwm.core.PWM_THRESHOLDS)
+            **kwargs: extra RliehPWM arguments (log_level, log_path,
+                state, locks)
+        """
+        if writer is None:
+            writer = DeviceWriter()
+        if pwm_thresholds is None:
+            pwm_thresholds = PWM_THRESHOLDS
+        self.writer = writer
+        self.pwm_thresholds = pwm_thresholds
+        self.kwargs = kwargs
+        self.channels = {}
+        self.tasks = {}
+        self.timelines = {}
+        self.scheduled = set()
+        self._agenda = {}
+        self.logger = logging.getLogger(__name__)
+        self.commands = {
+            'set': self._set,
+            'on': self._on,
+            'off': self._off,
+            'range': self._range,
+            'fx-light': self._fx_light,
+            'fx-storm': self._fx_storm,
+            'stop': self._stop,
+            'get': self._get,
+            'metrics': self._metrics,
+            'frame': self._frame,
+            'at': self._at,
+        }
+
+    def channel(self, pin):
+        '''get the RliehPWM instance of a pin, created on first use.'''
+        pin = int(pin)
+        if pin not in self.channels:
+            self.channels[pin] = RliehPWM(pin=pin, writer=self.writer,
+                                          **self.kwargs)
+        return self.channels[pin]
+
+    async def execute(self, line):
+        '''execute a command line.
+
+        Args:
+            line (str): command, eg. 'set 42.42 18'
+
+        Returns:
+            str: reply, 'ok [value]' or 'error message'
+        '''
+        args = line.split()
+        if not args:
+            return 'error empty command'
+        if args[0] not in self.commands:
+            return 'error unknown command "{}"'.format(args[0])
+        try:
+            result = self.commands[args[0]](*args[1:])
+        except TypeError:
+            return 'error bad arguments for "{}"'.format(args[0])
+        except (ValueError, KeyError, SystemExit, RuntimeError) as e:
+            # RuntimeError: pin used by another process
+            return 'error {}'.format(e)
+        if result is None:
+            return 'ok'
+        return 'ok {}'.format(result)
+
+    async def handle(self, reader, writer):
+        '''serve a client connection, one reply per command line.
+
+        The command lines received together are run in order and their
+        replies sent in one write.
+        '''
+        pending = b''
+        try:
+            while True:
+                data = await reader.read(LINE_LIMIT)
+                lines = (pending + data).split(b'\n')
+                pending = lines.pop()
+                if not data and pending:
+                    # last line without end of line
+                    lines.append(pending)
+                elif len(pending) > LINE_LIMIT:
+                    writer.write(b'error command line too long\n')
+                    break
+                replies = [await self.execute(line.decode('ascii', 'replace'))
+                           for line in lines]
+                if replies:
+                    writer.write(''.join(reply + '\n' for reply in replies)
+                                 .encode('ascii', 'replace'))
+                    await writer.drain()
+                if not data:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def wait(self):
+        '''wait for every scheduled command and running transition to
+        end.'''
+        while self.tasks or self.scheduled:
+            await asyncio.gather(*(list(self.scheduled) +
+                                   list(self.tasks.values())),
+                                 return_exceptions=True)
+
+    def preempt(self, pin):
+        '''cancel the running transition of a pin.
+
+        Returns:
+            bool: True if a transition was running
+        '''
+        task = self.tasks.pop(int(pin), None)
+        self.timelines.pop(int(pin), None)
+        if task is None:
+            return False
+        # the task is suspended: once cancelled it never writes again
+        task.cancel()
+        self.logger.info('pin {}: transition preempted'.format(pin))
+        return True
+
+    def _set(self, value, pin):
+        value = float(value)
+        channel = self.channel(pin)
+        self.preempt(channel.pin)
+        channel.pwm = value
+
+    def _on(self, pin):
+        self._set(100, pin)
+
+    def _off(self, pin):
+        self._set(0, pin)
+
+    def _stop(self, pin):
+        self.preempt(self.channel(pin).pin)
+
+    def _get(self, pin):
+        return self.channel(pin).pwm
+
+    def _metrics(self):
+        return (self.kwargs.get('metrics') or METRICS).to_json()
+
+    def _frame(self, *values):
+        if not values:
+            raise TypeError
+        changes = []
+        for value in values:
+            pin, _sep, percent = value.partition('=')
+            channel = self.channel(pin)
+            percent = float(percent)
+            changes.append((channel, percent,
+                            channel._convert_percent_to_blaster(percent)))
+        for channel, _percent, _value in changes:
+            self.preempt(channel.pin)
+        taken = RliehPWMGroup._acquire(
+            channel for channel, _percent, _value in changes)
+        try:
+            # one pi-blaster write for every pin
+            self.writer.write_frame([(channel.pin, value)
+                                     for channel, _percent, value in changes])
+        except OSError as e:
+            for channel, _percent, _value in changes:
+                channel.metrics.failed += 1
+            raise SystemExit('PWM frame failed ({})'.format(e.strerror))
+        finally:
+            for lock in taken:
+                lock.release()
+        for channel, percent, _value in changes:
+            if not channel.writer.metered:
+                channel.metrics.writes += 1
+            channel._store(percent)
+
+    def _at(self, when, command, *args):
+        when = float(when)
+        if command not in self.commands or command == 'at':
+            raise ValueError('unknown command "{}"'.format(command))
+        line = ' '.join((command,) + args)
+        if when in self._agenda:
+            self._agenda[when].append(line)
+            return
+        # commands of the same time run in order, in the same tick
+        self._agenda[when] = [line]
+        task = asyncio.ensure_future(self._later(when))
+        self.scheduled.add(task)
+        task.add_done_callback(self.scheduled.discard)
+
+    async def _later(self, when):
+        '''execute the command lines of a wall clock time.'''
+        delay = when - wall_time()
+        if delay < 0:
+            self.logger.warning('commands at %s are %.3fs late', when,
+                                -delay)
+        try:
+            await asyncio.sleep(max(delay, 0))
+        finally:
+            lines = self._agenda.pop(when)
+        for line in lines:
+            reply = await self.execute(line)
+            if reply.startswith('error'):
+                self.logger.error('"%s": %s', line, reply)
+
+    def _range(self, begin, end, pin, duration=DURATION):
+        channel = self.channel(pin)
+        begin = None if begin == '-' else float(begin)
+        if begin is not None:
+            # same checks as RliehPWM.modulate
+            channel._modulation_timeline(begin, float(end), 0)
+        self._start(channel, Envelope([(0, begin), (1, float(end))]),
+                    float(duration))
+
+    def _fx_light(self, name, pin, duration=DURATION):
+        if name not in self.pwm_thresholds:
+            raise ValueError('unknown effect "{}"'.format(name))
+        envelope = Envelope.from_thresholds(self.pwm_thresholds[name])
+        self._start(self.channel(pin), envelope, float(duration))
+
+    def _start(self, channel, envelope, duration):
+        '''play an envelope on a channel in the background.
+
+        A running transition on the channel is preempted, the new one
+        then starts from the current value.
+        '''
+        begin = None
+        if channel.pin in self.tasks or envelope.keyframes[0][1] is None:
+            # hand off from the current value
+            begin = channel.pwm
+        # checks the envelope before answering
+        timeline = channel._envelope_timeline(envelope, duration, begin)
+        self._spawn(channel, timeline)
+
+    def _fx_storm(self, pin, duration=DURATION, seed='-', strikes=None):
+        channel = self.channel(pin)
+        ambient = None
+        if channel.pin in self.timelines:
+            # the running transition goes on under the storm
+            timeline, start = self.timelines[channel.pin]
+            ambient = timeline.after(channel.clock() - start)
+        timeline = channel._storm_timeline(
+            float(duration), None if seed == '-' else int(seed), strikes,
+            ambient)
+        self._spawn(channel, timeline)
+
+    def _spawn(self, channel, timeline):
+        '''play a timeline on a channel in the background, preempting its
+        running transition.'''
+        self.preempt(channel.pin)
+        task = asyncio.ensure_future(self._run(channel, timeline))
+        self.tasks[channel.pin] = task
+        self.timelines[channel.pin] = (timeline, channel.clock())
+
+    async def _run(self, channel, timeline):
+        try:
+            await channel._play_async('transition', timeline,
+                                      timeline.duration)
+        except (SystemExit, RuntimeError) as e:
+            self.logger.error('pin {}: {}'.format(channel.pin, e))
+        finally:
+            if self.tasks.get(channel.pin) is asyncio.current_task():
+                del self.tasks[channel.pin]
+                del self.timelines[channel.pin]
+
+
+async def serve(controller, path=SOCKET_PATH):
+    '''start serving controller commands on a Unix socket.
+
+    Args:
+        controller (Controller): command executor
+        path (str): socket path, a stale socket file is replaced
+
+    Returns:
+        asyncio.AbstractServer
+    '''
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if os.path.exists(path):
+        os.remove(path)
+    return await asyncio.start_unix_server(controller.handle, path)
+
+
+def run(path=SOCKET_PATH, writer=None, listen=None, **kwargs):
+    '''run the rlieh-pwm daemon until interrupted.
+
+    Args:
+        path (str): socket path
+        writer (BlasterWriter): pi-blaster write backend (default:
+            BackgroundWriter, the event loop never waits for pi-blaster)
+        listen (str): also serve commands on this TCP address
+            ('HOST:PORT', see rlieh_pwm.remote)
+        **kwargs: extra RliehPWM arguments (log_level, log_path)
+    '''
+    # storms and curves need NumPy: import it now, not on the event loop
+    # of the first command using it
+    import rlieh_pwm.storm
+    background = writer is None
+    if background:
+        writer = BackgroundWriter(metrics=kwargs.get('metrics'))
+
+    async def main():
+        controller = Controller(writer=writer, **kwargs)
+        server = await serve(controller, path)
+        if listen is not None:
+            from rlieh_pwm import remote
+            await remote.serve(controller, listen)
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+        if background:
+            writer.close()
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# @Author: Olivier Watté <user>
+# @Date:   2026-10-17T09:00:00-04:00
+# @Email:  owatte@ipeos.com
+# @Last modified by:   user
+# @Last modified time: 2026-10-17T09:00:00-04:00
+# @License: GPLv3
+# @Copyright: Olivier Watté
+
+# Rlieh-pwm provides an interface to manage PWM on RLIEH systems.
+# Copyright (C) 2017 Olivier Watte
+#
+# This file is part of rlieh-pwm.
+#
+# Rlieh-pwm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rlieh-pwm is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rlieh-pwm.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+    This module provides multi-channel fixtures (RGB, RGBW LED bars...).
+
+    A fixture names the channels of an RliehPWMGroup and fades them
+    through a color space:
+        - rgb: one percent per channel, in channels order or as a dict
+          {name: percent}
+        - hsv: (hue in degrees, saturation, value in percent), on the
+          red, green and blue channels
+        - kelvin: (color temperature in Kelvin, brightness in percent),
+          on the red, green and blue channels, linear in mireds
+
+    With a white channel, hsv and kelvin colors send their common part
+    of red, green and blue to it. Channels outside of the color space
+    keep their value.
+
+    The frames of a fade are computed in one NumPy pass over the whole
+    transition (ticks x channels array), only ticks changing a hardware
+    level are kept, and each one is a single write of the group: channels
+    stay in sync whatever their number. Linear rgb fades tick on the
+    levels of their widest channel range, other fades are sampled as
+    curved transitions (see core.plan_transition).
+
+    Usage:
+
+    >>> from rlieh_pwm.fixture import Fixture
+    >>> bar = Fixture({'red': 16, 'green': 18, 'blue': 22, 'white': 24})
+    >>> bar.set((30, 100, 50), space='hsv')
+    >>> bar.fade((2700, 0), (6500, 80), 30, space='kelvin', curve='gamma')
+"""
+import numpy as np
+
+from rlieh_pwm.core import CURVE_OVERSAMPLING, RliehPWMGroup, Transition
+from rlieh_pwm.curves import transition_table
+
+__all__ = ['Fixture', 'SPACES', 'hsv_to_rgb', 'kelvin_to_rgb']
+
+# color spaces and the number of components of their colors
+SPACES = {'rgb': None, 'hsv': 3, 'kelvin': 2}
+
+# channel names driven by the hsv and kelvin spaces
+RGB = ('red', 'green', 'blue')
+WHITE = 'white'
+
+# color temperatures range of the kelvin space
+KELVIN_RANGE = (1000., 40000.)
+
+
+def hsv_to_rgb(hsv):
+    '''convert hsv colors to red, green and blue percents.
+
+    Args:
+        hsv (numpy.ndarray): (n, 3) hue in degrees, saturation and value
+                             in percent
+
+    Returns:
+        numpy.ndarray: (n, 3) red, green and blue percents
+    '''
+    hue = hsv[:, 0:1] / 60.
+    saturation = hsv[:, 1:2] / 100.
+    value = hsv[:, 2:3]
+    k = (np.array([5., 3., 1.]) + hue) % 6.
+    return value * (1. - saturation *
+                    np.clip(np.minimum(k, 4. - k), 0., 1.))
+
+
+def kelvin_to_rgb(kelvin):
+    '''convert color temperatures and brightness to red, green and blue
+    percents (Tanner Helland's blackbody approximation).
+
+    Args:
+        kelvin (numpy.ndarray): (n, 2) temperature in Kelvin and
+                                brightness in percent
+
+    Returns:
+        numpy.ndarray: (n, 3) red, green and blue percents
+    '''
+    t = np.clip(kelvin[:, 0], *KELVIN_RANGE) / 100.
+    # bounded operands: np.where computes both branches
+    hot = np.maximum(t - 60., 1.)
+    red = np.where(t <= 66., 255., 329.698727446 * hot ** -0.1332047592)
+    green = np.where(t <= 66.,
+                     99.4708025861 * np.log(t) - 161.1195681661,
+                     288.1221695283 * hot ** -0.0755148492)
+    blue = np.where(t >= 66., 255.,
+                    np.where(t <= 19., 0., 138.5177312231 *
+                             np.log(np.maximum(t - 10., 1.)) -
+                             305.0447927307))
+    rgb = np.clip(np.stack([red, green, blue], axis=1), 0., 255.) / 255.
+    return rgb * kelvin[:, 1:2]
+
+
+class Fixture(object):
+    """This class fades the named channels of a light fixture together.
+
+    Attributes:
+        - names (list): channel names, in pins order.
+        - group (RliehPWMGroup): PWM channels of the fixture.
+
+    Properties:
+        - color (dict): PWM percent of each channel name.
+    """
+
+    def __init__(self, channels, writer=None, **kwargs):
+        '''
+        Args:
+            channels (dict): pin of each channel name, or list of
+                (name, pin) pairs
+            writer (BlasterWriter): write backend shared by channels
+            **kwargs: extra RliehPWMGroup arguments (log_level, clock,
+                sleeper, state, locks...)
+        '''
+        if isinstance(channels, dict):
+            channels = channels.items()
+        channels = list(channels)
+        self.names = [name for name, _pin in channels]
+        if len(set(self.names)) != len(self.names):
+            raise ValueError(
+                'Duplicated channel name ({})'.format(self.names))
+        self.group = RliehPWMGroup([pin for _name, pin in channels],
+                                   writer=writer, **kwargs)
+
+    @property
+    def color(self):
+        '''get PWM percent of each channel name.'''
+        return dict(zip(self.names, self.group.frame))
+
+    def set(self, color, space='rgb'):
+        '''set the channels to a color in one write.
+
+        Args:
+            color: color in space (see module documentation)
+            space (str): color space name
+        '''
+        current = self._current()
+        frame = self._frames(self._colors([color], space), space, current)
+        self.group.frame = frame[0].tolist()
+
+    def frames(self, begin, end, duration, space='rgb', curve='linear'):
+        '''Plan the frames of a fade.
+
+        Args:
+            begin: first color in space, None for the current values
+                   (rgb space only, 0 for the channels never written)
+            end: last color in space
+            duration (float): fade duration in minutes
+            space (str): color space name, colors are interpolated in it
+            curve: progress curve name or keyframes (see rlieh_pwm.curves)
+
+        Returns:
+            Transition: (offset, frame) pairs, frames in channels order
+        '''
+        seconds = float(duration) * 60.
+        current = self._current()
+        if begin is None:
+            if space != 'rgb':
+                raise ValueError(
+                    'Begin color is needed in {} space.'.format(space))
+            colors = np.vstack([current, self._colors([end], space)])
+        else:
+            colors = self._colors([begin, end], space)
+        channels = self.group.channels
+        resolutions = np.array([channel.writer.resolution
+                                for channel in channels], dtype=float)
+        frequency = max(channel.writer.frequency for channel in channels)
+        if space == 'rgb':
+            # as plan_transition, on the widest channel range
+            ends = np.floor(self._frames(colors, space, current) *
+                            resolutions / 100. + .5)
+            ticks = int(np.abs(ends[1] - ends[0]).max())
+            if curve != 'linear':
+                ticks *= CURVE_OVERSAMPLING
+        else:
+            ticks = int(resolutions.max()) * CURVE_OVERSAMPLING
+        ticks = min(ticks, int(seconds * frequency))
+        if ticks < 1:
+            frame = self._frames(colors[1:], space, current)[0]
+            return Transition.hold(frame.tolist(), seconds)
+
+        # (ticks + 1, components) colors, then (ticks + 1, channels) frames
+        progress = transition_table(0., 100., ticks + 1, curve) / 100.
+        progress = progress[:, None]
+        begin, end = colors
+        delta = end - begin
+        if space == 'hsv':
+            # shortest way around the hue circle
+            delta[0] = (delta[0] + 180.) % 360. - 180.
+        elif space == 'kelvin':
+            begin, end = begin.copy(), end.copy()
+            begin[0], end[0] = 1e6 / begin[0], 1e6 / end[0]
+            delta = end - begin
+        path = begin + delta * progress
+        if space == 'kelvin':
+            path[:, 0] = 1e6 / path[:, 0]
+        frames = self._frames(path, space, current)
+
+        # keep the first tick of each hardware levels change
+        levels = np.floor(frames * resolutions / 100. + .5)
+        kept = np.flatnonzero(np.any(np.diff(levels, axis=0), axis=1)) + 1
+        if not len(kept):
+            return Transition.hold(frames[-1].tolist(), seconds)
+        offsets = [0.] + (kept * (seconds / ticks)).tolist()
+        values = [frames[0].tolist()] + \
+            (levels[kept] * 100. / resolutions).tolist()
+        values[-1] = frames[-1].tolist()
+        return Transition.from_pairs(zip(offsets, values), seconds)
+
+    def fade(self, begin, end, duration, space='rgb', curve='linear'):
+        '''Fade the channels from a color to another for a duration.
+
+        Args:
+            begin: first color in space, None for the current values
+                   (rgb space only, 0 for the channels never written)
+            end: last color in space
+            duration (float): fade duration in minutes
+            space (str): color space name, colors are interpolated in it
+            curve: progress curve name or keyframes (see rlieh_pwm.curves)
+
+        Returns:
+            ScheduleReport : writes, skipped frames and lateness
+        '''
+        return self.group.play(
+            self.frames(begin, end, duration, space, curve))
+
+    def _colors(self, colors, space):
+        '''check colors and convert them to a (n, components) array.'''
+        if space not in SPACES:
+            raise ValueError(
+                'Unknown color space "{}". Space should be a value in: '
+                '{}.'.format(space, ', '.join(sorted(SPACES))))
+        if space == 'rgb':
+            colors = [self._rgb(color) for color in colors]
+        elif not set(RGB).issubset(self.names):
+            raise ValueError(
+                '{} space needs {} channels.'.format(space, ', '.join(RGB)))
+        array = np.array(colors, dtype=float)
+        size = SPACES[space] or len(self.names)
+        if array.ndim != 2 or array.shape[1] != size:
+            raise ValueError(
+                '{} colors need {} values. (was {})'.format(
+                    space, size, colors))
+        # rgb values, hsv saturation and value, kelvin brightness
+        percents = array if space == 'rgb' else array[:, 1:]
+        if not np.isfinite(array).all() or (percents < 0).any() or \
+                (percents > 100).any():
+            raise ValueError(
+                '{} color percents must be between 0 and 100. (was {})'
+                .format(space, colors))
+        if space == 'kelvin' and (array[:, 0] <= 0).any():
+            raise ValueError(
+                'Color temperature must be greater than 0. (was {})'.format(
+                    colors))
+        return array
+
+    def _rgb(self, color):
+        '''rgb color as a list of percents in channels order.'''
+        if not isinstance(color, dict):
+            return list(color)
+        unknown = set(color) - set(self.names)
+        if unknown:
+            raise ValueError(
+                'Unknown channel {}.'.format(', '.join(sorted(unknown))))
+        current = dict(zip(self.names, self._current()[0].tolist()))
+        return [color.get(name, current[name]) for name in self.names]
+
+    def _current(self):
+        '''(1, channels) array of the current values, 0 for the channels
+        never written.'''
+        return np.array([[0. if value is None else float(value)
+                          for value in self.group.frame]])
+
+    def _frames(self, colors, space, current):
+        '''convert (n, components) colors to (n, channels) percents.
+
+        Args:
+            colors (numpy.ndarray): colors in space
+            space (str): color space name
+            current (numpy.ndarray): (1, channels) values kept by the
+                channels outside of the color space
+        '''
+        if space == 'rgb':
+            return np.clip(colors, 0., 100.)
+        if space == 'hsv':
+            rgb = hsv_to_rgb(colors)
+        else:
+            rgb = kelvin_to_rgb(colors)
+        frames = np.repeat(current, len(colors), axis=0)
+        if WHITE in self.names:
+            white = rgb.min(axis=1)
+            rgb -= white[:, None]
+            frames[:, self.names.index(WHITE)] = white
+        for index, name in enumerate(RGB):
+            frames[:, self.names.index(name)] = rgb[:, index]
+        return np.clip(frames, 0., 100.)
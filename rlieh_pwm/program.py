@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# @Author: Olivier Watté <user>
+# @Date:   2026-10-17T09:00:00-04:00
+# @Email:  owatte@ipeos.com
+# @Last modified by:   user
+# @Last modified time: 2026-10-17T09:00:00-04:00
+# @License: GPLv3
+# @Copyright: Olivier Watté
+
+# Rlieh-pwm provides an interface to manage PWM on RLIEH systems.
+# Copyright (C) 2017 Olivier Watte
+#
+# This file is part of rlieh-pwm.
+#
+# Rlieh-pwm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rlieh-pwm is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rlieh-pwm.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+    This module provides daily light programs.
+
+    A program is a JSON file giving, for each GPIO, the effects to run
+    at given times of the day:
+
+    {
+        "18": [
+            {"at": "07:00", "fx": "dawn", "duration": 30},
+            {"at": "07:30", "fx": "sunrise", "duration": 60},
+            {"at": "12:00", "fx": "noon", "duration": 60},
+            {"at": "19:00", "fx": "sunset", "duration": 60},
+            {"at": "20:00", "range": [20, 0], "duration": 30},
+            {"at": "22:00", "set": 0}
+        ]
+    }
+
+    Each entry has a time ("at", HH:MM or HH:MM:SS) and one of:
+        - "fx": fx-light preset name, see core.PWM_THRESHOLDS
+        - "range": [begin, end] values, begin may be null for the
+          current value
+        - "set": value
+    and an optional "duration" in minutes (default 0.5) for fx and range.
+    Between entries the last value is kept, until the next day.
+
+    The whole day is compiled into sorted keyframes per pin, and one
+    timer heap drives every pin from a single process: joining the
+    program mid-day evaluates the current values with a bisection.
+
+    Given pin locks (see rlieh_pwm.core.PinLocks), the program holds the
+    locks of its pins while it runs, and stops driving a pin preempted
+    by another process.
+
+    Usage:
+
+    >>> from rlieh_pwm.program import Program
+    >>> program = Program.load('/etc/rlieh/light.json')
+    >>> program.value(18, 9 * 3600)
+    75.0
+    >>> program.run()
+"""
+from bisect import bisect_right
+from datetime import datetime
+import heapq
+import json
+import math
+from time import monotonic, sleep
+
+from rlieh_pwm.core import (BackgroundWriter, PWM_THRESHOLDS, PinLock,
+                            RliehPWMGroup, _plan_value)
+
+__all__ = ['Program', 'DAY']
+
+# day length in seconds
+DAY = 24 * 3600
+
+# default effect duration (in minutes)
+DURATION = 0.5
+
+
+def _parse_time(text):
+    '''convert HH:MM[:SS] to seconds since midnight.'''
+    parts = [int(part) for part in text.split(':')]
+    if not 2 <= len(parts) <= 3:
+        raise ValueError('Bad time "{}", HH:MM expected.'.format(text))
+    hours, minutes = parts[:2]
+    seconds = parts[2] if len(parts) == 3 else 0
+    if not (0 <= hours < 24 and 0 <= minutes < 60 and 0 <= seconds < 60):
+        raise ValueError('Bad time "{}".'.format(text))
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def _seconds_of_day():
+    '''local wall clock time, in seconds since midnight.'''
+    now = datetime.now()
+    return (now - now.replace(hour=0, minute=0, second=0,
+                              microsecond=0)).total_seconds()
+
+
+class _Cursor(object):
+    """Position of a pin in its keyframes, gives the writes to do."""
+
+    def __init__(self, times, values, resolution, frequency):
+        self.times = times
+        self.values = values
+        self.resolution = resolution
+        self.frequency = frequency
+
+    def at(self, time):
+        '''value at a time of the day and time of the next change.
+
+        Returns:
+            tuple: value, next deadline (seconds of the day, may be DAY)
+        '''
+        times, values = self.times, self.values
+        index = bisect_right(times, time) - 1
+        start, stop = times[index], times[index + 1]
+        begin, end = values[index], values[index + 1]
+        levels = abs(math.floor(end * self.resolution / 100. + .5) -
+                     math.floor(begin * self.resolution / 100. + .5))
+        ticks = min(levels, int((stop - start) * self.frequency))
+        if ticks < 1:
+            return end, stop
+        pause_time = (stop - start) / ticks
+        tick = min(int((time - start) / pause_time), ticks - 1)
+        if tick < ticks - 1 and start + (tick + 1) * pause_time <= time:
+            # rounding error: the next tick is already due
+            tick += 1
+        value = _plan_value(begin, end, tick, ticks, self.resolution)
+        return value, start + (tick + 1) * pause_time
+
+
+class Program(object):
+    """This class compiles and runs a daily light program.
+
+    Attributes:
+        - keyframes (dict): sorted (time, value) pairs of each pin, time
+          in seconds since midnight, from 0 to DAY.
+    """
+
+    def __init__(self, keyframes):
+        """
+        Args:
+            keyframes (dict): (time, value) pairs of each pin
+        """
+        # a stable sort keeps steps (same time pairs) in order
+        self.keyframes = dict((int(pin), sorted(frames, key=lambda f: f[0]))
+                              for pin, frames in keyframes.items())
+        self._times = dict((pin, [time for time, _ in frames])
+                           for pin, frames in self.keyframes.items())
+        self._values = dict((pin, [value for _, value in frames])
+                            for pin, frames in self.keyframes.items())
+
+    @classmethod
+    def load(cls, path, pwm_thresholds=PWM_THRESHOLDS):
+        '''load a JSON program file.'''
+        with open(path) as f:
+            return cls.from_dict(json.load(f), pwm_thresholds)
+
+    @classmethod
+    def from_dict(cls, data, pwm_thresholds=PWM_THRESHOLDS):
+        '''compile a program from its definition.
+
+        Args:
+            data (dict): list of entries of each pin (see module doc)
+            pwm_thresholds (dict): fx presets
+
+        Returns:
+            Program
+        '''
+        return cls(dict((int(pin), cls._compile(entries, pwm_thresholds))
+                        for pin, entries in data.items()))
+
+    @staticmethod
+    def _compile(entries, pwm_thresholds):
+        '''compile the entries of a pin into sorted keyframes.'''
+        segments = []
+        for entry in entries:
+            start = _parse_time(entry['at'])
+            duration = float(entry.get('duration', DURATION)) * 60.
+            if 'fx' in entry:
+                if entry['fx'] not in pwm_thresholds:
+                    raise ValueError('Unknown fx "{}".'.format(entry['fx']))
+                thresholds = pwm_thresholds[entry['fx']]
+            elif 'range' in entry:
+                thresholds = list(entry['range'])
+            elif 'set' in entry:
+                thresholds, duration = [entry['set']], 0.
+            else:
+                raise ValueError('Entry needs fx, range or set. '
+                                 '(was {})'.format(entry))
+            last = max(len(thresholds) - 1, 1)
+            segments.append([(start + duration * index / last, value)
+                             for index, value in enumerate(thresholds)])
+        if not segments:
+            raise ValueError('A pin needs one entry at least.')
+        segments.sort(key=lambda frames: frames[0][0])
+        for previous, following in zip(segments, segments[1:]):
+            if following[0][0] < previous[-1][0]:
+                raise ValueError('Entries at {} and {} overlap.'.format(
+                    previous[0][0], following[0][0]))
+        if segments[-1][-1][0] > DAY:
+            raise ValueError('Last entry ends after midnight.')
+
+        # values are kept between entries, and from the end of the day
+        current = segments[-1][-1][1]
+        if current is None:
+            raise ValueError('Last value of the day is needed.')
+        keyframes = [(0., float(current))]
+        for frames in segments:
+            keyframes.append((float(frames[0][0]), current))
+            for time, value in frames:
+                if value is not None:
+                    current = float(value)
+                keyframes.append((float(time), current))
+        keyframes.append((float(DAY), current))
+        return keyframes
+
+    @property
+    def pins(self):
+        '''get program pins.'''
+        return sorted(self.keyframes)
+
+    def value(self, pin, time):
+        '''get the value of a pin at a time of the day.
+
+        Args:
+            pin (int): Raspberry Pi's gpio
+            time (float): seconds since midnight
+
+        Returns:
+            float: value, in percent
+        '''
+        times, values = self._times[pin], self._values[pin]
+        time = time % DAY
+        index = bisect_right(times, time) - 1
+        start, stop = times[index], times[index + 1]
+        if stop == start:
+            return values[index + 1]
+        return values[index] + (values[index + 1] - values[index]) * \
+            (time - start) / (stop - start)
+
+    def run(self, group=None, start=None, duration=None, clock=None,
+            sleeper=None, **kwargs):
+        '''run the program.
+
+        Pins due at the same deadline are written in one frame. The run
+        ends early once every pin was preempted (see PinLocks).
+
+        Args:
+            group (RliehPWMGroup): channels of the program pins (default:
+                new group on a BackgroundWriter to /dev/pi-blaster)
+            start (float): time of the day to start from, in seconds
+                           (default: now)
+            duration (float): run time in seconds (default: forever)
+            clock: time source in seconds (default: group clock)
+            sleeper: sleep function (default: group sleeper)
+            **kwargs: extra RliehPWMGroup arguments (writer, log_level,
+                locks...)
+
+        Returns:
+            int: number of frames written
+
+        Raises:
+            RuntimeError: a pin is used by another process (reject policy
+                          or queue timeout)
+        '''
+        if group is None:
+            if kwargs.get('writer') is None:
+                kwargs['writer'] = BackgroundWriter(
+                    metrics=kwargs.get('metrics'))
+            group = RliehPWMGroup(self.pins, clock=clock, sleeper=sleeper,
+                                  **kwargs)
+        clock = clock or group.clock
+        sleeper = sleeper or group.sleeper
+        if start is None:
+            start = _seconds_of_day()
+        # backend of each pin
+        writers = dict((int(channel.pin), channel.writer)
+                       for channel in group.channels)
+        cursors = dict((pin, _Cursor(self._times[pin], self._values[pin],
+                                     writers[pin].resolution,
+                                     writers[pin].frequency))
+                       for pin in self.pins)
+        # program time = origin + clock time, heap deadlines are (day,
+        # seconds of the day) pairs compared without float modulo
+        origin = start - clock()
+        stop = None if duration is None else start + duration
+        first = (int(start // DAY), start % DAY)
+        heap = [(first, pin) for pin in self.pins]
+        heapq.heapify(heap)
+        locks = dict((int(channel.pin), channel.lock)
+                     for channel in group.channels if channel.lock is not None)
+
+        def drop_lost():
+            '''stop driving the pins preempted by another process.'''
+            lost = [pin for pin, lock in locks.items() if not lock.owned()]
+            for pin in lost:
+                locks.pop(pin).release()
+                group.logger.warning('program: pin %s preempted', pin)
+            if lost:
+                heap[:] = [entry for entry in heap if entry[1] not in lost]
+                heapq.heapify(heap)
+            return bool(lost)
+
+        def wait(delay):
+            # wakes up within a tick of a pin lock loss
+            deadline = monotonic() + delay
+            while all(lock.owned() for lock in locks.values()):
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    return
+                sleep(min(remaining, PinLock.TICK))
+
+        if locks and sleeper is sleep:
+            sleeper = wait
+        levels = {}
+        frames = 0
+        taken = group._acquire(group.channels)
+        try:
+            while heap:
+                day, time = heap[0][0]
+                deadline = day * DAY + time
+                if stop is not None and deadline >= stop:
+                    delay = stop - origin - clock()
+                    if delay > 0:
+                        sleeper(delay)
+                    if drop_lost():
+                        continue
+                    break
+                delay = deadline - origin - clock()
+                if delay > 0:
+                    sleeper(delay)
+                if drop_lost():
+                    continue
+                now = origin + clock()
+                now = max((int(now // DAY), now % DAY), (day, time))
+                frame = {}
+                while heap and heap[0][0] <= now:
+                    _deadline, pin = heapq.heappop(heap)
+                    value, following = cursors[pin].at(now[1])
+                    if following < DAY:
+                        heapq.heappush(heap, ((now[0], following), pin))
+                    else:
+                        heapq.heappush(heap,
+                                       ((now[0] + 1, following - DAY), pin))
+                    level = math.floor(
+                        value * writers[pin].resolution / 100. + .5)
+                    if levels.get(pin) != level:
+                        levels[pin] = level
+                        frame[pin] = value
+                if frame:
+                    group.frame = frame
+                    frames += 1
+        finally:
+            for lock in taken:
+                lock.release()
+        group.writer.flush()
+        return frames
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# @Author: Olivier Watté <user>
+# @Date:   2026-10-17T09:00:00-04:00
+# @Email:  owatte@ipeos.com
+# @Last modified by:   user
+# @Last modified time: 2026-10-17T09:00:00-04:00
+# @License: GPLv3
+# @Copyright: Olivier Watté
+
+# Rlieh-pwm provides an interface to manage PWM on RLIEH systems.
+# Copyright (C) 2017 Olivier Watte
+#
+# This file is part of rlieh-pwm.
+#
+# Rlieh-pwm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rlieh-pwm is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rlieh-pwm.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+    This module drives the rlieh-pwm daemons of several Raspberry Pis.
+
+    'rlieh-pwm daemon --listen=HOST:PORT' serves the daemon commands (see
+    rlieh_pwm.daemon) on TCP with the protocol of its Unix socket: one
+    command per line, one reply line per command, in order. Commands
+    are pipelined: the controller sends all its lines before reading the
+    replies, and 'frame GPIO=VALUE...' sets several pins in one write.
+
+    The listener has no authentication: bind it to a trusted network.
+
+    A Fleet keeps one connection per node and sends the commands to every
+    node before reading any reply, so a fan-out costs a single round trip
+    whatever the number of nodes. Fleet.start() prefixes the commands with
+    'at TIME' so that every node runs them at the same wall clock time
+    (node clocks are expected to be synchronized, eg. with NTP).
+
+    Usage:
+
+    >>> from rlieh_pwm.remote import Fleet
+    >>> with Fleet(['pi-1', 'pi-2:5018']) as fleet:
+    ...     fleet.start(['range 0 100 18 30', 'fx-light dawn 23 30'])
+    {'pi-1': ['ok', 'ok'], 'pi-2:5018': ['ok', 'ok']}
+
+    $ rlieh-pwm remote pi-1,pi-2 program.txt --start=2
+"""
+import asyncio
+import socket
+from time import time as wall_time
+
+__all__ = ['PORT', 'Node', 'Fleet', 'serve', 'read_commands']
+
+# default rlieh-pwm listener TCP port
+PORT = 5018
+
+# default delay before a synchronized start (seconds)
+START_DELAY = 1.
+
+# commands sent before reading their replies, the replies of a longer
+# pipeline could fill the socket buffers while the commands are sent
+PIPELINE = 1024
+
+
+def parse_address(address):
+    '''split a 'HOST[:PORT]' address ('[::1]:PORT' for IPv6).
+
+    Returns:
+        tuple: (host, port)
+    '''
+    host, sep, port = address.rpartition(':')
+    if not sep or host.endswith(':') or (host.startswith('[') and
+                                         not host.endswith(']')):
+        host, port = address, PORT
+    if host.startswith('['):
+        host = host[1:-1]
+    try:
+        return host, int(port)
+    except ValueError:
+        raise ValueError('Bad address "{}", HOST:PORT expected.'.format(
+            address))
+
+
+def read_commands(stream):
+    '''get the command lines of a stream, without comments and blank
+    lines (see rlieh_pwm.batch).'''
+    commands = []
+    for line in stream:
+        command = line.split('#', 1)[0].strip()
+        if command:
+            commands.append(command)
+    return commands
+
+
+async def serve(controller, address):
+    '''start serving controller commands on TCP.
+
+    Args:
+        controller (Controller): command executor (see rlieh_pwm.daemon)
+        address (str): listening address, 'HOST:PORT' (port 0 for any)
+
+    Returns:
+        asyncio.AbstractServer
+    '''
+    host, port = parse_address(address)
+    return await asyncio.start_server(controller.handle, host or None, port)
+
+
+class Node(object):
+    """Connection to the rlieh-pwm listener of a node.
+
+    >>> with Node('pi-1') as node:
+    ...     node.send(['set 42 18', 'get 18'])
+    ['ok', 'ok 42.0']
+
+    Attributes:
+        - address (str): node address, 'HOST[:PORT]'.
+    """
+
+    def __init__(self, address, timeout=5.):
+        '''
+        Args:
+            address (str): node address, 'HOST[:PORT]'
+            timeout (float): connection and reply timeout in seconds
+
+        Raises:
+            OSError: the node can't be reached
+        '''
+        self.address = address
+        self._socket = socket.create_connection(parse_address(address),
+                                                timeout)
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._replies = self._socket.makefile('rb')
+
+    def send(self, commands):
+        '''send command lines, then read their replies.
+
+        Returns:
+            list: reply of each command
+        '''
+        commands = list(commands)
+        replies = []
+        for index in range(0, len(commands), PIPELINE):
+            chunk = commands[index:index + PIPELINE]
+            self.write(chunk)
+            replies.extend(self.read(len(chunk)))
+        return replies
+
+    def write(self, commands):
+        '''send command lines at once, without waiting for the replies.'''
+        data = ''.join(command + '\n' for command in commands)
+        self._socket.sendall(data.encode('ascii'))
+
+    def read(self, count):
+        '''read the replies of count commands.
+
+        Raises:
+            OSError: the connection is lost
+        '''
+        replies = []
+        for _index in range(count):
+            reply = self._replies.readline()
+            if not reply:
+                raise ConnectionError('Connection closed by {}'.format(
+                    self.address))
+            replies.append(reply.decode('ascii').strip())
+        return replies
+
+    def close(self):
+        self._replies.close()
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Fleet(object):
+    """Sends the same commands to the listeners of many nodes.
+
+    A node which can't be reached gets 'error MESSAGE' replies, the
+    other nodes are still driven. It is connected again on the next
+    send.
+
+    Attributes:
+        - addresses (list): node addresses, 'HOST[:PORT]'.
+        - timeout (float): connection and reply timeout in seconds.
+    """
+
+    def __init__(self, addresses, timeout=5.):
+        self.addresses = list(addresses)
+        self.timeout = timeout
+        self._nodes = {}
+
+    def send(self, commands):
+        '''send command lines to every node, then read their replies.
+
+        Returns:
+            dict: replies of each node address
+        '''
+        commands = list(commands)
+        replies = dict((address, []) for address in self.addresses)
+        for index in range(0, len(commands), PIPELINE):
+            chunk = commands[index:index + PIPELINE]
+            sent = []
+            for address in self.addresses:
+                try:
+                    node = self._node(address)
+                    node.write(chunk)
+                except OSError as e:
+                    replies[address].extend(self._failed(address, e, chunk))
+                else:
+                    sent.append(node)
+            for node in sent:
+                try:
+                    replies[node.address].extend(node.read(len(chunk)))
+                except OSError as e:
+                    replies[node.address].extend(
+                        self._failed(node.address, e, chunk))
+        return replies
+
+    def start(self, commands, delay=START_DELAY):
+        '''send command lines run by every node at the same time.
+
+        Args:
+            commands (list): command lines
+            delay (float): seconds from now to the start, longer than the
+                           fan-out
+
+        Returns:
+            dict: replies of each node address
+        '''
+        at = 'at {:.3f} '.format(wall_time() + delay)
+        return self.send(at + command for command in commands)
+
+    def close(self):
+        for node in self._nodes.values():
+            node.close()
+        self._nodes = {}
+
+    def _node(self, address):
+        '''get the connection to a node, opened on first use.'''
+        if address not in self._nodes:
+            self._nodes[address] = Node(address, self.timeout)
+        return self._nodes[address]
+
+    def _failed(self, address, error, commands):
+        '''drop the connection to a node, and reply the error.'''
+        node = self._nodes.pop(address, None)
+        if node is not None:
+            node.close()
+        return ['error {}'.format(error)] * len(commands)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
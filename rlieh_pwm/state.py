@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# @Author: Olivier Watté <user>
+# @Date:   2026-10-17T09:00:00-04:00
+# @Email:  owatte@ipeos.com
+# @Last modified by:   user
+# @Last modified time: 2026-10-17T09:00:00-04:00
+# @License: GPLv3
+# @Copyright: Olivier Watté
+
+# Rlieh-pwm provides an interface to manage PWM on RLIEH systems.
+# Copyright (C) 2017 Olivier Watte
+#
+# This file is part of rlieh-pwm.
+#
+# Rlieh-pwm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rlieh-pwm is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rlieh-pwm.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+    This module provides the PWM state table shared by RLIEH processes.
+
+    The state table is a small memory-mapped file holding one fixed-size
+    record per GPIO:
+        - value (float): current PWM percent
+        - target (float): PWM percent at the end of the running
+          transition (None when idle)
+        - end (float): transition end time (time.time(), None when idle)
+        - sequence (int): sequence number, increased on each update
+
+    Each writer updates its pins records without lock: the sequence
+    number is odd while a record is written (seqlock). Readers map the
+    file read-only and poll it without any system call, retrying the
+    records caught during an update. A pin has a single writer at a time
+    (see rlieh_pwm.core.RliehPWM).
+
+    Usage:
+
+    >>> from rlieh_pwm.state import StateTable
+    >>> light = RliehPWM(18, state=StateTable())
+    >>> StateTable(writable=False).read(18)
+    PinState(value=42.0, target=None, end=None, sequence=2)
+"""
+from collections import namedtuple
+import math
+import mmap
+import os
+import struct
+
+__all__ = ['STATE_PATH', 'PinState', 'StateTable', 'open_state']
+
+STATE_PATH = '/run/rlieh/pwm.state'
+
+PinState = namedtuple('PinState', ['value', 'target', 'end', 'sequence'])
+PinState.__doc__ = """State of a pin, see rlieh_pwm.state."""
+
+# file header: magic, format version, record size, records count (padded
+# to keep records 8 bytes aligned)
+HEADER = struct.Struct('<4sHHI4x')
+MAGIC = b'RLPW'
+VERSION = 1
+# record: sequence, value, target, end
+RECORD = struct.Struct('<Qddd')
+SEQUENCE = struct.Struct('<Q')
+FIELDS = struct.Struct('<ddd')
+# GPIO 0 to 40
+PINS = 41
+SIZE = HEADER.size + PINS * RECORD.size
+
+_NONE = float('nan')
+
+
+class StateTable(object):
+    """Memory-mapped PWM state table.
+
+    Attributes:
+        - path (str): state file path.
+        - writable (bool): True if records can be updated.
+    """
+
+    def __init__(self, path=STATE_PATH, writable=True):
+        '''
+        Args:
+            path (str): state file, created if writable
+            writable (bool): map the file to update records
+
+        Raises:
+            OSError: the file can't be opened
+            ValueError: the file is not a state table
+        '''
+        self.path = path
+        self.writable = writable
+        if writable:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        else:
+            fd = os.open(path, os.O_RDONLY)
+        try:
+            size = os.fstat(fd).st_size
+            if writable and size < SIZE:
+                # zero filled records: never written
+                os.ftruncate(fd, SIZE)
+                os.pwrite(fd, HEADER.pack(MAGIC, VERSION, RECORD.size, PINS),
+                          0)
+            elif size < SIZE:
+                raise ValueError('{} is not a PWM state table'.format(path))
+            access = mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ
+            self._map = mmap.mmap(fd, SIZE, access=access)
+        finally:
+            os.close(fd)
+        magic, version, record_size, pins = HEADER.unpack_from(self._map, 0)
+        if (magic, version, record_size, pins) != (MAGIC, VERSION,
+                                                   RECORD.size, PINS):
+            self.close()
+            raise ValueError('{} is not a PWM state table'.format(path))
+
+    @staticmethod
+    def _offset(pin):
+        pin = int(pin)
+        if not 0 <= pin < PINS:
+            raise ValueError('Bad pin value ({})'.format(pin))
+        return HEADER.size + pin * RECORD.size
+
+    def update(self, pin, value, target=None, end=None):
+        '''update the record of a pin.
+
+        Args:
+            pin (int): Raspberry Pi's gpio
+            value (float): current PWM percent
+            target (float): transition target percent, None when idle
+            end (float): transition end time (time.time()), None when idle
+        '''
+        offset = self._offset(pin)
+        sequence = SEQUENCE.unpack_from(self._map, offset)[0]
+        # odd while the record is written
+        sequence += 1 if sequence % 2 == 0 else 2
+        SEQUENCE.pack_into(self._map, offset, sequence)
+        FIELDS.pack_into(self._map, offset + SEQUENCE.size, float(value),
+                         _NONE if target is None else float(target),
+                         _NONE if end is None else float(end))
+        SEQUENCE.pack_into(self._map, offset, sequence + 1)
+
+    def read(self, pin, retries=1000):
+        '''read the record of a pin.
+
+        Returns:
+            PinState, or None if the pin was never written
+
+        Raises:
+            RuntimeError: the record is updated faster than it is read
+        '''
+        offset = self._offset(pin)
+        for _retry in range(retries):
+            sequence, value, target, end = RECORD.unpack_from(self._map,
+                                                              offset)
+            if sequence % 2:
+                continue
+            if SEQUENCE.unpack_from(self._map, offset)[0] != sequence:
+                continue
+            if sequence == 0:
+                return None
+            return PinState(value,
+                            None if math.isnan(target) else target,
+                            None if math.isnan(end) else end, sequence)
+        raise RuntimeError('Pin {} state is busy'.format(pin))
+
+    def snapshot(self):
+        '''read the records of every pin written so far.
+
+        Returns:
+            dict: PinState of each pin
+        '''
+        states = {}
+        for pin in range(PINS):
+            state = self.read(pin)
+            if state is not None:
+                states[pin] = state
+        return states
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_state(path=STATE_PATH, writable=True):
+    '''open the state table, or None if it is not available.
+
+    Processes without access to the state table (eg. /run/rlieh owned by
+    another user) still drive PWM, without publishing their state.
+    '''
+    try:
+        return StateTable(path, writable)
+    except (OSError, ValueError):
+        return None
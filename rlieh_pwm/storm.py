@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# @Author: Olivier Watté <user>
+# @Date:   2026-10-17T09:00:00-04:00
+# @Email:  owatte@ipeos.com
+# @Last modified by:   user
+# @Last modified time: 2026-10-17T09:00:00-04:00
+# @License: GPLv3
+# @Copyright: Olivier Watté
+
+# Rlieh-pwm provides an interface to manage PWM on RLIEH systems.
+# Copyright (C) 2017 Olivier Watte
+#
+# This file is part of rlieh-pwm.
+#
+# Rlieh-pwm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Rlieh-pwm is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with rlieh-pwm.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+    This module plans thunderstorm effects for RLIEH PWM.
+
+    A storm is drawn up front from a seed, as compact NumPy arrays: the
+    lightning strikes come at random (Poisson process), each one with 1
+    to 4 strokes of a bright flash, a dimmer afterglow and a dark gap.
+    The flashes overlay an ambient level, a value or a running
+    transition, which comes back after each stroke and once the storm is
+    over.
+
+    Flashes only last a few PWM periods: the timeline is played on
+    deadlines with the writer of the channel (see RliehPWM.storm), never
+    by a process per write. The same seed plays the same storm.
+
+    Usage:
+
+    >>> from rlieh_pwm.storm import storm_timeline
+    >>> night = storm_timeline(600, ambient=5, seed=42)
+    >>> night[1]
+    (7.04, 92.3)
+"""
+import numpy as np
+
+from rlieh_pwm.core import Transition
+
+__all__ = ['STRIKES_PER_MINUTE', 'flashes', 'storm_timeline']
+
+# mean lightning strikes per minute
+STRIKES_PER_MINUTE = 4.
+
+# random ranges: strokes per strike (upper bound excluded), flash,
+# afterglow and dark gap lengths (seconds), flash level (percent) and
+# afterglow level (fraction of the flash level)
+STROKES = (1, 5)
+FLASH = (.02, .06)
+AFTERGLOW = (.03, .12)
+DARK = (.03, .12)
+PEAK = (50., 100.)
+GLOW = (.2, .5)
+
+
+def flashes(duration, seed=None, strikes=STRIKES_PER_MINUTE):
+    '''draw the lightning strikes of a storm.
+
+    Strikes never overlap, and end before the storm end.
+
+    Args:
+        duration (float): storm duration in seconds
+        seed (int): random seed (default: random storm)
+        strikes (float): mean lightning strikes per minute
+
+    Returns:
+        tuple: numpy arrays of offsets (seconds) and levels (percent, 0
+               when back to the ambient level)
+    '''
+    rng = np.random.RandomState(seed)
+    mean = 60. / strikes
+    count = int(duration / mean) * 2 + 8
+    while True:
+        gaps = rng.exponential(mean, count)
+        strokes = rng.randint(*STROKES, size=count)
+        total = int(strokes.sum())
+        flash = rng.uniform(*FLASH, total)
+        glow = rng.uniform(*AFTERGLOW, total)
+        period = flash + glow + rng.uniform(*DARK, total)
+        peaks = rng.uniform(*PEAK, total)
+        glows = peaks * rng.uniform(*GLOW, total)
+
+        # strokes of a strike follow each other, then a gap to the next
+        first = np.cumsum(strokes) - strokes
+        lengths = np.add.reduceat(period, first)
+        ends = np.cumsum(gaps + lengths)
+        if ends[-1] >= duration:
+            break
+        count *= 2
+    elapsed = np.cumsum(period) - period
+    starts = np.repeat(ends - lengths - elapsed[first], strokes) + elapsed
+    kept = np.repeat(ends < duration, strokes)
+
+    offsets = np.stack([starts, starts + flash, starts + flash + glow],
+                       axis=1)[kept].ravel()
+    levels = np.stack([peaks, glows, np.zeros(total)],
+                      axis=1)[kept].ravel()
+    return offsets, levels.astype(np.float32)
+
+
+def storm_timeline(duration, ambient, seed=None,
+                   strikes=STRIKES_PER_MINUTE, resolution=1000,
+                   frequency=100):
+    '''Plan a storm over an ambient level.
+
+    Flash levels are rounded to hardware steps and come one PWM period
+    apart at least. A flash dimmer than the ambient level is not seen.
+
+    Args:
+        duration (float): storm duration in seconds
+        ambient: ambient value (percent), or Transition of the ambient
+                 level, it goes on after the storm
+        seed (int): random seed (default: random storm)
+        strikes (float): mean lightning strikes per minute
+        resolution (int): number of hardware PWM steps
+        frequency (int): PWM frequency in Hz (maximum update rate)
+
+    Returns:
+        Transition: (offset, value) pairs, lasting the storm duration or
+                    the ambient transition if longer
+    '''
+    offsets, levels = flashes(duration, seed, strikes)
+    # one PWM period between steps at least
+    ticks = np.round(offsets * frequency).astype(np.int64)
+    index = np.arange(len(ticks))
+    ticks = np.maximum.accumulate(ticks - index) + index
+    levels = np.floor(levels.astype(float) * resolution / 100. + .5) * \
+        100. / resolution
+
+    if not isinstance(ambient, Transition):
+        ambient = Transition.hold(float(ambient), duration)
+    ambient_offsets = np.fromiter((offset for offset, _value in ambient),
+                                  float, len(ambient))
+    ambient_values = np.fromiter((value for _offset, value in ambient),
+                                 float, len(ambient))
+
+    # value of the ambient level and of the flashes at every change
+    flash_offsets = ticks / float(frequency)
+    merged = np.union1d(ambient_offsets, flash_offsets)
+    base = ambient_values[
+        np.searchsorted(ambient_offsets, merged, 'right') - 1]
+    flash = np.concatenate([[0.], levels])[
+        np.searchsorted(flash_offsets, merged, 'right')]
+    values = np.where(flash > 0, np.maximum(base, flash), base)
+    changed = np.concatenate([[True], values[1:] != values[:-1]])
+    offsets, values = merged[changed], values[changed]
+
+    def point(index):
+        return float(offsets[index]), float(values[index])
+    return Transition(len(offsets), point, max(duration, ambient.duration))
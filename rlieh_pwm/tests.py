@@ -26,8 +26,36 @@
 
 
 from numpy import allclose
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+from time import perf_counter, sleep, time as wall_time
 import unittest
-from .core import RliehPWM
+from . import batch, bench, cli
+from .client import send
+from .curves import transition_table
+from .daemon import Controller, serve
+from .fixture import Fixture
+from .program import DAY, Program
+from .remote import Fleet, Node
+from .storm import flashes, storm_timeline
+from . import remote
+from .state import PinState, StateTable
+from .core import (RliehPWM, RliehPWMGroup, DeviceWriter, MemoryWriter,
+                   BackgroundWriter, DitherWriter, SysfsPWMWriter,
+                   RoutingWriter,
+                   RecordingWriter, SimulatedClock, Envelope, ENVELOPES,
+                   Metrics, Transition, plan_transition, schedule,
+                   configure_logging, PinLocks)
 
 
 class TestCalcPauseTime(unittest.TestCase):
@@ -76,12 +104,1381 @@ class TestCalcSteps(unittest.TestCase):
 class TestConvertPercentToBlaster(unittest.TestCase):
     def test___convert_percent_to_blaster__valueerror(self):
         mytest = RliehPWM()
-        for percent in [-0.001, -1, 101, 100.1]:
+        for percent in [-0.001, -1, 101, 100.1, float('nan'), float('inf')]:
             self.assertRaises(ValueError,
                               mytest._convert_percent_to_blaster,
                               percent)
 
 
+class TestWriters(unittest.TestCase):
+    '''Perfom test on pi-blaster writers.'''
+
+    def test_memory_writer(self):
+        writer = MemoryWriter()
+        mytest = RliehPWM(writer=writer)
+        mytest.pwm = 42.42
+        mytest.pwm = 0
+        self.assertEqual(writer.lines, ['18=0.4242', '18=0.0'])
+        self.assertEqual(mytest.pwm, 0)
+
+    def test_device_writer_keeps_file_open(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        with DeviceWriter(path) as writer:
+            writer.write(18, 0.5)
+            first_fd = writer._fd
+            writer.write(23, 0.25)
+            self.assertEqual(writer._fd, first_fd)
+        self.assertIsNone(writer._fd)
+        with open(path) as f:
+            self.assertEqual(f.read(), '18=0.5\n23=0.25\n')
+
+    def test_device_writer_missing_device(self):
+        mytest = RliehPWM(writer=DeviceWriter('/nonexistent/pi-blaster'))
+        self.assertRaises(SystemExit, setattr, mytest, 'pwm', 10)
+
+
+class SlowWriter(MemoryWriter):
+    '''Memory writer blocking until released, failing first writes.'''
+
+    def __init__(self, failures=0):
+        super().__init__()
+        self.failures = failures
+        self.entered = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+    def _write(self, data):
+        self.entered.set()
+        self.release.wait()
+        if self.failures:
+            self.failures -= 1
+            raise OSError(32, 'Broken pipe')
+        super()._write(data)
+
+
+class TestBackgroundWriter(unittest.TestCase):
+    '''Perfom test on the background writer.'''
+
+    def test_latest_value_wins(self):
+        device = SlowWriter()
+        device.release.clear()
+        writer = BackgroundWriter(device)
+        self.addCleanup(writer.close)
+        writer.write(18, 0.1)
+        self.assertTrue(device.entered.wait(1))
+        # the device is busy: newer values replace the pending ones
+        writer.write(18, 0.2)
+        writer.write_frame([(23, 0.5), (18, 0.3)])
+        device.release.set()
+        self.assertTrue(writer.flush(1))
+        self.assertEqual(device.lines, ['18=0.1', '18=0.3', '23=0.5'])
+        self.assertEqual(writer.dropped, 1)
+
+    def test_retry_after_errors(self):
+        metrics = Metrics()
+        device = SlowWriter(failures=2)
+        writer = BackgroundWriter(device, backoff=.001, metrics=metrics)
+        self.addCleanup(writer.close)
+        mytest = RliehPWM(writer=writer, metrics=metrics)
+        mytest.pwm = 50
+        self.assertTrue(writer.flush(1))
+        self.assertEqual(device.lines, ['18=0.5'])
+        self.assertEqual(writer.errors, 2)
+        self.assertEqual(metrics.pin(18).failed, 2)
+        self.assertEqual(metrics.pin(18).writes, 1)
+
+    def test_metrics_count_device_writes(self):
+        metrics = Metrics()
+        device = SlowWriter()
+        device.release.clear()
+        writer = BackgroundWriter(device, metrics=metrics)
+        self.addCleanup(writer.close)
+        mytest = RliehPWM(writer=writer, metrics=metrics)
+        mytest.pwm = 10
+        self.assertTrue(device.entered.wait(1))
+        for percent in (20, 30, 40):
+            mytest.pwm = percent
+        device.release.set()
+        self.assertTrue(writer.flush(1))
+        self.assertEqual(device.lines, ['18=0.1', '18=0.4'])
+        self.assertEqual(metrics.pin(18).writes, 2)
+        self.assertEqual(metrics.pin(18).latency.count, 2)
+        self.assertEqual(metrics.pin(18).dropped, 2)
+        self.assertEqual(metrics.snapshot()['18']['dropped'], 2)
+        self.assertIn('rlieh_pwm_dropped_values_total{pin="18"} 2',
+                      metrics.to_prometheus())
+
+    def test_missing_device_does_not_exit(self):
+        writer = BackgroundWriter(DeviceWriter('/nonexistent/pi-blaster'),
+                                  backoff=.001)
+        mytest = RliehPWM(writer=writer, metrics=Metrics())
+        mytest.pwm = 10
+        self.assertFalse(writer.flush(.05))
+        self.assertGreater(writer.errors, 0)
+        writer.close()
+        self.assertTrue(writer.flush(0))
+        self.assertRaises(ValueError, writer.write, 18, 0.1)
+
+
+class TestSysfsPWMWriter(unittest.TestCase):
+    '''Perfom test on the sysfs hardware PWM backend.'''
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        self.chip = os.path.join(self.path, 'pwmchip0')
+        os.mkdir(self.chip)
+        open(os.path.join(self.chip, 'export'), 'w').close()
+
+    def make_channel(self, channel):
+        channel_path = os.path.join(self.chip, 'pwm{}'.format(channel))
+        os.mkdir(channel_path)
+        for name in ('period', 'duty_cycle', 'enable'):
+            with open(os.path.join(channel_path, name), 'w') as f:
+                f.write('0\n')
+
+    def read(self, channel, name):
+        path = os.path.join(self.chip, 'pwm{}'.format(channel), name)
+        with open(path) as f:
+            return f.readline().strip()
+
+    def test_duty_cycle(self):
+        self.make_channel(0)
+        writer = SysfsPWMWriter(frequency=10000, path=self.path)
+        self.addCleanup(writer.close)
+        mytest = RliehPWM(pin=12, writer=writer)
+        mytest.pwm = 42.42
+        fd = writer._fds[12]
+        mytest.pwm = 5
+        self.assertEqual(writer._fds[12], fd)
+        self.assertEqual(self.read(0, 'duty_cycle'), '5000')
+        self.assertEqual(self.read(0, 'period'), '100000')
+        self.assertEqual(self.read(0, 'enable'), '1')
+        self.assertRaises(ValueError, RliehPWM, pin=33, writer=writer)
+
+    def test_export(self):
+        # the kernel creates the exported channel later
+        timer = threading.Timer(.02, self.make_channel, [1])
+        timer.start()
+        writer = SysfsPWMWriter(path=self.path)
+        self.addCleanup(writer.close)
+        writer.write(13, 0.5)
+        timer.join()
+        with open(os.path.join(self.chip, 'export')) as f:
+            self.assertEqual(f.read(), '1\n')
+        self.assertEqual(self.read(1, 'duty_cycle'), '500000')
+
+    def test_unknown_pin(self):
+        self.make_channel(0)
+        sysfs = SysfsPWMWriter(path=self.path)
+        # rejected up front
+        self.assertRaises(ValueError, RoutingWriter,
+                          {33: BackgroundWriter(sysfs)})
+        self.assertRaises(ValueError, RliehPWM, 33,
+                          writer=BackgroundWriter(sysfs))
+        # the writer thread survives a pin without channel
+        metrics = Metrics()
+        writer = BackgroundWriter(sysfs, metrics=metrics)
+        self.addCleanup(writer.close)
+        writer.write_frame([(33, 0.2), (18, 0.5)])
+        self.assertTrue(writer.flush(1))
+        self.assertEqual(writer.errors, 1)
+        self.assertEqual(metrics.pin(33).failed, 1)
+        writer.write(18, 0.5)
+        self.assertTrue(writer.flush(1))
+        self.assertEqual(self.read(0, 'duty_cycle'), '500000')
+
+    def test_routing(self):
+        self.make_channel(0)
+        sysfs = SysfsPWMWriter(path=self.path)
+        memory = MemoryWriter()
+        writer = RoutingWriter({12: sysfs}, default=memory)
+        self.addCleanup(writer.close)
+        group = RliehPWMGroup([12, 18], writer=writer)
+        self.assertIs(group.channels[0].writer, sysfs)
+        self.assertIs(group.channels[1].writer, memory)
+        group.frame = [50, 25]
+        self.assertEqual(self.read(0, 'duty_cycle'), '500000')
+        self.assertEqual(memory.lines, ['18=0.25'])
+        clock = SimulatedClock()
+        group.clock, group.sleeper = clock, clock.sleep
+        group.modulate([0, 0], [1, 1], 1)
+        # 10 pi-blaster levels on 18, 100 sysfs levels on 12
+        self.assertEqual(len(memory.lines), 1 + 11)
+        self.assertEqual(self.read(0, 'duty_cycle'), '10000')
+
+
+class TestDitherWriter(unittest.TestCase):
+    '''Perfom test on temporal dithering.'''
+
+    def test_fractional_level(self):
+        device = MemoryWriter()
+        writer = DitherWriter(device, run=False)
+        writer.write_frame([(18, 0.0015), (23, 0.5)])
+        levels = []
+        for _tick in range(100):
+            frame = dict(writer.tick())
+            levels.append(frame.get(18, levels[-1] if levels else None))
+        # 0.15% alternates between 0.1% and 0.2%
+        self.assertEqual(set(levels), {0.001, 0.002})
+        self.assertAlmostEqual(sum(levels) / len(levels), 0.0015)
+        # steady levels are written once
+        self.assertEqual(device.lines.count('23=0.5'), 1)
+        self.assertEqual(len(device.lines), 101)
+
+    def test_oversampled_plans(self):
+        writer = DitherWriter(MemoryWriter(), run=False)
+        self.assertEqual(writer.resolution, 10000)
+        mytest = RliehPWM(writer=writer)
+        self.assertEqual(len(mytest._modulation_timeline(0, 1, 1)[0]), 101)
+        mytest.pwm = 0.05
+        self.assertEqual(writer.tick(), [(18, 0.001)])
+        self.assertEqual(writer.tick(), [(18, 0.0)])
+
+    def test_metrics_count_device_writes(self):
+        metrics = Metrics()
+        device = MemoryWriter()
+        writer = DitherWriter(device, run=False, metrics=metrics)
+        mytest = RliehPWM(writer=writer, metrics=metrics)
+        mytest.pwm = 0.15
+        mytest.pwm = 0.25
+        self.assertEqual(metrics.pin(18).writes, 0)
+        for _tick in range(10):
+            writer.tick()
+        self.assertEqual(metrics.pin(18).writes, len(device.lines))
+        self.assertEqual(metrics.pin(18).latency.count, len(device.lines))
+
+    def test_thread(self):
+        device = MemoryWriter()
+        writer = DitherWriter(device)
+        writer.write(18, 0.0025)
+        threading.Event().wait(.05)
+        writer.close()
+        self.assertGreater(len(device.lines), 2)
+        self.assertEqual(set(device.lines), {'18=0.002', '18=0.003'})
+
+
+class TestLogging(unittest.TestCase):
+    '''Perfom test on the process logging setup.'''
+
+    def test_configured_once(self):
+        RliehPWM(writer=MemoryWriter())
+        handlers = logging.getLogger().handlers[:]
+        for pin in (16, 18, 22, 24):
+            RliehPWM(pin=pin, writer=MemoryWriter())
+        self.assertEqual(logging.getLogger().handlers, handlers)
+        self.assertEqual(len([h for h in handlers if isinstance(
+            h, logging.handlers.QueueHandler)]), 1)
+
+    def test_queued_records(self):
+        log_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, log_path)
+        clock = SimulatedClock()
+        mytest = RliehPWM(writer=MemoryWriter(), log_level='info',
+                          log_path=log_path, clock=clock,
+                          sleeper=clock.sleep)
+        mytest.pwm = 10
+        mytest.modulate(10, 20, 1)
+        self.assertRaises(ValueError, setattr, mytest, 'pwm', 101)
+        # back to the default configuration, the queue is written
+        configure_logging()
+        with open(os.path.join(log_path, 'pwm.log')) as f:
+            lines = f.read().splitlines()
+        with open(os.path.join(log_path, 'pwm_error.log')) as f:
+            errors = f.read().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertIn('modulate: 101 steps', lines[0])
+        self.assertIn('CRITICAL', lines[1])
+        self.assertEqual(errors, lines[1:])
+
+
+class TestGroup(unittest.TestCase):
+    '''Perfom test on RliehPWMGroup.'''
+
+    def test_frame_single_write(self):
+        writer = MemoryWriter()
+        writes = []
+        writer._write = writes.append
+        group = RliehPWMGroup([12, 15, 16, 18], writer=writer)
+        group.frame = [100, 50, 0, 42.42]
+        self.assertEqual(writes, ['12=1.0\n15=0.5\n16=0.0\n18=0.4242\n'])
+        group.frame = {18: 10}
+        self.assertEqual(writes[-1], '18=0.1\n')
+        self.assertEqual(group.frame, [100, 50, 0, 10])
+
+    def test_bad_groups(self):
+        self.assertRaises(ValueError, RliehPWMGroup, [])
+        self.assertRaises(ValueError, RliehPWMGroup, [18, 18])
+        self.assertRaises(ValueError, RliehPWMGroup,
+                          [3, 5, 7, 8, 10, 11, 12, 13, 15])
+        group = RliehPWMGroup([18], writer=MemoryWriter())
+        self.assertRaises(ValueError, setattr, group, 'frame', [1, 2])
+        self.assertRaises(ValueError, setattr, group, 'frame', {23: 1})
+
+
+class TestFixture(unittest.TestCase):
+    '''Perfom test on Fixture color fades.'''
+
+    def setUp(self):
+        self.writes = []
+        writer = MemoryWriter()
+        writer._write = self.writes.append
+        self.clock = SimulatedClock()
+        self.bar = Fixture({'red': 16, 'green': 18, 'blue': 22,
+                            'white': 24}, writer=writer, clock=self.clock,
+                           sleeper=self.clock.sleep)
+
+    def test_set(self):
+        self.bar.set((0, 100, 100), space='hsv')
+        self.assertEqual(self.writes, ['16=1.0\n18=0.0\n22=0.0\n24=0.0\n'])
+        # unsaturated colors go to the white channel
+        self.bar.set((0, 0, 50), space='hsv')
+        self.assertEqual(self.bar.color,
+                         {'red': 0, 'green': 0, 'blue': 0, 'white': 50})
+        self.bar.set({'blue': 10})
+        self.assertEqual(self.bar.group.frame, [0, 0, 10, 50])
+        self.bar.set((6500, 100), space='kelvin')
+        self.assertGreater(self.bar.color['white'], 95)
+
+    def test_unknown_values(self):
+        # channels never written count as 0
+        bar = Fixture({'red': 16, 'green': 18, 'blue': 22, 'uv': 23},
+                      writer=MemoryWriter())
+        bar.set({'red': 50})
+        self.assertEqual(bar.group.writer.lines,
+                         ['16=0.5', '18=0.0', '22=0.0', '23=0.0'])
+        bar = Fixture({'red': 16, 'green': 18, 'blue': 22, 'uv': 23},
+                      writer=MemoryWriter())
+        bar.set((0, 100, 100), space='hsv')
+        self.assertEqual(bar.group.writer.lines,
+                         ['16=1.0', '18=0.0', '22=0.0', '23=0.0'])
+        self.assertRaises(ValueError, bar.set, (float('nan'), 0, 0, 0))
+
+    def test_out_of_range_colors(self):
+        # rejected, not clipped
+        for color, space in [((120, 0, 0, 0), 'rgb'), ({'red': -1}, 'rgb'),
+                             ((30, 150, 50), 'hsv'), ((30, 100, 101), 'hsv'),
+                             ((2700, 120), 'kelvin'), ((0, 50), 'kelvin')]:
+            self.assertRaises(ValueError, self.bar.set, color, space)
+            self.assertRaises(ValueError, self.bar.frames, color, color, 1,
+                              space)
+        self.assertEqual(self.writes, [])
+
+    def test_fade_in_sync(self):
+        timeline = self.bar.frames((0, 0, 0, 0), (100, 50, 0, 10), 0.5)
+        # one write per kept tick, for every changed channel
+        self.assertEqual(len(timeline), 1001)
+        self.assertEqual(timeline[500], (15., [50., 25., 0., 5.]))
+        report = self.bar.fade((0, 0, 0, 0), (100, 50, 0, 10), 0.5)
+        self.assertEqual(report.writes, len(timeline))
+        self.assertEqual(len(self.writes), len(timeline))
+        self.assertEqual(self.bar.group.frame, [100, 50, 0, 10])
+
+    def test_hue_shortest_way(self):
+        timeline = self.bar.frames((350, 100, 100), (10, 100, 100), 1,
+                                   space='hsv')
+        blues = [frame[2] for _offset, frame in timeline]
+        greens = [frame[1] for _offset, frame in timeline]
+        self.assertTrue(allclose(max(blues + greens), 100 / 6.))
+        self.assertEqual(min(frame[0] for _offset, frame in timeline), 100)
+
+    def test_bad_colors(self):
+        self.assertRaises(ValueError, self.bar.set, (1, 2, 3))
+        self.assertRaises(ValueError, self.bar.set, (1, 2), space='hsv')
+        self.assertRaises(ValueError, self.bar.set, (1, 2), space='xyz')
+        self.assertRaises(ValueError, self.bar.set, {'uv': 1})
+        self.assertRaises(ValueError, self.bar.frames, None, (2700, 50), 1,
+                          space='kelvin')
+        self.assertRaises(ValueError, Fixture, [('red', 16), ('red', 18)])
+        uv = Fixture({'uv': 12}, writer=MemoryWriter())
+        self.assertRaises(ValueError, uv.set, (0, 0, 0), space='hsv')
+
+
+class TestPlanTransition(unittest.TestCase):
+    '''Perfom test on core.plan_transition().'''
+
+    def test_plan_transition__long(self):
+        # 10 hardware levels, 10 minutes: every level, 1 minute each
+        actual = plan_transition(10, 11, 600)
+        self.assertEqual([offset for offset, _ in actual],
+                         [i * 60. for i in range(11)])
+        self.assertTrue(allclose([value for _, value in actual],
+                                 [10 + i / 10. for i in range(11)]))
+
+    def test_plan_transition__short(self):
+        # 1000 levels, 1 second at 100Hz: 100 ticks, distinct levels
+        actual = plan_transition(100, 0, 1)
+        values = [value for _, value in actual]
+        self.assertEqual(len(actual), 101)
+        self.assertEqual(len(set(values)), 101)
+        self.assertEqual(values[0], 100)
+        self.assertEqual(values[-1], 0)
+        offsets = [offset for offset, _ in actual]
+        self.assertTrue(min(b - a for a, b in zip(offsets, offsets[1:])) >=
+                        0.01 - 1e-9)
+
+    def test_plan_transition__same_level(self):
+        self.assertEqual(list(plan_transition(10, 10.01, 60)), [(0., 10.01)])
+
+
+class TestTransition(unittest.TestCase):
+    '''Perfom test on core.Transition.'''
+
+    def setUp(self):
+        self.up = Transition.from_pairs([(0, 0), (1, 10), (2, 20)], 3)
+
+    def test_transition__lazy(self):
+        transition = plan_transition(0, 100, 12 * 3600.)
+        self.assertEqual(len(transition), 1001)
+        self.assertEqual(transition[-1], (12 * 3600., 100))
+        self.assertEqual(next(iter(transition)), (0., 0))
+
+    def test_transition__chain(self):
+        actual = list(self.up + Transition.hold(5, 2) + self.up)
+        self.assertEqual(actual, [(0, 0), (1, 10), (2, 20), (3, 5),
+                                  (5, 0), (6, 10), (7, 20)])
+        self.assertEqual((self.up + self.up).duration, 6)
+
+    def test_transition__reversed(self):
+        actual = reversed(self.up)
+        self.assertEqual(list(actual), [(0, 20), (1, 10), (2, 0)])
+        self.assertEqual(actual.duration, 3)
+
+    def test_transition__slice(self):
+        actual = self.up[1:]
+        self.assertEqual(list(actual), [(0, 10), (1, 20)])
+        self.assertEqual(actual.duration, 2)
+        self.assertEqual(self.up[:1].duration, 1)
+        self.assertRaises(ValueError, self.up.__getitem__, slice(None, None, -1))
+
+    def test_transition__after(self):
+        actual = self.up.after(1.5)
+        self.assertEqual(list(actual), [(0, 10), (0.5, 20)])
+        self.assertEqual(actual.duration, 1.5)
+        self.assertEqual(list(self.up.after(5)), [(0, 20)])
+        self.assertEqual(self.up.after(5).duration, 0)
+
+
+class TestStorm(unittest.TestCase):
+    '''Perfom test on the fx-storm lightning timelines.'''
+
+    def test_seeded(self):
+        storm = list(storm_timeline(600, 5, seed=42))
+        self.assertEqual(list(storm_timeline(600, 5, seed=42)), storm)
+        self.assertNotEqual(list(storm_timeline(600, 5, seed=43)), storm)
+        offsets, levels = flashes(600, seed=42)
+        self.assertEqual(levels.dtype.itemsize, 4)
+        self.assertEqual(len(offsets), len(levels))
+
+    def test_overlay(self):
+        storm = storm_timeline(600, 10, seed=1, strikes=20)
+        offsets = [offset for offset, _value in storm]
+        values = [value for _offset, value in storm]
+        self.assertGreater(len(storm), 100)
+        self.assertEqual(min(values), 10)
+        self.assertEqual(values[-1], 10)
+        self.assertEqual(storm.duration, 600)
+        # one pi-blaster period between writes at least
+        self.assertGreater(min(b - a for a, b in zip(offsets, offsets[1:])),
+                           .0099)
+
+    def test_running_ambient(self):
+        dawn = plan_transition(0, 20, 120)
+        storm = storm_timeline(60, dawn, seed=5, strikes=30)
+        self.assertEqual(storm.duration, 120)
+        self.assertEqual(storm[-1], (120, 20))
+        self.assertEqual([pair for pair in storm if pair[0] >= 60],
+                         [pair for pair in dawn if pair[0] >= 60])
+
+    def test_play(self):
+        clock = SimulatedClock()
+        mytest = RliehPWM(pin=18, writer=MemoryWriter(), clock=clock,
+                          sleeper=clock.sleep)
+        mytest.pwm = 20
+        report = mytest.storm(1, seed=3, strikes=30)
+        self.assertEqual(report.skipped, 0)
+        self.assertGreater(report.writes, 10)
+        self.assertEqual(clock(), 60)
+        self.assertEqual(mytest.pwm, 20)
+        self.assertEqual(mytest.writer.lines[-1], '18=0.2')
+        self.assertRaises(ValueError, mytest.storm, 1, strikes=0)
+        self.assertRaises(ValueError, mytest.storm, 1, ambient=120)
+
+    def test_daemon_storm(self):
+        writer = MemoryWriter()
+        controller = Controller(writer=writer)
+
+        async def run():
+            replies = [await controller.execute(line) for line in [
+                'range 0 20 18 0.02', 'fx-storm 18 0.015 1 600',
+                'fx-storm 18 x']]
+            await controller.wait()
+            return replies
+
+        replies = asyncio.run(run())
+        self.assertEqual(replies[:2], ['ok', 'ok'])
+        self.assertTrue(replies[2].startswith('error'))
+        # flashes, then the range goes on
+        self.assertGreater(max(float(line.split('=')[1])
+                               for line in writer.lines), .2)
+        self.assertEqual(writer.lines[-1], '18=0.2')
+        self.assertEqual(controller.timelines, {})
+
+
+class TestTransitionTable(unittest.TestCase):
+    '''Perfom test on curves.transition_table().'''
+
+    def test_transition_table__curves(self):
+        for curve in ['linear', 'gamma', 'log', 'smoothstep', 'ease-in',
+                      'ease-out', 'ease-in-out', [(0, 0), (0.5, 0.8), (1, 1)]]:
+            up = transition_table(20, 80, 101, curve)
+            down = transition_table(80, 20, 101, curve)
+            self.assertEqual((up[0], up[-1]), (20, 80))
+            self.assertEqual((down[0], down[-1]), (80, 20))
+            self.assertTrue((up[1:] >= up[:-1]).all())
+            self.assertTrue((down[1:] <= down[:-1]).all())
+
+    def test_transition_table__cached(self):
+        first = transition_table(0, 100, 1000, 'gamma')
+        hits = transition_table.cache_info().hits
+        self.assertIs(transition_table(0, 100, 1000, 'gamma'), first)
+        self.assertEqual(transition_table.cache_info().hits, hits + 1)
+        self.assertFalse(first.flags.writeable)
+
+    def test_transition_table__valueerror(self):
+        self.assertRaises(ValueError, transition_table, 0, 1, 10, 'cubic')
+        self.assertRaises(ValueError, transition_table, 0, 1, 10,
+                          [(0.2, 0), (1, 1)])
+        self.assertRaises(ValueError, transition_table, 0, 1, 1)
+
+    def test_plan_transition__curve(self):
+        actual = plan_transition(0, 100, 1800, curve='log')
+        levels = [value for _, value in actual]
+        self.assertEqual(len(set(levels)), len(levels))
+        self.assertEqual(levels[-1], 100)
+        # perceptual curve: first tenth of the levels takes longer
+        self.assertTrue(actual[100][0] > 180)
+
+
+class TestEnvelope(unittest.TestCase):
+    '''Perfom test on core.Envelope.'''
+
+    def test_envelope__noon(self):
+        transition = ENVELOPES['noon'].compile(3600)
+        self.assertEqual(transition.duration, 3600)
+        offsets = [offset for offset, _ in transition]
+        values = [value for _, value in transition]
+        # one time base, no duplicated writes at segment joins
+        self.assertEqual(offsets, sorted(offsets))
+        self.assertTrue(all(a != b for a, b in zip(values, values[1:])))
+        self.assertEqual(transition[0], (0, 75))
+        self.assertEqual(transition[-1], (3600, 75))
+        self.assertIn((900, 99), transition)
+        self.assertIn((1800, 100), transition)
+
+    def test_envelope__begin(self):
+        envelope = Envelope([(0, None), (0.5, 50), (1, 50)])
+        self.assertRaises(ValueError, envelope.compile, 10)
+        transition = envelope.compile(10, begin=49.9)
+        self.assertEqual(list(transition), [(0, 49.9), (5, 50)])
+        self.assertEqual(transition.duration, 10)
+
+    def test_envelope__valueerror(self):
+        self.assertRaises(ValueError, Envelope, [(0, 10)])
+        self.assertRaises(ValueError, Envelope, [(0, 10), (0.5, 20)])
+        self.assertRaises(ValueError, Envelope, [(0, 10), (1, 101)])
+        self.assertRaises(ValueError, Envelope, [(0, 10), (1, None)])
+
+    def test_play(self):
+        writer = MemoryWriter()
+        mytest = RliehPWM(writer=writer)
+        report = mytest.play(ENVELOPES['noon'], 0.001)
+        self.assertEqual(writer.lines[0], '18=0.75')
+        self.assertEqual(writer.lines[-1], '18=0.75')
+        self.assertIn('18=1.0', writer.lines)
+        self.assertFalse(report.cancelled)
+
+
+class FakeClock(object):
+    '''clock whose time only moves on sleep or when told to.'''
+
+    def __init__(self):
+        self.now = 0.
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, delay):
+        self.now += delay
+
+
+class TestSchedule(unittest.TestCase):
+    '''Perfom test on core.schedule().'''
+
+    def test_schedule_on_time(self):
+        clock = FakeClock()
+        applied = []
+        timeline = [(i * 0.5, i) for i in range(10)]
+        report = schedule(timeline, applied.append, end=5,
+                          clock=clock, sleeper=clock.sleep)
+        self.assertEqual(applied, list(range(10)))
+        self.assertEqual(clock.now, 5)
+        self.assertEqual(report.skipped, 0)
+        self.assertEqual(report.max_lateness, 0)
+
+    def test_schedule_slow_writes_are_merged(self):
+        clock = FakeClock()
+        applied = []
+
+        def slow_apply(value):
+            applied.append(value)
+            clock.now += 1.2
+
+        timeline = [(i * 0.5, i) for i in range(10)]
+        report = schedule(timeline, slow_apply, end=5,
+                          clock=clock, sleeper=clock.sleep)
+        # last value is always written, total duration is kept
+        self.assertEqual(applied[-1], 9)
+        self.assertEqual(report.writes + report.skipped, 10)
+        self.assertTrue(report.skipped > 0)
+        self.assertTrue(report.max_lateness > 0)
+        self.assertTrue(clock.now <= 5 + 1.2)
+
+    def test_modulate_duration(self):
+        writer = MemoryWriter()
+        mytest = RliehPWM(writer=writer)
+        report = mytest.modulate(10, 11, 0.001)
+        self.assertEqual(writer.lines[-1], '18=0.11')
+        # 0.06 seconds at 100Hz: 6 ticks
+        self.assertEqual(report.writes + report.skipped, 7)
+
+    def test_modulate_async_concurrent_pins(self):
+        writer = MemoryWriter()
+        lights = [RliehPWM(pin=pin, writer=writer) for pin in (16, 18)]
+
+        async def run():
+            return await asyncio.gather(
+                lights[0].modulate_async(0, 1, 0.001),
+                lights[1].modulate_async(2, 1, 0.001))
+
+        reports = asyncio.run(run())
+        self.assertEqual([r.writes + r.skipped for r in reports], [7, 7])
+        self.assertEqual(lights[0].pwm, 1)
+        self.assertEqual(lights[1].pwm, 1)
+        self.assertEqual(len(writer.lines), sum(r.writes for r in reports))
+
+    def test_modulate_cancel(self):
+        mytest = RliehPWM(writer=MemoryWriter())
+        reports = []
+        thread = threading.Thread(
+            target=lambda: reports.append(mytest.modulate(0, 100, 0.05)))
+        thread.start()
+        threading.Event().wait(0.05)
+        mytest.cancel()
+        thread.join(1)
+        self.assertFalse(thread.is_alive())
+        self.assertTrue(reports[0].cancelled)
+        self.assertTrue(0 < mytest.pwm < 100)
+
+    def test_modulate_from_current_value(self):
+        writer = MemoryWriter()
+        mytest = RliehPWM(writer=writer)
+        self.assertRaises(ValueError, mytest.modulate, None, 10, 0.001)
+        mytest.pwm = 5
+        mytest.modulate(None, 6, 0.001)
+        self.assertEqual(writer.lines[1], '18=0.05')
+        self.assertEqual(mytest.pwm, 6)
+
+
+class TestMetrics(unittest.TestCase):
+    '''Perfom test on pins metrics.'''
+
+    def test_write_counters(self):
+        metrics = Metrics()
+        mytest = RliehPWM(writer=MemoryWriter(), metrics=metrics)
+        mytest.pwm = 10
+        mytest.pwm = 20
+        failing = RliehPWM(pin=23, metrics=metrics,
+                           writer=DeviceWriter('/nonexistent/pi-blaster'))
+        self.assertRaises(SystemExit, setattr, failing, 'pwm', 10)
+        self.assertEqual(metrics.pin(18).writes, 2)
+        self.assertEqual(metrics.pin(18).latency.count, 2)
+        self.assertEqual(metrics.pin(23).writes, 0)
+        self.assertEqual(metrics.pin(23).failed, 1)
+
+    def test_schedule_lateness(self):
+        clock = SimulatedClock()
+        metrics = Metrics()
+        group = RliehPWMGroup([16, 18], writer=MemoryWriter(),
+                              metrics=metrics, clock=clock,
+                              sleeper=lambda delay: clock.sleep(delay + .1))
+        report = group.modulate([0, 0], [100, 50], 1)
+        for pin in (16, 18):
+            self.assertEqual(metrics.pin(pin).skipped, report.skipped)
+            self.assertEqual(metrics.pin(pin).lateness.count, report.writes)
+        self.assertGreater(report.skipped, 0)
+        self.assertEqual(metrics.pin(16).writes, report.writes)
+
+    def test_exports(self):
+        metrics = Metrics()
+        controller = Controller(writer=MemoryWriter(), metrics=metrics,
+                                log_path='/tmp')
+        reply = asyncio.run(controller.execute('set 50 18'))
+        reply = asyncio.run(controller.execute('metrics'))
+        self.assertTrue(reply.startswith('ok '))
+        snapshot = json.loads(reply[3:])
+        self.assertEqual(snapshot['18']['writes'], 1)
+        self.assertEqual(snapshot['18']['lateness_seconds']['count'], 0)
+        self.assertEqual(
+            snapshot['18']['write_latency_seconds']['buckets'][-1],
+            ['+Inf', 1])
+        fd, path = tempfile.mkstemp(suffix='.prom')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        metrics.write_textfile(path)
+        with open(path) as f:
+            lines = f.read().splitlines()
+        self.assertIn('rlieh_pwm_writes_total{pin="18"} 1', lines)
+        self.assertIn('rlieh_pwm_write_latency_seconds_bucket'
+                      '{pin="18",le="+Inf"} 1', lines)
+        self.assertIn('# TYPE rlieh_pwm_lateness_seconds histogram', lines)
+
+
+class TestDaemon(unittest.TestCase):
+    '''Perfom test on the rlieh-pwm daemon.'''
+
+    def setUp(self):
+        self.writer = MemoryWriter()
+        self.controller = Controller(writer=self.writer)
+
+    def test_execute(self):
+        async def run():
+            replies = [await self.controller.execute(line) for line in [
+                'set 42.42 18', 'get 18', 'on 16', 'off 16', 'jump 18',
+                'set 101 18', 'set 18', 'range 0 1 18 0.001',
+                'fx-light noon 16 0.001', 'fx-light storm 16']]
+            await self.controller.wait()
+            return replies
+
+        replies = asyncio.run(run())
+        self.assertEqual(replies[:4], ['ok', 'ok 42.42', 'ok', 'ok'])
+        for reply in replies[4:7]:
+            self.assertTrue(reply.startswith('error'))
+        self.assertEqual(replies[7:9], ['ok', 'ok'])
+        self.assertTrue(replies[9].startswith('error'))
+        self.assertEqual(self.controller.channel(18).pwm, 1)
+        self.assertEqual(self.controller.channel(16).pwm, 75)
+
+    def test_preemption(self):
+        async def run():
+            channel = self.controller.channel(18)
+            await self.controller.execute('range 0 100 18 0.05')
+            await asyncio.sleep(0.1)
+            live = channel.pwm
+            handoff = len(self.writer.lines)
+            reply = await self.controller.execute('range 0 50 18 0.001')
+            self.assertEqual(reply, 'ok')
+            await self.controller.wait()
+            self.assertEqual(channel.pwm, 50)
+            # hand off: no jump back to 0
+            self.assertEqual(self.writer.lines[handoff],
+                             '18={}'.format(round(live / 100., 4)))
+            await self.controller.execute('range 50 100 18 10')
+            await asyncio.sleep(0.05)
+            await self.controller.execute('off 18')
+            await asyncio.sleep(0.05)
+            self.assertEqual(self.writer.lines[-1], '18=0.0')
+            self.assertEqual(self.controller.tasks, {})
+            return live
+
+        self.assertTrue(0 < asyncio.run(run()) < 100)
+
+    def test_unix_socket(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'pwm.sock')
+
+        async def run():
+            server = await serve(self.controller, path)
+            loop = asyncio.get_running_loop()
+            async with server:
+                return await loop.run_in_executor(None, send, 'on 18', path)
+
+        self.assertEqual(asyncio.run(run()), 'ok')
+        self.assertEqual(self.writer.lines, ['18=1.0'])
+
+    def test_no_reply(self):
+        # the daemon got the command: it is not run again by the CLI
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'pwm.sock')
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(path)
+        listener.listen(1)
+        received = []
+
+        def accept():
+            connection, _address = listener.accept()
+            with connection:
+                received.append(connection.makefile('rb').readline())
+        thread = threading.Thread(target=accept)
+        thread.start()
+        with self.assertRaises(SystemExit) as raised:
+            cli.main(['set', '42', '18', '--socket={}'.format(path)])
+        thread.join()
+        listener.close()
+        self.assertEqual(received, [b'set 42 18\n'])
+        self.assertIn('did not reply', str(raised.exception))
+
+
+class TimedWriter(MemoryWriter):
+    '''MemoryWriter keeping the wall clock time of its writes.'''
+
+    def __init__(self):
+        super().__init__()
+        self.times = []
+
+    def _write(self, data):
+        self.times.append(wall_time())
+        super()._write(data)
+
+
+class TestRemote(unittest.TestCase):
+    '''Perfom test on rlieh-pwm listeners, several nodes on localhost.'''
+
+    NODES = 3
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        thread.start()
+        self.writers = [TimedWriter() for _index in range(self.NODES)]
+        self.controllers = [Controller(writer=writer)
+                            for writer in self.writers]
+        self.servers = [self.call(remote.serve(controller, '127.0.0.1:0'))
+                        for controller in self.controllers]
+        self.addresses = ['127.0.0.1:{}'.format(
+            server.sockets[0].getsockname()[1]) for server in self.servers]
+
+        async def shutdown():
+            for server in self.servers:
+                server.close()
+            tasks = asyncio.all_tasks() - {asyncio.current_task()}
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        def stop():
+            self.call(shutdown())
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            thread.join()
+            self.loop.close()
+        self.addCleanup(stop)
+
+    def call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def test_pipelining(self):
+        writes = []
+        self.writers[0]._write = writes.append
+        with Node(self.addresses[0]) as node:
+            replies = node.send(['set 10 18', 'get 18', 'frame 16=50 18=20',
+                                 'frame 16=x', 'jump'])
+            self.assertEqual(replies[:3], ['ok', 'ok 10.0', 'ok'])
+            self.assertTrue(replies[3].startswith('error'))
+            self.assertTrue(replies[4].startswith('error'))
+            # replies of long pipelines are read while sending
+            self.assertEqual(len(node.send(['get 16'] * 5000)), 5000)
+        self.assertEqual(writes, ['18=0.1\n', '16=0.5\n18=0.2\n'])
+
+    def test_synchronized_start(self):
+        with Fleet(self.addresses) as fleet:
+            replies = fleet.start(['on 18', 'frame 16=10 22=20'], delay=.2)
+            self.assertEqual(replies, dict(
+                (address, ['ok', 'ok']) for address in self.addresses))
+            self.assertEqual(self.writers[0].lines, [])
+            sleep(.4)
+        for writer in self.writers:
+            self.assertEqual(writer.lines, ['18=1.0', '16=0.1', '22=0.2'])
+        starts = [writer.times[0] for writer in self.writers]
+        self.assertLess(max(starts) - min(starts), .05)
+
+    def test_unreachable_node(self):
+        self.servers[1].close()
+        self.call(self.servers[1].wait_closed())
+        with Fleet(self.addresses, timeout=1.) as fleet:
+            replies = fleet.send(['on 18', 'get 18'])
+        self.assertEqual(replies[self.addresses[0]], ['ok', 'ok 100.0'])
+        self.assertTrue(all(reply.startswith('error')
+                            for reply in replies[self.addresses[1]]))
+        self.assertEqual(self.writers[2].lines, ['18=1.0'])
+
+    def test_at(self):
+        async def run():
+            controller = self.controllers[0]
+            replies = [await controller.execute(line) for line in [
+                'at {} on 18'.format(wall_time() + .01), 'at 0 jump 18',
+                'at x on 18', 'at 0']]
+            await controller.wait()
+            return replies
+
+        replies = self.call(run())
+        self.assertEqual(replies[0], 'ok')
+        self.assertTrue(all(reply.startswith('error')
+                            for reply in replies[1:]))
+        self.assertEqual(self.writers[0].lines, ['18=1.0'])
+
+
+class TestState(unittest.TestCase):
+    '''Perfom test on the shared state table.'''
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'rlieh', 'pwm.state')
+
+    def test_update_and_read(self):
+        with StateTable(self.path) as table, \
+                StateTable(self.path, writable=False) as reader:
+            self.assertIsNone(reader.read(18))
+            table.update(18, 42.42)
+            table.update(23, 10, target=80, end=1234.5)
+            self.assertEqual(reader.read(18), PinState(42.42, None, None, 2))
+            self.assertEqual(reader.read(23), PinState(10, 80, 1234.5, 2))
+            table.update(18, 0)
+            self.assertEqual(reader.read(18).sequence, 4)
+            self.assertEqual(sorted(reader.snapshot()), [18, 23])
+            # a record caught during an update is retried
+            table._map[16:24] = (5).to_bytes(8, 'little')
+            self.assertRaises(RuntimeError, reader.read, 0, retries=10)
+            self.assertRaises(ValueError, table.update, 41, 0)
+
+    def test_transition_state(self):
+        clock = SimulatedClock()
+        states = []
+        with StateTable(self.path) as table:
+            def sleeper(delay):
+                clock.sleep(delay)
+                states.append(table.read(18))
+            mytest = RliehPWM(writer=MemoryWriter(), state=table,
+                              clock=clock, sleeper=sleeper)
+            mytest.modulate(20, 60, 1)
+            self.assertEqual(states[0].value, 20)
+            self.assertEqual(states[0].target, 60)
+            self.assertGreater(states[0].end, 0)
+            self.assertEqual(table.read(18).value, 60)
+            self.assertIsNone(table.read(18).target)
+
+    def test_status_cli(self):
+        with StateTable(self.path) as table:
+            table.update(18, 42.0)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            cli.main(['status', '--state={}'.format(self.path)])
+            cli.main(['status', '23', '--state={}'.format(self.path)])
+        self.assertEqual(output.getvalue(), '18 42.0 - -\n23 - - -\n')
+
+    def test_stored_value(self):
+        self.assertIsNone(cli.stored_value(None, 18))
+        with StateTable(self.path) as table:
+            self.assertIsNone(cli.stored_value(table, 18))
+            table.update(18, 42.0, target=80, end=1234.5)
+            self.assertEqual(cli.stored_value(table, '18'), 42.0)
+
+
+class TestLocks(unittest.TestCase):
+    '''Perfom test on pin arbitration between processes.'''
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        self.writer = MemoryWriter()
+
+    def pwm(self, policy, timeout=None):
+        locks = PinLocks(self.path, policy, timeout)
+        self.addCleanup(locks.lock(18).close)
+        return RliehPWM(writer=self.writer, locks=locks)
+
+    def test_uncontended(self):
+        first = self.pwm('reject')
+        first.pwm = 10
+        self.assertFalse(first.lock.held)
+        second = self.pwm('reject')
+        second.pwm = 20
+        second.modulate(20, 21, 0)
+        self.assertEqual(self.writer.lines[-1], '18=0.21')
+        self.assertRaises(ValueError, PinLocks, self.path, 'newest')
+
+    def test_reject_and_timeout(self):
+        owner = self.pwm('preempt')
+        owner.lock.acquire()
+        self.assertRaises(RuntimeError, setattr, self.pwm('reject'), 'pwm', 1)
+        self.assertRaises(RuntimeError, setattr, self.pwm('queue', .02),
+                          'pwm', 1)
+        self.assertEqual(self.writer.lines, [])
+
+    def test_queue(self):
+        owner = self.pwm('preempt')
+        owner.lock.acquire()
+        queued = self.pwm('queue')
+        thread = threading.Thread(target=setattr, args=(queued, 'pwm', 50))
+        thread.start()
+        thread.join(.05)
+        self.assertTrue(thread.is_alive())
+        owner.lock.release()
+        thread.join(1)
+        self.assertEqual(self.writer.lines, ['18=0.5'])
+
+    def test_preempt(self):
+        owner = self.pwm('preempt')
+        reports = []
+        thread = threading.Thread(
+            target=lambda: reports.append(owner.modulate(0, 100, 0.1)))
+        thread.start()
+        while len(self.writer.lines) < 3:
+            thread.join(.01)
+        newest = self.pwm('preempt')
+        newest.pwm = 42
+        thread.join(1)
+        self.assertFalse(thread.is_alive())
+        self.assertTrue(reports[0].cancelled)
+        # the preempted modulation never writes again
+        self.assertEqual(self.writer.lines[-1], '18=0.42')
+        self.assertFalse(owner.lock.held)
+
+    def test_async_queue(self):
+        owner = self.pwm('preempt')
+        owner.lock.acquire()
+        queued = self.pwm('queue')
+        threading.Timer(.1, owner.lock.release).start()
+        ticks = []
+
+        async def ticker():
+            while True:
+                ticks.append(perf_counter())
+                await asyncio.sleep(.01)
+
+        async def run():
+            ticking = asyncio.ensure_future(ticker())
+            report = await queued.modulate_async(0, 1, 0)
+            ticking.cancel()
+            return report
+
+        report = asyncio.run(run())
+        self.assertFalse(report.cancelled)
+        self.assertEqual(self.writer.lines[-1], '18=0.01')
+        # the event loop kept running while waiting for the lock
+        self.assertLess(max(b - a for a, b in zip(ticks, ticks[1:])), .05)
+        self.assertFalse(queued.lock.held)
+
+    def test_async_preempted(self):
+        owner = self.pwm('preempt')
+
+        async def run():
+            playing = asyncio.ensure_future(owner.modulate_async(0, 100, .1))
+            while len(self.writer.lines) < 3:
+                await asyncio.sleep(.01)
+            # the preempting process waits for the owner to let go
+            newest = self.pwm('preempt')
+            await asyncio.get_running_loop().run_in_executor(
+                None, setattr, newest, 'pwm', 42)
+            return await playing
+
+        self.assertTrue(asyncio.run(run()).cancelled)
+        self.assertEqual(self.writer.lines[-1], '18=0.42')
+        self.assertFalse(owner.lock.held)
+
+    def run_program(self, duration):
+        '''run a 0 to 100 program on pins 16 and 18 in a thread.'''
+        program = Program.from_dict(dict(
+            (pin, [{'at': '00:00', 'range': [0, 100], 'duration': 1}])
+            for pin in ('16', '18')))
+        locks = PinLocks(self.path, 'preempt')
+        self.addCleanup(lambda: [lock.close()
+                                 for lock in locks.locks.values()])
+        thread = threading.Thread(target=program.run, kwargs=dict(
+            start=0, duration=duration, writer=self.writer, locks=locks))
+        thread.start()
+        while len(self.writer.lines) < 4:
+            thread.join(.01)
+        return thread
+
+    def test_program_preempted(self):
+        thread = self.run_program(.5)
+        newest = self.pwm('preempt')
+        newest.pwm = 42
+        written = len(self.writer.lines)
+        thread.join(1)
+        self.assertFalse(thread.is_alive())
+        # the program leaves the preempted pin, and drives the other one
+        lines = self.writer.lines[written:]
+        self.assertNotIn('18', [line.split('=')[0] for line in lines])
+        self.assertIn('16', [line.split('=')[0] for line in lines])
+        self.assertIn('18=0.42', self.writer.lines)
+
+    def test_program_queue_and_reject(self):
+        thread = self.run_program(.3)
+        self.assertRaises(RuntimeError, setattr, self.pwm('reject'), 'pwm', 1)
+        queued = self.pwm('queue')
+        waiting = threading.Thread(target=setattr, args=(queued, 'pwm', 50))
+        waiting.start()
+        waiting.join(.05)
+        self.assertTrue(waiting.is_alive())
+        thread.join(1)
+        waiting.join(1)
+        self.assertEqual(self.writer.lines[-1], '18=0.5')
+
+
+class TestBatch(unittest.TestCase):
+    '''Perfom test on batch commands.'''
+
+    def test_same_tick_frame(self):
+        pins = [12, 16, 18, 22, 24]
+        commands = ''.join('set {} {}\n'.format(value, pins[value % 5])
+                           for value in range(100))
+        writer = RecordingWriter()
+        failed = batch.run(io.StringIO(commands), writer=writer,
+                           log_path='/tmp')
+        self.assertEqual(failed, 0)
+        # commands read at once are written in a single frame
+        self.assertLessEqual(writer.frames, 3)
+        last = dict((pin, value) for _time, pin, value in writer.writes)
+        self.assertEqual(last, {12: 0.95, 16: 0.96, 18: 0.97, 22: 0.98,
+                                24: 0.99})
+
+    def test_sequential_transitions(self):
+        # the second range starts once the first one is over
+        commands = ('range 0 10 23 0.008\n'
+                    'range 0 10 18 0.005\n'
+                    'range 10 20 18 0.005\n')
+        writer = RecordingWriter()
+        start = perf_counter()
+        failed = batch.run(io.StringIO(commands), writer=writer,
+                           log_path='/tmp')
+        self.assertEqual(failed, 0)
+        self.assertGreaterEqual(perf_counter() - start, .6)
+        values = [value for _time, pin, value in writer.writes if pin == 18]
+        self.assertEqual(values, sorted(values))
+        self.assertEqual(values[0], 0.0)
+        self.assertEqual(values[-1], 0.2)
+        self.assertIn(0.1, values)
+        # the transitions of other pins go on meanwhile
+        times = dict(((pin, value), time)
+                     for time, pin, value in writer.writes)
+        self.assertLess(times[18, 0.1], times[23, 0.1])
+        self.assertLess(times[23, 0.1], times[18, 0.2])
+
+    def test_metrics_count_frames(self):
+        metrics = Metrics()
+        writer = RecordingWriter()
+        commands = ''.join('set {} 18\n'.format(value) for value in range(10))
+        failed = batch.run(io.StringIO(commands), writer=writer,
+                           metrics=metrics, log_path='/tmp')
+        self.assertEqual(failed, 0)
+        self.assertEqual(metrics.pin(18).writes, writer.frames)
+        self.assertEqual(metrics.pin(18).latency.count, writer.frames)
+        self.assertEqual(metrics.pin(18).writes + metrics.pin(18).dropped,
+                         10)
+
+    def test_replies_and_transitions(self):
+        commands = ('# comment\n'
+                    'set 42 18\n'
+                    'bogus 18\n'
+                    'get 18  # current value\n'
+                    'range 0 100 23 0.001\n')
+        writer = MemoryWriter()
+        output, errors = io.StringIO(), io.StringIO()
+        failed = batch.run(io.StringIO(commands), writer=writer,
+                           output=output, errors=errors, log_path='/tmp')
+        self.assertEqual(failed, 1)
+        self.assertEqual(output.getvalue(), '42.0\n')
+        self.assertEqual(errors.getvalue(),
+                         'line 3: error unknown command "bogus"\n')
+        self.assertEqual(writer.lines[0], '18=0.42')
+        self.assertEqual(writer.lines[-1], '23=1.0')
+
+
+class TestProgram(unittest.TestCase):
+    '''Perfom test on program.Program.'''
+
+    def setUp(self):
+        self.program = Program.from_dict({
+            '18': [{'at': '07:00', 'fx': 'dawn', 'duration': 30},
+                   {'at': '12:00', 'fx': 'noon', 'duration': 60},
+                   {'at': '22:00', 'set': 0}],
+            '16': [{'at': '08:00', 'range': [None, 50], 'duration': 10},
+                   {'at': '20:00:30', 'set': 0}]})
+
+    def test_value(self):
+        self.assertEqual(self.program.value(18, 0), 0)
+        self.assertEqual(self.program.value(18, 7.25 * 3600), 10)
+        self.assertEqual(self.program.value(18, 12.5 * 3600), 100)
+        self.assertEqual(self.program.value(18, 21 * 3600), 75)
+        self.assertEqual(self.program.value(16, 9 * 3600), 50)
+        self.assertEqual(self.program.value(16, 20 * 3600 + 30), 0)
+        self.assertEqual(self.program.value(16, DAY + 9 * 3600), 50)
+
+    def test_run(self):
+        clock = FakeClock()
+        writer = MemoryWriter()
+        group = RliehPWMGroup(self.program.pins, writer=writer)
+        # joins the program mid-dawn, for one day
+        self.program.run(group, start=7.25 * 3600, duration=DAY,
+                         clock=clock, sleeper=clock.sleep)
+        self.assertEqual(clock.now, DAY)
+        self.assertEqual(writer.lines[:2], ['16=0.0', '18=0.1'])
+        # a day later, the last write was just before mid-dawn
+        self.assertTrue(allclose(group.frame, [0, 9.9]))
+        self.assertIn('18=1.0', writer.lines)
+        self.assertIn('16=0.5', writer.lines)
+
+    def test_bad_programs(self):
+        for entries in [[{'at': '25:00', 'set': 0}],
+                        [{'at': '07:00', 'fx': 'storm'}],
+                        [{'at': '07:00'}],
+                        [{'at': '07:00', 'fx': 'dawn', 'duration': 30},
+                         {'at': '07:10', 'set': 0}],
+                        [{'at': '23:50', 'fx': 'dawn', 'duration': 30}],
+                        []]:
+            self.assertRaises(ValueError, Program.from_dict, {'18': entries})
+
+
+class TestSimulation(unittest.TestCase):
+    '''Perfom test on simulated clock runs.'''
+
+    def test_simulated_modulate(self):
+        clock = SimulatedClock()
+        writer = RecordingWriter(clock)
+        mytest = RliehPWM(writer=writer, clock=clock, sleeper=clock.sleep)
+        report = mytest.modulate(0, 100, 720)
+        self.assertEqual(clock.now, 43200)
+        self.assertEqual(report.skipped, 0)
+        self.assertEqual(len(writer.writes), 1001)
+        self.assertEqual(writer.writes[500], (21600, 18, 0.5))
+
+    def test_simulated_ada_variation(self):
+        from .cli_ada import MyLeds
+        clock = SimulatedClock()
+        writer = RecordingWriter(clock)
+        mytest = MyLeds(18, writer=writer, clock=clock, sleeper=clock.sleep)
+        mytest.progressive_variation(10)
+        self.assertEqual(clock.now, 600)
+        self.assertEqual(len(writer.writes), 1001)
+
+    def test_simulated_range_from_unknown_value(self):
+        # no daemon and no state: a clean error, not a traceback
+        with self.assertRaises(SystemExit) as raised:
+            cli.main(['range', '-', '20', '18', '--simulate',
+                      '--log-path=/tmp'])
+        self.assertIn('BEGIN is needed', str(raised.exception))
+
+    def test_simulated_program_cli(self):
+        program = {'18': [{'at': '07:00', 'fx': 'dawn', 'duration': 30},
+                          {'at': '07:30', 'fx': 'sunrise', 'duration': 60},
+                          {'at': '12:00', 'fx': 'noon', 'duration': 60},
+                          {'at': '19:00', 'fx': 'sunset', 'duration': 60},
+                          {'at': '20:00', 'fx': 'dusk', 'duration': 30}],
+                   '16': [{'at': '08:00', 'range': [0, 50], 'duration': 600},
+                          {'at': '20:00', 'set': 0}]}
+        fd, path = tempfile.mkstemp(suffix='.json')
+        self.addCleanup(os.remove, path)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(program, f)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            cli.main(['run', path, '--simulate', '--log-path=/tmp'])
+        writes = [line.split() for line in output.getvalue().splitlines()]
+        # midnight value, then 200 + 550 + 500 + 550 + 200 levels on 18,
+        # midnight value, 500 levels and off on 16
+        self.assertEqual(len([w for w in writes if w[1] == '18']), 2001)
+        self.assertEqual(len([w for w in writes if w[1] == '16']), 502)
+        self.assertEqual(writes[-1][1:], ['18', '0.0'])
+        times = [float(w[0]) for w in writes]
+        self.assertEqual(times, sorted(times))
+
+
+class TestBench(unittest.TestCase):
+    '''Perfom test on benchmarks.'''
+
+    def test_percentiles(self):
+        summary = bench.percentiles(range(1, 101))
+        self.assertEqual(summary['p50'], 51)
+        self.assertEqual(summary['p99'], 100)
+        self.assertEqual(summary['max'], 100)
+        self.assertEqual(summary['mean'], 50.5)
+
+    def test_fifo_stand_in(self):
+        with bench.stand_in(fifo=True) as path:
+            with DeviceWriter(path) as writer:
+                writes = bench.bench_writes(writer, 100)
+                frames = bench.bench_frames(writer, 10)
+        self.assertEqual(writes['count'], 100)
+        self.assertEqual(frames['channels'], 8)
+        self.assertGreater(frames['per_second'], 0)
+        self.assertFalse(os.path.exists(path))
+
+    def test_sysfs(self):
+        writes = bench.bench_sysfs(100)
+        self.assertEqual(writes['count'], 100)
+        self.assertEqual(writes['device'], 'file')
+        self.assertGreater(writes['per_second'], 0)
+
+    def test_sysfs_path_cli(self):
+        fd, output = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        self.addCleanup(os.remove, output)
+        with bench.sysfs_stand_in() as path:
+            cli.main(['bench', '--quick', '--sysfs-path={}'.format(path),
+                      '--output={}'.format(output)])
+        with open(output) as f:
+            self.assertEqual(json.load(f)['sysfs']['device'], path)
+
+
+# allowed CLI start-up time over a bare interpreter start, in seconds
+STARTUP_BUDGET = 0.075
+
+
+class TestStartup(unittest.TestCase):
+    '''Perfom test on the CLI start-up work.'''
+
+    def python(self, code):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ, PYTHONPATH=root)
+        start = perf_counter()
+        output = subprocess.run([sys.executable, '-c', code], env=env,
+                                stdout=subprocess.PIPE, check=True).stdout
+        return perf_counter() - start, output.decode()
+
+    def test_lazy_imports(self):
+        _duration, output = self.python(
+            'import sys, rlieh_pwm.cli; print(" ".join(sys.modules))')
+        modules = set(output.split())
+        for name in ('asyncio', 'docopt', 'gettext', 'numpy', 'json',
+                     'logging.handlers', 'subprocess'):
+            self.assertNotIn(name, modules)
+
+    def test_fast_arguments(self):
+        arguments = cli.fast_arguments(['set', '42', '18', '--socket=/s'])
+        self.assertTrue(arguments['set'])
+        self.assertEqual(arguments['VALUE'], '42')
+        self.assertEqual(arguments['GPIO'], '18')
+        self.assertEqual(arguments['--socket'], '/s')
+        self.assertIsNone(arguments['--log-path'])
+        self.assertEqual(cli.daemon_command(arguments, 0.5), 'set 42 18')
+        self.assertEqual(cli.fast_arguments(['off', '18'])['GPIO'], '18')
+        for argv in (['set', '42'], ['on', '18', '23'], ['-v'],
+                     ['range', '0', '100', '18'], ['on', '18', '--simulate'],
+                     ['on', '18', '--socket=/a', '--socket=/b']):
+            self.assertIsNone(cli.fast_arguments(argv))
+
+    def test_cold_start_budget(self):
+        bare = min(self.python('pass')[0] for _i in range(3))
+        cold = min(self.python('import rlieh_pwm.cli')[0] for _i in range(3))
+        self.assertLess(cold - bare, STARTUP_BUDGET)
+
+
 if __name__ == "__main__":
     # bt = TestPWMAvgPauseTime()
     # bt.test__get_avg_pause_time()
@@ -53,10 +53,12 @@ setup(
         "Programming Language :: Python :: 3",
         "Topic :: Scientific/Engineering",
     ],
+    python_requires='>=3.7',
     entry_points={
         'console_scripts': ['rlieh-pwm=rlieh_pwm.cli:main'],
     },
     install_requires=[
           'docopt',
+          'numpy',
       ],
 )